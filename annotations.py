@@ -0,0 +1,135 @@
+import os
+import sys
+import json
+import argparse
+import numpy as np
+
+'''Append-only keypoint annotation storage (replaces the monolithic images/knots_info.json)
+
+Each frame's pixels are appended as int16 (u, v) pairs to keypoints.bin and a (frame, offset, count) int64 row is
+appended to keypoints.idx once the pixels are on disk, so a crash only loses the frame being written.
+Usage: python annotations.py to_json images  |  python annotations.py from_json images'''
+
+DATA_FILENAME = "keypoints.bin"
+INDEX_FILENAME = "keypoints.idx"
+LEGACY_FILENAME = "knots_info.json"
+
+class AnnotationWriter(object):
+    def __init__(self, dir, append=False):
+        # Opens dir/keypoints.{bin,idx} for appending; with append=False any existing annotations are discarded
+        if not os.path.exists(dir):
+            os.makedirs(dir)
+        mode = 'ab' if append else 'wb'
+        self.data = open(os.path.join(dir, DATA_FILENAME), mode)
+        self.index = open(os.path.join(dir, INDEX_FILENAME), mode)
+        self.offset = self.data.tell() // 4 # In (u, v) pairs
+
+    def __setitem__(self, frame, pixels):
+        # Lets the writer stand in for the legacy mapping dict (mapping[frame] = pixels); accepts [[[u, v]], ...] or an (N, 2) array
+        self.write(frame, pixels)
+
+    def write(self, frame, pixels):
+        pixels = np.asarray(pixels).reshape(-1, 2)
+        pixels = np.clip(pixels, -32768, 32767).astype(np.int16)
+        self.data.write(pixels.tobytes())
+        self.data.flush()
+        self.index.write(np.array([int(frame), self.offset, len(pixels)], dtype=np.int64).tobytes())
+        self.index.flush()
+        self.offset += len(pixels)
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class AnnotationReader(object):
+    def __init__(self, dir):
+        # Random access to the annotations in dir by frame index; the data file is memory-mapped
+        index = np.fromfile(os.path.join(dir, INDEX_FILENAME), dtype=np.int64)
+        index = index[:len(index) - len(index)%3].reshape(-1, 3) # Drop a partially written row
+        data_path = os.path.join(dir, DATA_FILENAME)
+        num_pairs = os.path.getsize(data_path) // 4
+        index = index[index[:,1] + index[:,2] <= num_pairs] # ...and frames whose pixels never reached the disk
+        self.data = np.memmap(data_path, dtype=np.int16, mode='r', shape=(num_pairs, 2)) if num_pairs else np.zeros((0, 2), dtype=np.int16)
+        self.index = {int(frame): (int(offset), int(count)) for frame, offset, count in index}
+
+    def __getitem__(self, frame):
+        # Returns the (N, 2) int array of pixels for frame
+        offset, count = self.index[int(frame)]
+        return np.array(self.data[offset:offset+count])
+
+    def __contains__(self, frame):
+        return int(frame) in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def frames(self):
+        return sorted(self.index)
+
+class LegacyAnnotationReader(object):
+    def __init__(self, dir):
+        # Same interface as AnnotationReader over an existing knots_info.json
+        with open(os.path.join(dir, LEGACY_FILENAME), "r") as f:
+            self.mapping = json.load(f)
+
+    def __getitem__(self, frame):
+        return np.array(self.mapping[str(frame)], dtype=int).reshape(-1, 2)
+
+    def __contains__(self, frame):
+        return str(frame) in self.mapping
+
+    def __len__(self):
+        return len(self.mapping)
+
+    def frames(self):
+        return sorted(int(k) for k in self.mapping)
+
+def open_annotations(dir):
+    # Returns a reader for dir, preferring the streaming format and falling back to knots_info.json
+    if os.path.exists(os.path.join(dir, INDEX_FILENAME)):
+        return AnnotationReader(dir)
+    return LegacyAnnotationReader(dir)
+
+def truncate(dir, num_frames):
+    # Drops the annotations of frames >= num_frames (e.g. the unfinished episode of a crashed run) so a resumed run can append
+    # after the rest; frames are appended in increasing order, so the kept rows are a prefix of both files
+    index_path = os.path.join(dir, INDEX_FILENAME)
+    if not os.path.exists(index_path):
+        return
+    index = np.fromfile(index_path, dtype=np.int64)
+    index = index[:len(index) - len(index)%3].reshape(-1, 3)
+    index = index[index[:,0] < num_frames]
+    index.tofile(index_path)
+    with open(os.path.join(dir, DATA_FILENAME), 'r+b') as f:
+        f.truncate(4 * int((index[:,1] + index[:,2]).max()) if len(index) else 0)
+
+def to_legacy_json(dir, json_path=None):
+    # Converts dir/keypoints.{bin,idx} into the legacy knots_info.json layout ({"frame": [[[u, v]], ...]})
+    reader = AnnotationReader(dir)
+    mapping = {str(frame): [[pixel] for pixel in reader[frame].tolist()] for frame in reader.frames()}
+    with open(json_path or os.path.join(dir, LEGACY_FILENAME), 'w') as outfile:
+        json.dump(mapping, outfile, sort_keys=True, indent=2)
+
+def from_legacy_json(dir, json_path=None):
+    # Converts a legacy knots_info.json into dir/keypoints.{bin,idx}
+    with open(json_path or os.path.join(dir, LEGACY_FILENAME), "r") as f:
+        mapping = json.load(f)
+    with AnnotationWriter(dir) as writer:
+        for frame in sorted(mapping, key=int):
+            writer.write(int(frame), mapping[frame])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['to_json', 'from_json'])
+    parser.add_argument('dir', type=str, nargs='?', default='images')
+    args = parser.parse_args()
+    if args.command == 'to_json':
+        to_legacy_json(args.dir)
+    else:
+        from_legacy_json(args.dir)
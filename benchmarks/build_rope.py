@@ -0,0 +1,30 @@
+import bpy
+import os
+import sys
+import json
+import time
+sys.path.append(os.getcwd())
+sys.path.append(os.path.join(os.getcwd(), "benchmarks"))
+
+from rigidbody_rope import *
+from common import results_path
+
+'''Usage (from the repo root): blender -b -P benchmarks/build_rope.py -- [segment counts...]
+Times make_capsule_rope for increasing num_segments and writes the results to benchmarks/results/build_rope.json'''
+
+if __name__ == '__main__':
+    with open("rigidbody_params.json", "r") as f:
+        params = json.load(f)
+    argv = sys.argv[sys.argv.index('--')+1:] if '--' in sys.argv else []
+    segment_counts = [int(n) for n in argv] or [50, 100, 200, 500, 1000]
+    results = []
+    for num_segments in segment_counts:
+        clear_scene()
+        params["num_segments"] = num_segments
+        start = time.time()
+        make_capsule_rope(params)
+        elapsed = time.time() - start
+        results.append({"num_segments": num_segments, "build_time": elapsed})
+        print("num_segments: %d build time: %.3fs" % (num_segments, elapsed))
+    with open(results_path("build_rope"), "w") as f:
+        json.dump(results, f, indent=2)
@@ -0,0 +1,106 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+
+'''Shared helpers for the benchmark scripts (plain Python, no bpy): timing, result files and baseline comparison.
+Results are flat {key: {"value": ..., "unit": ...}} dicts so two runs can be compared key by key; keys look like
+"simulate/pretzel/segments=50". benchmarks/results/<name>.json holds the latest run (not tracked by git), benchmarks/baseline/<name>.json
+the stored baseline.'''
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+BASELINE_DIR = os.path.join(BENCH_DIR, "baseline")
+LOWER_IS_BETTER = {"s", "ms"} # every other unit (fps, frames/s, x real-time, ...) is a throughput
+
+def parse_args(segments, resolutions=None, argv=None):
+    # Common flags; Blender scripts take theirs after '--', plain Python scripts from sys.argv
+    if argv is None:
+        argv = sys.argv[sys.argv.index('--')+1:] if '--' in sys.argv else sys.argv[1:]
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--segments', type=int, nargs='+', default=segments)
+    if resolutions is not None:
+        parser.add_argument('--resolutions', type=str, nargs='+', default=resolutions) # WIDTHxHEIGHT
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--tolerance', type=float, default=0.1) # relative slowdown reported as a regression
+    parser.add_argument('--save_baseline', action='store_true')
+    args = parser.parse_args(argv)
+    if resolutions is not None:
+        args.resolutions = [tuple(int(v) for v in r.lower().split('x')) for r in args.resolutions]
+    return args
+
+def load_params():
+    with open(os.path.join(BENCH_DIR, "..", "rigidbody_params.json"), "r") as f:
+        return json.load(f)
+
+def best_of(fn, repeat=3):
+    # Best wall time of repeat calls to fn (the least noisy estimate of its cost)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def add_result(results, key, value, unit):
+    results[key] = {"value": value, "unit": unit}
+    print("%-50s %12.4f %s" % (key, value, unit), flush=True)
+
+def machine_info():
+    info = {"python": platform.python_version(), "platform": platform.platform(), "processor": platform.processor(), "cpus": os.cpu_count()}
+    try:
+        import bpy
+        info["blender"] = bpy.app.version_string
+    except ImportError:
+        pass
+    return info
+
+def compare(results, baseline, tolerance=0.1):
+    # Returns (key, baseline, current, speedup, status) rows; speedup > 1 means the current run is faster
+    rows = []
+    for key, result in sorted(results.items()):
+        if key not in baseline:
+            rows.append((key, None, result["value"], None, "new"))
+            continue
+        old, new = baseline[key]["value"], result["value"]
+        if result["unit"] in LOWER_IS_BETTER:
+            speedup = old / new if new else float('inf')
+        else:
+            speedup = new / old if old else float('inf')
+        status = "regression" if speedup < 1 - tolerance else "improved" if speedup > 1 + tolerance else "ok"
+        rows.append((key, old, new, speedup, status))
+    return rows
+
+def results_path(name):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    return os.path.join(RESULTS_DIR, "%s.json" % name)
+
+def write_results(name, results, args):
+    # Writes benchmarks/results/<name>.json, compares it against the stored baseline and returns the number of regressions
+    record = {"benchmark": name, "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "machine": machine_info(), "results": results}
+    with open(results_path(name), "w") as f:
+        json.dump(record, f, indent=2, sort_keys=True)
+    baseline_path = os.path.join(BASELINE_DIR, "%s.json" % name)
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(baseline_path, "w") as f:
+            json.dump(record, f, indent=2, sort_keys=True)
+        print("Saved baseline %s" % baseline_path)
+        return 0
+    if not os.path.exists(baseline_path):
+        print("No baseline at %s (run with --save_baseline to store one)" % baseline_path)
+        return 0
+    with open(baseline_path, "r") as f:
+        baseline = json.load(f)["results"]
+    rows = compare(results, baseline, args.tolerance)
+    print("\n%-50s %12s %12s %8s" % ("benchmark", "baseline", "current", "speedup"))
+    for key, old, new, speedup, status in rows:
+        if old is None:
+            print("%-50s %12s %12.4f %8s  %s" % (key, "-", new, "-", status))
+        else:
+            print("%-50s %12.4f %12.4f %7.2fx  %s" % (key, old, new, speedup, status))
+    regressions = sum(row[4] == "regression" for row in rows)
+    print("%d regression(s) beyond %d%%" % (regressions, 100*args.tolerance))
+    return regressions
@@ -0,0 +1,91 @@
+import os
+import sys
+import tempfile
+import numpy as np
+sys.path.append(os.getcwd())
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy_rope
+import annotations
+import rasterize
+import crossings
+from vis import draw_keypoints
+from common import parse_args, load_params, best_of, add_result, write_results
+
+'''Usage (from the repo root): python benchmarks/numpy_bench.py [--segments 50 100] [--resolutions 640x480] [--save_baseline]
+The parts of the pipeline that run without bpy: numpy_rope knot simulation, analytic depth/mask rasterization, crossing
+extraction, the annotation store and keypoint drawing.
+Writes benchmarks/results/numpy_bench.json and compares it against benchmarks/baseline/numpy_bench.json; exits 1 on regressions.'''
+
+KNOTS = ["pretzel", "figure_eight", "stevedore", "double_pretzel", "cornell1"]
+BATCH_SIZE = 16
+NUM_ANNOTATIONS = 300
+
+def bench_simulation(params, segment_counts, results):
+    for num_segments in segment_counts:
+        params = dict(params, num_segments=num_segments)
+        for knot in KNOTS:
+            sim = numpy_rope.RopeBatch(params)
+            elapsed = best_of(lambda: (sim.reset(), numpy_rope.tie_knot(sim, knot)), repeat=1)
+            add_result(results, "simulate/%s/segments=%d" % (knot, num_segments), (sim.frame - 1) / elapsed, "frames/s")
+        sim = numpy_rope.RopeBatch(params, batch_size=BATCH_SIZE)
+        elapsed = best_of(lambda: (sim.reset(), numpy_rope.tie_knot(sim, "pretzel")), repeat=1)
+        add_result(results, "simulate/pretzel_batch%d/segments=%d" % (BATCH_SIZE, num_segments), BATCH_SIZE * (sim.frame - 1) / elapsed, "frames/s")
+
+def bench_rasterize(params, resolutions, results, repeat):
+    # Depth + mask passes of a tied pretzel
+    sim = numpy_rope.RopeBatch(params)
+    numpy_rope.tie_knot(sim, "pretzel")
+    transforms = sim.transforms()[0]
+    for width, height in resolutions:
+        K, cam_to_world, size = rasterize.default_camera(width, height)
+        add_result(results, "rasterize/%dx%d" % (width, height), 1000 * best_of(lambda: rasterize.render_passes(transforms, K, cam_to_world, size), repeat), "ms")
+
+def bench_crossings(results, repeat, segment_counts=(50, 500, 2000)):
+    # Full and incremental (a few segments moved) crossing extraction on a tangled random walk
+    rng = np.random.RandomState(0)
+    for num_segments in segment_counts:
+        steps = rng.normal(size=(num_segments, 3)) * [1, 1, 0.1]
+        positions = np.cumsum(0.5 * steps / np.linalg.norm(steps, axis=1, keepdims=True), axis=0)
+        moved = positions.copy()
+        moved[num_segments//2:num_segments//2+5] += 0.05
+        add_result(results, "crossings/full/segments=%d" % num_segments, 1000 * best_of(lambda: crossings.CrossingAnalyzer().update(positions), repeat), "ms")
+        analyzer = crossings.CrossingAnalyzer()
+        analyzer.update(positions)
+        def incremental():
+            # Two updates, each moving the same 5 segments (there and back)
+            analyzer.update(moved)
+            analyzer.update(positions)
+        add_result(results, "crossings/incremental/segments=%d" % num_segments, 1000 * best_of(incremental, repeat) / 2, "ms")
+
+def bench_annotations(results, repeat, num_frames=1000):
+    pixels = np.random.randint(0, 640, size=(NUM_ANNOTATIONS, 2))
+    with tempfile.TemporaryDirectory() as dir:
+        def write():
+            with annotations.AnnotationWriter(dir) as writer:
+                for frame in range(num_frames):
+                    writer[frame] = pixels
+        def read():
+            reader = annotations.AnnotationReader(dir)
+            for frame in range(num_frames):
+                np.asarray(reader[frame])
+        add_result(results, "annotations/write", num_frames / best_of(write, repeat), "frames/s")
+        add_result(results, "annotations/read", num_frames / best_of(read, repeat), "frames/s")
+
+def bench_draw(resolutions, results, repeat):
+    for width, height in resolutions:
+        img = np.zeros((height, width, 3), dtype=np.uint8)
+        pixels = np.stack((np.random.randint(0, width, NUM_ANNOTATIONS), np.random.randint(0, height, NUM_ANNOTATIONS)), axis=1)
+        add_result(results, "draw_keypoints/%dx%d" % (width, height), 1000 * best_of(lambda: draw_keypoints(img.copy(), pixels), repeat), "ms")
+
+if __name__ == '__main__':
+    args = parse_args(segments=[50, 100], resolutions=["640x480", "1280x960"])
+    np.random.seed(0)
+    params = load_params()
+    results = {}
+    bench_simulation(params, args.segments, results)
+    bench_rasterize(params, args.resolutions, results, args.repeat)
+    bench_crossings(results, args.repeat)
+    bench_annotations(results, args.repeat)
+    bench_draw(args.resolutions, results, args.repeat)
+    sys.exit(1 if write_results("numpy_bench", results, args) else 0)
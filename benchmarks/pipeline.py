@@ -0,0 +1,97 @@
+import bpy
+import os
+import sys
+import time
+import tempfile
+sys.path.append(os.getcwd())
+sys.path.append(os.path.join(os.getcwd(), "benchmarks"))
+
+from rigidbody_rope import *
+from render import set_animation_settings, set_render_settings, render_frame, annotate, find_knot
+import knots
+from common import parse_args, load_params, best_of, add_result, write_results
+
+'''Usage (from the repo root): blender -b -P benchmarks/pipeline.py -- [--segments 50 100] [--resolutions 640x480] [--save_baseline]
+Times the Blender pipeline for each segment count: scene build (make_capsule_rope + rig_rope), simulated frames/s while tying
+every knot in trajectories/, and, on the tied pretzel, find_knot, annotate and per-frame render latency for each engine and resolution.
+Writes benchmarks/results/pipeline.json and compares it against benchmarks/baseline/pipeline.json (exit code 1 on regressions with --python-exit-code 1).
+Renders go to a temporary folder, so ./images etc. are left alone.'''
+
+KNOTS = ["pretzel", "figure_eight", "stevedore", "double_pretzel", "cornell1"]
+ENGINES = ["BLENDER_WORKBENCH", "BLENDER_EEVEE"]
+NUM_ANNOTATIONS = 300
+
+def clear_all():
+    clear_scene()
+    # clear_scene's select_all/delete can't select the capsules rig_rope hid; left in place they would stay in the rigid body
+    # world and push the next rope's segments to other names
+    for obj in list(bpy.data.objects):
+        bpy.data.objects.remove(obj, do_unlink=True)
+    for curve in bpy.data.curves:
+        bpy.data.curves.remove(curve)
+    for armature in bpy.data.armatures:
+        bpy.data.armatures.remove(armature)
+
+def bench_build(params, results):
+    clear_all()
+    start = time.perf_counter()
+    make_capsule_rope(params)
+    rig_rope(params, 'cable')
+    add_result(results, "build/segments=%d" % params["num_segments"], time.perf_counter() - start, "s")
+    add_camera_light()
+    make_table(params)
+    set_animation_settings(15000)
+
+def bench_knot(params, name, trajectory, results):
+    # knots.tie_knot with the trajectory loaded up front; returns with the rope tied at the last simulated frame
+    knots.compile_trajectory(params, trajectory)
+    start = time.perf_counter()
+    for step in range(1, trajectory["sim_frames"]):
+        bpy.context.scene.frame_set(step)
+    elapsed = time.perf_counter() - start
+    add_result(results, "simulate/%s/segments=%d" % (name, params["num_segments"]), (trajectory["sim_frames"] - 1) / elapsed, "frames/s")
+
+def bench_oracle(params, results, repeat):
+    num_segments = params["num_segments"]
+    frame = bpy.context.scene.frame_current
+    add_result(results, "find_knot/segments=%d" % num_segments, 1000 * best_of(lambda: find_knot(num_segments), repeat), "ms")
+    # The default knot_only annotation only covers the 6 segments around find_knot's pull and hold points whatever the rope
+    # length, so time the full-rope variant here to make the segment count in the key meaningful
+    add_result(results, "annotate/full_rope/segments=%d" % num_segments, 1000 * best_of(lambda: annotate(frame, {}, NUM_ANNOTATIONS, knot_only=False), repeat), "ms")
+
+def bench_render(params, resolutions, results, repeat):
+    frame = bpy.context.scene.frame_current
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as out_dir:
+        os.chdir(out_dir)
+        try:
+            for engine in ENGINES:
+                for width, height in resolutions:
+                    set_render_settings(engine, (width, height))
+                    # The first render also compiles shaders; best_of keeps the steady-state latency
+                    elapsed = best_of(lambda: render_frame(frame, step=1, annot=False), repeat + 1)
+                    add_result(results, "render/%s/%dx%d/segments=%d" % (engine, width, height, params["num_segments"]), 1000 * elapsed, "ms")
+        finally:
+            os.chdir(cwd)
+
+def reset_animation():
+    # Same reset generate_dataset does between episodes
+    bpy.context.scene.frame_set(0)
+    for a in bpy.data.actions:
+        bpy.data.actions.remove(a)
+
+if __name__ == '__main__':
+    args = parse_args(segments=[50, 100], resolutions=["640x480", "1280x960"])
+    params = load_params()
+    trajectories = {name: knots.load_trajectory(name) for name in KNOTS}
+    results = {}
+    for num_segments in args.segments:
+        params["num_segments"] = num_segments
+        bench_build(params, results)
+        for name in KNOTS:
+            bench_knot(params, name, trajectories[name], results)
+            if name == "pretzel":
+                bench_oracle(params, results, args.repeat)
+                bench_render(params, args.resolutions, results, args.repeat)
+            reset_animation()
+    sys.exit(1 if write_results("pipeline", results, args) else 0)
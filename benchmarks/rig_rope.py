@@ -0,0 +1,41 @@
+import bpy
+import os
+import sys
+import json
+import time
+sys.path.append(os.getcwd())
+sys.path.append(os.path.join(os.getcwd(), "benchmarks"))
+
+from rigidbody_rope import *
+from common import results_path
+
+'''Usage (from the repo root): blender -b -P benchmarks/rig_rope.py -- [segment counts...]
+Times rig_rope with the single edit-session construction against the original per-segment operators; writes benchmarks/results/rig_rope.json'''
+
+if __name__ == '__main__':
+    with open("rigidbody_params.json", "r") as f:
+        params = json.load(f)
+    argv = sys.argv[sys.argv.index('--')+1:] if '--' in sys.argv else []
+    segment_counts = [int(n) for n in argv] or [50, 100, 200]
+    results = []
+    for num_segments in segment_counts:
+        params["num_segments"] = num_segments
+        result = {"num_segments": num_segments}
+        for name, per_segment_ops in [("per_segment_ops", True), ("single_session", False)]:
+            clear_scene()
+            # rig_rope hides the capsules, which clear_scene's select_all/delete then misses; createNewBone looks its targets up
+            # by name, so stale capsules would be rigged instead of the new rope
+            for obj in list(bpy.data.objects):
+                bpy.data.objects.remove(obj, do_unlink=True)
+            for curve in bpy.data.curves:
+                bpy.data.curves.remove(curve)
+            for armature in bpy.data.armatures:
+                bpy.data.armatures.remove(armature)
+            make_capsule_rope(params)
+            start = time.time()
+            rig_rope(params, 'cable', per_segment_ops=per_segment_ops)
+            result[name] = time.time() - start
+        results.append(result)
+        print("num_segments: %d per-segment ops: %.3fs single session: %.3fs" % (num_segments, result["per_segment_ops"], result["single_session"]))
+    with open(results_path("rig_rope"), "w") as f:
+        json.dump(results, f, indent=2)
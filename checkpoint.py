@@ -0,0 +1,65 @@
+import bpy
+import numpy as np
+
+import os
+import sys
+import json
+import hashlib
+import tempfile
+sys.path.append(os.getcwd())
+
+from mathutils import Matrix
+from rigidbody_rope import get_rope
+from knots import toggle_animation
+
+'''Snapshots of the full rope state (e.g. right after tying + reidemeister) so episodes can branch from a tied knot without re-simulating it'''
+
+RENDER_PARAMS = ("engine", "render_width", "render_height") # Don't change the simulation, so they don't invalidate cached knots
+
+def params_hash(params):
+    # Short, order-independent hash of the rope hyperparameters that affect the simulation
+    physics = {k: v for k, v in params.items() if k not in RENDER_PARAMS}
+    return hashlib.md5(json.dumps(physics, sort_keys=True).encode()).hexdigest()[:10]
+
+def checkpoint_path(cache_dir, knot_name, params, seed):
+    return os.path.join(cache_dir, "%s_%s_%d.npz" % (knot_name, params_hash(params), seed))
+
+def get_rope_state(params):
+    # Reads every segment's world transform, kinematic flag and (finite-difference) velocity at the current frame
+    rope = get_rope("Cylinder")
+    state = rope.read()
+    kinematic = np.array([obj.rigid_body.kinematic for obj in rope])
+    # Steps back to the previous frame if needed; it is already in the rigid body point cache, so this does not re-simulate
+    velocities = rope.velocities()
+    frame, matrices = state.frame, state.matrices
+    return {"matrices": matrices, "kinematic": kinematic, "velocities": velocities, "frame": frame}
+
+def save_rope_state(path, state):
+    os.makedirs(os.path.dirname(path), exist_ok=True) # Shards may create the cache folder at the same time
+    # Written to a temporary file next to path and renamed over it, so concurrent shards or an interrupted run never leave a
+    # partial checkpoint for load_rope_state to pick up
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **state)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def load_rope_state(path):
+    with np.load(path) as data:
+        return {k: data[k] for k in data.files}
+
+def restore_rope_state(params, state, frame=1):
+    # Poses every segment from a snapshot at the simulation start frame and returns that frame; keyframes must already be cleared.
+    # Bullet's initial velocities can't be set through bpy, so the rope restarts from rest (snapshots are taken once it has settled).
+    scene = bpy.context.scene
+    scene.frame_set(frame)
+    for i, obj in enumerate(get_rope("Cylinder")):
+        obj.matrix_world = Matrix(state["matrices"][i].tolist())
+        obj.keyframe_insert(data_path="location", frame=frame)
+        obj.keyframe_insert(data_path="rotation_euler", frame=frame)
+        toggle_animation(obj, frame, bool(state["kinematic"][i]))
+    scene.frame_set(frame)
+    return frame
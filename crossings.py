@@ -0,0 +1,176 @@
+import numpy as np
+
+'''Crossing graph of a rope seen from above (the add_camera_light camera looks straight down -z), in NumPy (no Blender needed).
+
+The rope is the polyline through its segment centers; bond k joins segments k and k+1. Bonds are bucketed in a uniform spatial
+hash grid over the xy plane, so only bonds sharing a cell are tested for a planar intersection and the cost stays near-linear in
+the number of segments. Every intersection of two non-adjacent bonds is a crossing; the bond that is higher at the intersection
+is the over strand. Crossing signs use the usual right-handed convention seen from +z: +1 when the under strand runs
+counterclockwise from the over strand.'''
+
+class Crossing(object):
+    __slots__ = ("over", "under", "over_pos", "under_pos", "point", "height", "sign")
+
+    def __init__(self, over, under, over_pos, under_pos, point, height, sign):
+        self.over = over # bond indices
+        self.under = under
+        self.over_pos = over_pos # arc-length positions along the rope, in segments (bond k + fraction)
+        self.under_pos = under_pos
+        self.point = point # (x, y) of the crossing
+        self.height = height # z of the over strand minus z of the under strand
+        self.sign = sign
+
+    def __repr__(self):
+        return "Crossing(over=%.2f, under=%.2f, sign=%+d)" % (self.over_pos, self.under_pos, self.sign)
+
+def bond_cells(a, b, cell_size, bonds=None):
+    # (cell key, bond) pairs for every grid cell each bond's xy bounding box touches, sorted by cell; bonds are no longer than
+    # cell_size, so a box spans at most 2x2 cells. bonds gives the indices of a, b when they are a subset of the rope's bonds
+    lo = np.floor(np.minimum(a, b) / cell_size).astype(np.int64)
+    hi = np.floor(np.maximum(a, b) / cell_size).astype(np.int64)
+    bonds = np.arange(len(a)) if bonds is None else bonds
+    keys, owners = [], []
+    for dx in (0, 1):
+        for dy in (0, 1):
+            cx, cy = lo[:,0] + dx, lo[:,1] + dy
+            inside = (cx <= hi[:,0]) & (cy <= hi[:,1])
+            # Pack the (possibly negative) cell coordinates into one sortable integer key
+            keys.append(((cx[inside] + (1 << 20)) << 21) | (cy[inside] + (1 << 20)))
+            owners.append(bonds[inside])
+    return sort_cells(np.concatenate(keys), np.concatenate(owners))
+
+def sort_cells(keys, owners):
+    order = np.lexsort((owners, keys))
+    return keys[order], owners[order]
+
+def unique_pairs(i, j, num_bonds):
+    # (i, j) with i < j-1 (adjacent bonds always touch), without duplicates
+    i, j = np.minimum(i, j), np.maximum(i, j)
+    keep = j - i >= 2
+    packed = np.unique(i[keep] * num_bonds + j[keep])
+    return packed // num_bonds, packed % num_bonds
+
+def candidate_pairs(a, b, cell_size):
+    # (i, j) bond pairs with i < j-1 that share at least one grid cell, without duplicates
+    keys, owners = bond_cells(a, b, cell_size)
+    return cell_pairs(keys, owners, len(a))
+
+def cell_pairs(keys, owners, num_bonds):
+    # Every pair of bonds in the same cell of the sorted cell table
+    pairs_i, pairs_j = [], []
+    # Pair every entry with the ones after it in the same cell; cells hold a handful of bonds, so this runs a few vectorized passes
+    k = 1
+    while k < len(keys):
+        same = keys[k:] == keys[:-k]
+        if not same.any():
+            break
+        pairs_i.append(owners[:-k][same])
+        pairs_j.append(owners[k:][same])
+        k += 1
+    if not pairs_i:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return unique_pairs(np.concatenate(pairs_i), np.concatenate(pairs_j), num_bonds)
+
+def pairs_with(keys, owners, bond_keys, bond_owners, num_bonds):
+    # Pairs of each (bond_keys, bond_owners) entry with every bond in its cell of the sorted cell table (keys, owners)
+    lo = np.searchsorted(keys, bond_keys, 'left')
+    counts = np.searchsorted(keys, bond_keys, 'right') - lo
+    starts = np.cumsum(counts) - counts
+    rows = np.arange(counts.sum()) - np.repeat(starts - lo, counts)
+    return unique_pairs(np.repeat(bond_owners, counts), owners[rows], num_bonds)
+
+def intersect_bonds(p, i, j):
+    # Planar intersection of bonds i and j (arrays); returns the hit mask and the fractions s, t along each bond
+    a0, a1 = p[i,:2], p[i+1,:2]
+    b0, b1 = p[j,:2], p[j+1,:2]
+    da, db, d0 = a1 - a0, b1 - b0, b0 - a0
+    denom = da[:,0]*db[:,1] - da[:,1]*db[:,0]
+    parallel = np.abs(denom) < 1e-12
+    denom = np.where(parallel, 1, denom)
+    s = (d0[:,0]*db[:,1] - d0[:,1]*db[:,0]) / denom
+    t = (d0[:,0]*da[:,1] - d0[:,1]*da[:,0]) / denom
+    # Half-open on the far end so a crossing exactly at a shared vertex is only counted once
+    hit = ~parallel & (s >= 0) & (s < 1) & (t >= 0) & (t < 1)
+    return hit, s, t
+
+class CrossingAnalyzer(object):
+    '''Finds every crossing of a rope per frame. The grid is kept between update() calls: only bonds that moved are re-binned
+    and re-tested (against the bonds sharing their new cells), and pairs of unmoved bonds keep the previous frame's answer.
+    A bond counts as moved once either end is more than move_tol from where it was when the bond was last binned and tested,
+    so slow drift accumulates until the bond is re-tested instead of going unnoticed update after update'''
+    def __init__(self, cell_size=None, move_tol=1e-4, slack=1.25):
+        self.cell_size = cell_size # Defaults to slack times the longest bond when the grid is built
+        self.move_tol = move_tol
+        self.slack = slack # Lets bonds stretch a little before the grid has to be rebuilt with larger cells
+        self.positions = None
+        self.grid_size = None
+        self.keys = self.owners = None # Sorted cell table of the grid
+        self.binned = None # (num_bonds, 2, 3) end positions of each bond when it was last binned and tested
+        # Crossing bond pairs (i < j) of the last update and the fractions s, t of the crossing along each
+        self.i = self.j = np.zeros(0, dtype=np.int64)
+        self.s = self.t = np.zeros(0)
+
+    def update(self, positions):
+        # positions: (num_segments, 3) segment centers; returns the list of Crossings (see crossings())
+        p = np.asarray(positions, dtype=np.float64)
+        a, b = p[:-1,:2], p[1:,:2]
+        longest = max(np.linalg.norm(b - a, axis=1).max(), 1e-6)
+        if self.positions is None or self.positions.shape != p.shape or (self.cell_size is None and longest > self.grid_size):
+            # Build the grid and test every candidate pair
+            self.grid_size = self.cell_size or self.slack * longest
+            self.keys, self.owners = bond_cells(a, b, self.grid_size)
+            i, j = cell_pairs(self.keys, self.owners, len(a))
+            keep = np.zeros(len(self.i), dtype=bool)
+            self.binned = np.stack((p[:-1], p[1:]), axis=1)
+        else:
+            drift = np.linalg.norm(np.stack((p[:-1], p[1:]), axis=1) - self.binned, axis=-1)
+            moved_bond = (drift > self.move_tol).any(axis=1)
+            bonds = np.flatnonzero(moved_bond)
+            self.binned[bonds, 0] = p[bonds]
+            self.binned[bonds, 1] = p[bonds+1]
+            # Re-bin the moved bonds, then pair them with everything in their new cells
+            moved_keys, moved_owners = bond_cells(a[bonds], b[bonds], self.grid_size, bonds)
+            unmoved = ~moved_bond[self.owners]
+            self.keys, self.owners = sort_cells(np.concatenate((self.keys[unmoved], moved_keys)), np.concatenate((self.owners[unmoved], moved_owners)))
+            i, j = pairs_with(self.keys, self.owners, moved_keys, moved_owners, len(a))
+            # Pairs of unmoved bonds keep last frame's answer
+            keep = ~(moved_bond[self.i] | moved_bond[self.j])
+        hit, s, t = intersect_bonds(p, i, j)
+        self.i = np.concatenate((self.i[keep], i[hit]))
+        self.j = np.concatenate((self.j[keep], j[hit]))
+        self.s = np.concatenate((self.s[keep], s[hit]))
+        self.t = np.concatenate((self.t[keep], t[hit]))
+        self.positions = p.copy()
+        return self.crossings()
+
+    def crossings(self):
+        # Crossing records of the last update, ordered by where the rope first reaches them
+        p, i, j, s, t = self.positions, self.i, self.j, self.s, self.t
+        zi = p[i,2] + s*(p[i+1,2] - p[i,2])
+        zj = p[j,2] + t*(p[j+1,2] - p[j,2])
+        i_over = zi >= zj
+        over, under = np.where(i_over, i, j), np.where(i_over, j, i)
+        over_pos, under_pos = np.where(i_over, i+s, j+t), np.where(i_over, j+t, i+s)
+        d_over = p[over+1,:2] - p[over,:2]
+        d_under = p[under+1,:2] - p[under,:2]
+        sign = np.where(d_over[:,0]*d_under[:,1] - d_over[:,1]*d_under[:,0] > 0, 1, -1)
+        point = p[i,:2] + s[:,None]*(p[i+1,:2] - p[i,:2])
+        height = np.abs(zi - zj)
+        order = np.argsort(np.minimum(over_pos, under_pos), kind='stable')
+        return [Crossing(*values) for values in zip(over[order].tolist(), under[order].tolist(), over_pos[order].tolist(), under_pos[order].tolist(),
+                                                   map(tuple, point[order].tolist()), height[order].tolist(), sign[order].tolist())]
+
+def gauss_code(crossings):
+    # Signed Gauss code: walking from segment 0, each crossing is visited twice, as (crossing number, 'O' or 'U', sign)
+    visits = []
+    for number, c in enumerate(crossings):
+        visits.append((c.over_pos, number, 'O', c.sign))
+        visits.append((c.under_pos, number, 'U', c.sign))
+    visits.sort()
+    return [(number, kind, sign) for _, number, kind, sign in visits]
+
+def crossing_graph(crossings):
+    # Crossings as nodes and the rope pieces between consecutive crossing visits as edges (with the segment span they cover)
+    visits = sorted([(c.over_pos, number) for number, c in enumerate(crossings)] + [(c.under_pos, number) for number, c in enumerate(crossings)])
+    edges = [(visits[k][1], visits[k+1][1], visits[k][0], visits[k+1][0]) for k in range(len(visits)-1)]
+    return {"crossings": crossings, "edges": edges, "writhe": sum(c.sign for c in crossings)}
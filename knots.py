@@ -7,6 +7,9 @@ import sys
 sys.path.append(os.getcwd())
 
 from rigidbody_rope import *
+import settle
+from timing import TIMER
+from layout import load_trajectory
 
 def set_animation_settings(anim_end):
     # Sets up the animation to run till frame anim_end (otherwise default terminates @ 250)
@@ -14,13 +17,6 @@ def set_animation_settings(anim_end):
     scene.frame_end = anim_end
     scene.rigidbody_world.point_cache.frame_end = anim_end
 
-def get_piece(piece_name, piece_id):
-    # Returns the piece with name piece_name, index piece_id
-    # if piece_id == -1:
-    if piece_id == -1 or piece_id == 0:
-        return bpy.data.objects['%s' % (piece_name)]
-    return bpy.data.objects['%s.%03d' % (piece_name, piece_id)]
-
 def toggle_animation(obj, frame, animate):
     # Sets the obj to be animable or non-animable at particular frame
     obj.rigid_body.kinematic = animate
@@ -42,167 +38,116 @@ def take_action(obj, frame, action_vec, animate=True):
     obj.keyframe_insert(data_path="location", frame=frame)
     obj.keyframe_insert(data_path="rotation_euler", frame=frame)
 
-def tie_pretzel_knot(params, chain=False, render=False):
-
-    piece = "Cylinder"
+def set_keyframes(obj, data_path, index, frames, values, interpolation=None):
+    # Writes all keyframes of one F-curve at once instead of one keyframe_insert per point
+    if obj.animation_data is None:
+        obj.animation_data_create()
+    if obj.animation_data.action is None:
+        obj.animation_data.action = bpy.data.actions.new(name="%sAction" % obj.name)
+    fcurves = obj.animation_data.action.fcurves
+    fcurve = fcurves.find(data_path, index=index) or fcurves.new(data_path, index=index)
+    start = len(fcurve.keyframe_points)
+    fcurve.keyframe_points.add(len(frames))
+    co = np.empty(2*len(fcurve.keyframe_points))
+    fcurve.keyframe_points.foreach_get("co", co)
+    co[2*start::2] = frames
+    co[2*start+1::2] = values
+    fcurve.keyframe_points.foreach_set("co", co)
+    if interpolation is not None:
+        for point in fcurve.keyframe_points[start:]:
+            point.interpolation = interpolation
+    fcurve.update() # Sorts the points and recomputes the (auto-clamped) handles
+
+def compile_trajectory(params, trajectory, start_frame=1, piece="Cylinder"):
+    # Keyframes a trajectory in bulk: every segment is pinned at its current pose on start_frame, the ends follow their waypoints
+    # (cumulative displacements, as with take_action) and are kinematic until their last kinematic event
     last = params["num_segments"]-1
-    end1 = get_piece(piece, -1)
-    end2 = get_piece(piece, last)
+    curr_frame = bpy.context.scene.frame_current
+    ends = {end["segment"] % (last+1): end for end in trajectory["ends"]}
+    rope = get_rope(piece)
+    state = rope.read()
     for i in range(last+1):
-        obj = get_piece(piece, i if i != 0 else -1)
-        take_action(obj, 1, (0,0,0), animate=(i==0 or i==last))
-
-    # Wrap endpoint one circularly around endpoint 2
-    take_action(end2, 80, (10,0,0))
-    take_action(end1, 80, (-15,5,0))
-    take_action(end1, 120, (-1,-7,0))
-    take_action(end1, 150, (3,0,-4))
-    take_action(end1, 170, (0,2.5,0))
-
-    # Thread endpoint 1 through the loop (downward)
-    take_action(end1, 180, (0,0,-2))
-
-    # Pull to tighten knot
-    take_action(end1, 200, (5,0,2))
-    take_action(end2, 200, (0,0,0))
-    take_action(end1, 230, (8,0,5))
-    take_action(end2, 230, (-6,0,0))
-
-    take_action(end1, 260, (-1,0,-1))
-    take_action(end2, 260, (1,0,-1))
-    toggle_animation(end1, 280, False)
-    toggle_animation(end2, 280, False)
-
-    ## Reidemeister
-    for step in range(1, 350):
+        obj = rope[i]
+        animate = i in ends
+        start_frames = sorted({curr_frame, start_frame})
+        if animate != obj.rigid_body.kinematic:
+            # We are "picking up" a dropped object, so we need its updated location
+            loc = state.positions[i]
+        else:
+            loc = np.array(obj.location)
+        rot = np.array(Matrix(state.orientations[i].tolist()).to_euler())
+        loc_keys = {f: loc for f in start_frames}
+        kinematic_keys = {curr_frame: animate}
+        if animate:
+            for frame, delta in ends[i]["waypoints"]:
+                loc = loc + np.array(delta)
+                loc_keys[frame] = loc
+            for frame, value in ends[i]["kinematic"]:
+                kinematic_keys[frame] = value
+        frames = sorted(loc_keys)
+        for axis in range(3):
+            set_keyframes(obj, "location", axis, frames, [loc_keys[f][axis] for f in frames])
+            set_keyframes(obj, "rotation_euler", axis, start_frames, [rot[axis]]*len(start_frames))
+        frames = sorted(kinematic_keys)
+        set_keyframes(obj, "rigid_body.kinematic", 0, frames, [float(kinematic_keys[f]) for f in frames], interpolation='CONSTANT')
+        obj.rigid_body.kinematic = kinematic_keys[frames[-1]]
+
+def settle_frames(params, start_frame, max_frame, phase, pieces=("Cylinder",)):
+    # Advances the simulation through start_frame..max_frame-1, yielding (frame, settled) after each frame_set, and stops after
+    # the frame where every rope in pieces has settled (settle.SettleDetector; params "settle_threshold"/"settle_window" override
+    # the defaults). The frames this skips are counted under settle_<phase> in the episode metrics
+    scene = bpy.context.scene
+    detector = settle.SettleDetector(params.get("settle_threshold", settle.THRESHOLD), params.get("settle_window", settle.WINDOW))
+    ropes = [get_rope(piece) for piece in pieces]
+    step = start_frame - 1
+    for step in range(start_frame, max_frame):
+        scene.frame_set(step)
+        velocities = [rope.read().velocities for rope in ropes]
+        settled = detector.update(None if any(v is None for v in velocities) else np.concatenate(velocities))
+        yield step, settled
+        if settled:
+            break
+    TIMER.count("settle_%s" % phase, calls=1, frames=step+1-start_frame, saved=max_frame-step-1)
+
+def last_event_frame(trajectory):
+    # Last frame with a keyframed waypoint or kinematic switch; the rope only settles after it
+    return max(frame for end in trajectory["ends"] for frame, _ in end["waypoints"] + end["kinematic"])
+
+def tie_knot(params, name, render=False):
+    # Ties the knot described by trajectories/<name>.json and simulates it until it settles (at most until its sim_frames)
+    trajectory = load_trajectory(name)
+    compile_trajectory(params, trajectory)
+    settle_start = last_event_frame(trajectory) + 1
+    for step in range(1, settle_start):
         bpy.context.scene.frame_set(step)
-        #if render:
-        #    render_frame(step, render_offset=render_offset)
-    return 350
+    step = settle_start - 1
+    for step, _ in settle_frames(params, settle_start, trajectory["sim_frames"], "tie"):
+        pass
+    return min(trajectory["end_frame"], step + 1)
 
-def tie_figure_eight(params, chain=False, render=False):
-
-    piece = "Cylinder"
-    last = params["num_segments"]-1
-    end1 = get_piece(piece, -1)
-    end2 = get_piece(piece, last)
-    for i in range(last+1):
-        obj = get_piece(piece, i if i != 0 else -1)
-        take_action(obj, 1, (0,0,0), animate=(i==0 or i==last))
-
-    take_action(end2, 80, (10,0,2))
-    take_action(end1, 80, (-15,2,2))
-    take_action(end2, 130, (1,3,0))
-    take_action(end2, 180, (-4,0,0))
-    take_action(end2, 200, (0,-2,0))
-    take_action(end2, 250, (4.5,-0.25,-6))
-    take_action(end2, 300, (0,0,-2))
-    take_action(end2, 350, (9,0,8))
-    take_action(end2, 400, (-16,0,0))
+def tie_pretzel_knot(params, chain=False, render=False):
+    return tie_knot(params, "pretzel", render=render)
 
-    take_action(end1, 350, (0,0,0))
-    take_action(end1, 400, (14,-2,-2))
 
-    # Take some time to settle
-    toggle_animation(end1, 450, False)
-    toggle_animation(end2, 450, False)
+def tie_figure_eight(params, chain=False, render=False):
+    return tie_knot(params, "figure_eight", render=render)
 
-    for step in range(1, 500):
-        bpy.context.scene.frame_set(step)
-        #if render:
-        #    render_frame(step)
-    return 500
 
 def tie_stevedore(params, chain=False, render=False):
+    return tie_knot(params, "stevedore", render=render)
 
-    piece = "Cylinder"
-    last = params["num_segments"]-1
-    end1 = get_piece(piece, -1)
-    end2 = get_piece(piece, last)
-    for i in range(last+1):
-        obj = get_piece(piece, i if i != 0 else -1)
-        take_action(obj, 1, (0,0,0), animate=(i==0 or i==last))
-
-    take_action(end2, 80, (10,0,2))
-    take_action(end1, 80, (-15,2,2))
-    take_action(end2, 100, (1,3,0))
-    take_action(end2, 130, (-4,0,0))
-    take_action(end2, 150, (0,-2,0))
-
-    take_action(end2, 170, (3,0,0))
-    take_action(end2, 190, (0,2,0))
-    take_action(end2, 210, (-2,0,0))
-    take_action(end2, 230, (0,-2,0))
-
-    take_action(end2, 300, (3.5,-0.25,-6))
-    take_action(end2, 310, (0,0,-3))
-    take_action(end2, 350, (9,0,8))
-    take_action(end1, 350, (0,0,0))
-    #take_action(end2, 400, (-16,0,-3))
-    #take_action(end1, 400, (8,-2,-5))
-    take_action(end2, 400, (-12,0,-3))
-    take_action(end1, 400, (12,-2,-5))
-
-    # Take some time to settle
-    toggle_animation(end1, 430, False)
-    toggle_animation(end2, 430, False)
-    for step in range(1, 470):
-        bpy.context.scene.frame_set(step)
-        #if render:
-        #    render_frame(step)
-    return 470
 
 def tie_double_pretzel(params, chain=False, render=False):
+    return tie_knot(params, "double_pretzel", render=render)
 
-    piece = "Cylinder"
-    last = params["num_segments"]-1
-    end1 = get_piece(piece, -1)
-    end2 = get_piece(piece, last)
-    for i in range(last+1):
-        obj = get_piece(piece, i if i != 0 else -1)
-        take_action(obj, 1, (0,0,0), animate=(i==0 or i==last))
-
-    take_action(end2, 80, (5,0,-1))
-    take_action(end1, 80, (-20,2,2))
-
-    take_action(end2, 100, (2,2,0))
-    take_action(end1, 100, (0,0,0))
-    take_action(end1, 150, (6,-1,0))
-    take_action(end2, 150, (0,0,0))
-    take_action(end2, 200, (2,-1.5,-3))
-    take_action(end2, 220, (0,0,-3))
-    take_action(end2, 240, (-6,0,0))
-    take_action(end1, 240, (0,0,0))
-    take_action(end2, 300, (-3,0,5))
-    take_action(end1, 300, (4,0,0))
-
-    take_action(end1, 320, (0,0,0))
-    take_action(end1, 360, (-11,3,-5))
-    take_action(end1, 380, (-1,-3,0))
-    take_action(end1, 410, (1,1,-2))
-    take_action(end1, 430, (-2,6,2))
-    take_action(end1, 460, (0,0,0))
-    take_action(end1, 490, (0,-5,3))
-    take_action(end2, 490, (0,0,0))
-    take_action(end2, 520, (11,0,-2))
-    take_action(end1, 520, (18,-3,-2))
-    toggle_animation(end1, 540, False)
-    toggle_animation(end2, 540, False)
-
-    for step in range(1, 560):
-        bpy.context.scene.frame_set(step)
-        #if render:
-        #    render_frame(step)
-    return 560
 
 def tie_knot_7(params, chain=False, render=True):
-    piece = "Cylinder"
+    rope = get_rope("Cylinder")
     last = params["num_segments"]-1
-    end1 = get_piece(piece, -1)
-    end2 = get_piece(piece, last)
+    end1 = rope[0]
+    end2 = rope[last]
     for i in range(last+1):
-        obj = get_piece(piece, i if i != 0 else -1)
-        take_action(obj, 1, (0,0,0), animate=(i==0 or i==last))
+        take_action(rope[i], 1, (0,0,0), animate=(i==0 or i==last))
 
     take_action(end2, 80, (11,0,3))
     take_action(end1, 80, (-7,2,-1))
@@ -213,45 +158,8 @@ def tie_knot_7(params, chain=False, render=True):
     take_action(end2, 180, (0,6,-1))
 
 def tie_cornell1_knot(params, chain=False, render=True):
-    piece = "Cylinder"
-    last = params["num_segments"]-1
-    end1 = get_piece(piece, -1)
-    end2 = get_piece(piece, last)
-    for i in range(last+1):
-        obj = get_piece(piece, i if i != 0 else -1)
-        take_action(obj, 1, (0,0,0), animate=(i==0 or i==last))
-
-    # make center loop
-    take_action(end2, 80, (10,1,5))
-    # take_action(end2, 120, (3,1,-3))
-    take_action(end2, 120, (3,2,-3))
-    take_action(end2, 160, (0,-3,-2))
-    take_action(end2, 200, (0,-2,-4))
-    toggle_animation(end2, 200, False)
-    toggle_animation(end2, 200, True)
-    take_action(end2, 240, (0,-1,2))
-    take_action(end2, 280, (-4,3,-2))
+    return tie_knot(params, "cornell1", render=render)
 
-    # move other end across
-    take_action(end1, 80, (-10,1,5))
-    take_action(end1, 120, (-5,0,0))
-    take_action(end1, 160, (0,-2,-4))
-    toggle_animation(end1, 160, False)
-    toggle_animation(end1, 160, True)
-    take_action(end2, 320, (0,-1,0))
-    # take_action(end2, 320, (1,-1,0))
-    take_action(end1, 360, (6,0,-5))
-    # take_action(end1, 360, (5,0,-5))
-    toggle_animation(end1, 360, False)
-    toggle_animation(end2, 360, False)
-
-    settle_time = 10
-    ## Reidemeister
-    for step in range(1, 360+settle_time):
-        bpy.context.scene.frame_set(step)
-        if render:
-           render_frame(step, render_offset=render_offset)
-    return 360
 
 def tie_cornell2_knot(params, chain=False, render=False):
     end_frame = tie_pretzel_knot(params, chain=chain, render=render)
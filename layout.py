@@ -0,0 +1,14 @@
+import os
+import json
+
+'''On-disk layout of a dataset and of the knot trajectories, shared by the Blender scripts and the plain-Python tools (no bpy import).'''
+
+# (folder, filename pattern) of every per-frame output; the pattern takes the frame index
+OUTPUT_FILES = [("images", "%06d_rgb.png"), ("images_depth", "%06d_rgb.png"), ("image_masks", "%06d_visible_mask.png")]
+
+TRAJECTORY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "trajectories") # Independent of the cwd, which render.py moves to out_dir
+
+def load_trajectory(name):
+    # Loads a knot trajectory from trajectories/<name>.json
+    with open(os.path.join(TRAJECTORY_DIR, "%s.json" % name), "r") as f:
+        return json.load(f)
@@ -1,15 +1,41 @@
 import os
+import cv2
 import argparse
+import subprocess
+import numpy as np
+from multiprocessing import Pool
+from annotations import open_annotations
+from vis import draw_keypoints
+
+WORKER_STATE = {}
+
+def init_worker(dir):
+    WORKER_STATE["knots_info"] = open_annotations(dir)
+    WORKER_STATE["dir"] = dir
+
+def compose_frame(idx):
+    # Reads the RGB frame, draws its annotations in memory and returns the side-by-side (rgb | annotated) frame as raw bytes
+    img = cv2.imread(os.path.join(WORKER_STATE["dir"], "%06d_rgb.png" % idx))
+    annotated = img.copy()
+    if idx in WORKER_STATE["knots_info"]:
+        draw_keypoints(annotated, WORKER_STATE["knots_info"][idx])
+    return np.hstack((img, annotated)).tobytes()
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-d', '--dir', type=str, default='images')
+    parser.add_argument('-o', '--output', type=str, default='output.mp4')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count())
     args = parser.parse_args()
-    # Generate annotation visualizations
-    os.system('python vis.py --dir {}'.format(args.dir))
-    # Make a video of rendered RGB frames
-    os.system('cd ./{} && ffmpeg -y -framerate 15 -i %06d_rgb.png -pix_fmt yuv420p out.mp4 && cd ..'.format(args.dir))
-    # Make a video of rendered annotations
-    os.system('cd ./annotated && ffmpeg -y -framerate 15 -i %06d_annotated.png -pix_fmt yuv420p out.mp4 && cd ..')
-    # Concatenate videos side by side
-    os.system("ffmpeg -y -i {}/out.mp4 -i annotated/out.mp4 -filter_complex '[0:v]pad=iw*2:ih[int];[int][1:v]overlay=W/2:0[vid]' -map [vid] -c:v libx264 -crf 23 -preset veryfast output.mp4".format(args.dir))
+    num_frames = 0
+    while os.path.exists(os.path.join(args.dir, "%06d_rgb.png" % num_frames)):
+        num_frames += 1
+    height, width = cv2.imread(os.path.join(args.dir, "%06d_rgb.png" % 0)).shape[:2]
+    # Single encoder fed raw side-by-side frames over stdin; decode + draw run in the pool while ffmpeg encodes
+    ffmpeg = subprocess.Popen(['ffmpeg', '-y', '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', '%dx%d' % (2*width, height), '-framerate', '15', '-i', '-',
+                               '-c:v', 'libx264', '-crf', '23', '-preset', 'veryfast', '-pix_fmt', 'yuv420p', args.output], stdin=subprocess.PIPE)
+    with Pool(max(args.workers, 1), initializer=init_worker, initargs=(args.dir,)) as pool:
+        for frame in pool.imap(compose_frame, range(num_frames), chunksize=4):
+            ffmpeg.stdin.write(frame)
+    ffmpeg.stdin.close()
+    ffmpeg.wait()
@@ -0,0 +1,77 @@
+import os
+import sys
+import json
+import hashlib
+import argparse
+
+'''Append-only record of the finished episodes of a dataset run, so an interrupted run can resume (render.py -- --resume).
+
+manifest.jsonl holds one JSON line per finished episode, written after all of its frames are on disk: the episode number, knot,
+seeds, the frame indices it rendered, the render_offset that continues the frame numbering, and the md5 of every file it wrote.
+A crash only loses the episode in progress; its frames are discarded on resume since they come after the manifest's last frame.
+Usage: python manifest.py . (summarizes the manifest and re-checks every file against its checksum)'''
+
+MANIFEST_FILENAME = "manifest.jsonl"
+
+def file_checksum(path, chunk_size=1 << 20):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+class Manifest(object):
+    def __init__(self, dir):
+        # Loads dir/manifest.jsonl if it exists (ignoring a partially written last line)
+        self.dir = dir
+        self.path = os.path.join(dir, MANIFEST_FILENAME)
+        self.episodes = []
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                for line in f:
+                    try:
+                        self.episodes.append(json.loads(line))
+                    except ValueError:
+                        break
+
+    def completed(self):
+        return set(record["episode"] for record in self.episodes)
+
+    def render_offset(self):
+        # render_offset after the last finished episode (0 for a new run)
+        return self.episodes[-1]["render_offset"] if self.episodes else 0
+
+    def num_frames(self):
+        # One past the highest frame index of the finished episodes; anything at or above it is from an unfinished episode
+        return max([max(record["frames"]) + 1 for record in self.episodes if record["frames"]] + [0])
+
+    def append(self, episode, frames, files, **info):
+        # Records a finished episode; files are paths relative to dir, checksummed now
+        record = dict(info, episode=episode, frames=sorted(frames), files={name: file_checksum(os.path.join(self.dir, name)) for name in files})
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record, sort_keys=True) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.episodes.append(record)
+        return record
+
+    def verify(self):
+        # Names of recorded files that are missing or no longer match their checksum
+        bad = []
+        for record in self.episodes:
+            for name, checksum in sorted(record["files"].items()):
+                path = os.path.join(self.dir, name)
+                if not os.path.exists(path) or file_checksum(path) != checksum:
+                    bad.append(name)
+        return bad
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('dir', type=str, nargs='?', default='.')
+    args = parser.parse_args()
+    manifest = Manifest(args.dir)
+    print("%d episodes, %d frames, %d files" % (len(manifest.episodes), sum(len(r["frames"]) for r in manifest.episodes), sum(len(r["files"]) for r in manifest.episodes)))
+    bad = manifest.verify()
+    for name in bad:
+        print("missing or modified:", name)
+    sys.exit(1 if bad else 0)
@@ -0,0 +1,169 @@
+import bpy
+import numpy as np
+
+import os
+import sys
+sys.path.append(os.getcwd())
+
+from rigidbody_rope import *
+from render import set_animation_settings, set_render_settings, take_action, toggle_animation, find_knot, render_frame
+import knots
+import annotations
+
+'''Usage: blender -b -P multi_rope.py -- --ropes 4 --iters 2
+Simulates several independent ropes in one rigid body world so each frame_set advances all of them. Each rope has its own
+table (and collision collection, so ropes never test against each other), camera and output folder rope_XX/.'''
+
+KNOT_NAMES = ["pretzel", "figure_eight"]
+
+def make_ropes(params, num_ropes, direct=False):
+    # Builds num_ropes rope/table/camera sets spaced along y; offsets are only along y so reidemeister's absolute x targets still apply
+    assert num_ropes <= 20, "Blender rigid bodies only have 20 collision collections"
+    spacing = params["table_size"] + 10
+    ropes = []
+    for k in range(num_ropes):
+        piece = "Cylinder" if k == 0 else "Rope%02d" % k
+        offset = (0, k*spacing, 0)
+        handle = make_capsule_rope(params, piece, offset, collision_collection=k)
+        rig_rope(params, 'cable', direct=direct, piece=piece, offset=offset)
+        camera = add_camera_light(offset, light=(k == 0))
+        ropes.append({"piece": piece, "rope": handle, "offset": offset, "camera": camera, "out_dir": "rope_%02d" % k})
+    return ropes
+
+def make_tables(params, ropes):
+    for k, rope in enumerate(ropes):
+        make_table(params, rope["offset"], collision_collection=k)
+
+def render_ropes(step, render_offset, ropes, annot=True):
+    # Renders the current frame once per rope through that rope's camera; update_curve_rig poses every rope's curve, so it runs
+    # once per rendered frame here rather than once per rope in render_frame
+    scene = bpy.context.scene
+    if (step - render_offset) % 2 == 0: # render_frame's default step
+        update_curve_rig()
+    for rope in ropes:
+        scene.camera = rope["camera"]
+        render_frame(step, render_offset=render_offset, annot=annot, mapping=rope["mapping"], out_dir=rope["out_dir"], piece=rope["piece"], update_rig=False)
+
+def tie_knots(params, ropes, knot_names):
+    # Keyframes one knot trajectory per rope, then simulates them all in a single frame loop
+    trajectories = [knots.load_trajectory(name) for name in knot_names]
+    for rope, trajectory in zip(ropes, trajectories):
+        knots.compile_trajectory(params, trajectory, piece=rope["piece"])
+    settle_start = max(knots.last_event_frame(t) for t in trajectories) + 1
+    for step in range(1, settle_start):
+        bpy.context.scene.frame_set(step)
+    step = settle_start - 1
+    for step, _ in knots.settle_frames(params, settle_start, max(t["sim_frames"] for t in trajectories), "tie", [rope["piece"] for rope in ropes]):
+        pass
+    return min(max(t["end_frame"] for t in trajectories), step + 1)
+
+def reidemeister_ropes(params, ropes, start_frame):
+    # render.reidemeister for every rope at once
+    last = params["num_segments"]-1
+    middle_frame = start_frame+25
+    end_frame = start_frame+75
+    for rope in ropes:
+        take_action(rope["rope"][last], middle_frame, (-6-rope["rope"].read().positions[last,0],np.random.uniform(-2,2),0))
+    for step in range(start_frame, middle_frame):
+        bpy.context.scene.frame_set(step)
+    for rope in ropes:
+        end1 = rope["rope"][0]
+        end2 = rope["rope"][last]
+        take_action(end1, end_frame, (9-rope["rope"].read().positions[0,0],np.random.uniform(-2,2),0))
+        # Drop the ends
+        toggle_animation(end1, end_frame, False)
+        toggle_animation(end2, end_frame, False)
+    for step in range(middle_frame, end_frame):
+        bpy.context.scene.frame_set(step)
+    return end_frame
+
+def undo_action_oracle_ropes(params, ropes, start_frame, render=False, render_offset=0):
+    # render.take_undo_action_oracle for every rope at once; each rope gets its own pull/hold from find_knot and its own noise
+    end_frame = start_frame + 100
+    actions = []
+    for rope in ropes:
+        pull_idx, hold_idx, action_vec = find_knot(len(rope["rope"]), piece=rope["piece"])
+        action_vec = np.array(action_vec) + np.random.uniform(-0.5, 0.5, 3)
+        action_vec /= np.linalg.norm(action_vec)
+        action_vec *= 2
+        pull_cyl = rope["rope"][pull_idx]
+        hold_cyl = rope["rope"][hold_idx]
+        take_action(hold_cyl, end_frame, (0,0,0))
+        actions.append((pull_cyl, hold_cyl, action_vec))
+
+    for step in range(start_frame, start_frame + 10):
+        bpy.context.scene.frame_set(step)
+        if render and (abs(step-start_frame) < 5 or abs(step-(start_frame+10)) < 5):
+            render_ropes(step, render_offset, ropes)
+        elif render:
+            render_offset += 1
+
+    for pull_cyl, hold_cyl, action_vec in actions:
+        take_action(pull_cyl, end_frame, action_vec)
+        ## Release both pull, hold
+        toggle_animation(pull_cyl, end_frame, False)
+        toggle_animation(hold_cyl, end_frame, False)
+    settle_time = 30 # At most; the settle stops once every rope is at rest
+    for step in range(start_frame + 10, end_frame):
+        bpy.context.scene.frame_set(step)
+        if render and abs(step-(start_frame+10)) < 2:
+            render_ropes(step, render_offset, ropes)
+        elif render:
+            render_offset += 1
+    step = end_frame - 1
+    for step, settled in knots.settle_frames(params, end_frame, end_frame+settle_time, "loosen", [rope["piece"] for rope in ropes]):
+        if render and (settled or step == end_frame+settle_time-1):
+            render_ropes(step, render_offset, ropes)
+        elif render:
+            render_offset += 1
+    return step+1, render_offset
+
+def generate_multi_dataset(params, ropes, iters=1, render=False):
+    # generate_dataset with all ropes sharing every simulated frame; each rope writes to its own rope_XX/ folder
+    set_animation_settings(15000)
+    for rope in ropes:
+        for folder in ["images", "images_depth", "image_masks"]:
+            os.makedirs(os.path.join(rope["out_dir"], folder), exist_ok=True)
+        rope["mapping"] = annotations.AnnotationWriter(os.path.join(rope["out_dir"], "images"))
+    render_offset = 0
+    num_loosens = 5
+    for i in range(iters):
+        print("Episode %d/%d" % (i+1, iters), flush=True)
+        knot_names = [KNOT_NAMES[k] for k in np.random.randint(len(KNOT_NAMES), size=len(ropes))]
+        knot_end_frame = tie_knots(params, ropes, knot_names)
+        reid_end_frame = reidemeister_ropes(params, ropes, knot_end_frame)
+        render_offset += reid_end_frame
+        loosen_start = reid_end_frame
+        for _ in range(num_loosens):
+            loosen_start, render_offset = undo_action_oracle_ropes(params, ropes, loosen_start, render=render, render_offset=render_offset)
+        render_offset -= loosen_start
+        # Delete all keyframes to make new knots and reset the frame counter
+        bpy.context.scene.frame_set(0)
+        for a in bpy.data.actions:
+            bpy.data.actions.remove(a)
+    for rope in ropes:
+        rope["mapping"].close()
+
+if __name__ == '__main__':
+    import argparse
+    argv = sys.argv[sys.argv.index('--')+1:] if '--' in sys.argv else []
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ropes', type=int, default=4)
+    parser.add_argument('--iters', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--direct_rig', action='store_true')
+    args = parser.parse_args(argv)
+    if args.seed is not None:
+        random.seed(args.seed)
+        np.random.seed(args.seed)
+    with open("rigidbody_params.json", "r") as f:
+        params = json.load(f)
+    clear_scene()
+    ropes = make_ropes(params, args.ropes, direct=args.direct_rig)
+    set_render_settings(params["engine"],(params["render_width"],params["render_height"]))
+    make_tables(params, ropes)
+    start = time.time()
+    generate_multi_dataset(params, ropes, iters=args.iters, render=True)
+    end = time.time()
+    num_samples = sum(len(annotations.AnnotationReader(os.path.join(rope["out_dir"], "images"))) for rope in ropes)
+    print("Time:", end-start, "Samples/s:", num_samples/(end-start))
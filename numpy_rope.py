@@ -0,0 +1,296 @@
+import json
+import time
+import argparse
+import numpy as np
+
+from layout import load_trajectory
+
+'''Headless position-based (XPBD-style, zero compliance) capsule-chain rope simulator in pure NumPy.
+
+Mirrors the Blender rope from rigidbody_rope.make_capsule_rope: num_segments capsules of segment_radius spaced 2*radius
+apart along x, a passive table plane at z=-5, and kinematic grasps keyframed through take_action/toggle_animation.
+A RopeBatch steps batch_size independent ropes at once.
+Usage: python numpy_rope.py -k pretzel -b 8'''
+
+GRAVITY = np.array([0.0, 0.0, -9.81])
+TABLE_Z = -5.0 # make_table places the plane at z=-5
+TABLE_FRICTION = 0.8 # make_table sets the table friction to 0.8; Bullet multiplies the two frictions
+
+def closest_segment_params(a0, a1, b0, b1):
+    # Parameters (s, t) of the closest points between segments a0-a1 and b0-b1 (batched over the leading axes)
+    d1 = a1 - a0
+    d2 = b1 - b0
+    r = a0 - b0
+    a = np.sum(d1*d1, axis=-1)
+    e = np.sum(d2*d2, axis=-1)
+    f = np.sum(d2*r, axis=-1)
+    c = np.sum(d1*r, axis=-1)
+    b = np.sum(d1*d2, axis=-1)
+    denom = a*e - b*b
+    s = np.where(denom > 1e-12, np.clip((b*f - c*e) / np.where(denom > 1e-12, denom, 1), 0, 1), 0)
+    t = (b*s + f) / e
+    s = np.where(t < 0, np.clip(-c/a, 0, 1), np.where(t > 1, np.clip((b-c)/a, 0, 1), s))
+    t = np.clip(t, 0, 1)
+    return s, t
+
+def smoothstep(u):
+    # Approximates Blender's auto-clamped bezier keyframes between two keys
+    return u*u*(3 - 2*u)
+
+class KeyTable(object):
+    '''Every {frame: value} key channel of a batch flattened into sorted arrays, so all channels are evaluated at a frame with a
+    few array operations: keys are grouped by channel and sorted by frame, channel c owning rows start[c]:start[c]+count[c]'''
+    def __init__(self, channels):
+        # channels: list of (rope, seg, {frame: value}) with at least one key each
+        self.rope = np.array([rope for rope, _, _ in channels], dtype=np.int64)
+        self.seg = np.array([seg for _, seg, _ in channels], dtype=np.int64)
+        self.count = np.array([len(keys) for _, _, keys in channels], dtype=np.int64)
+        self.start = np.cumsum(self.count) - self.count
+        self.channel = np.repeat(np.arange(len(channels)), self.count)
+        self.frames = np.array([frame for _, _, keys in channels for frame in sorted(keys)], dtype=np.float64)
+        self.values = np.array([keys[frame] for _, _, keys in channels for frame in sorted(keys)])
+
+    def keys_before(self, frame, inclusive=False):
+        # Number of keys of each channel at (or with inclusive, up to and including) frame
+        before = self.frames <= frame if inclusive else self.frames < frame
+        return np.bincount(self.channel, weights=before, minlength=len(self.count)).astype(np.int64)
+
+    def step(self, frame):
+        # Constant interpolation (like the rigid_body.kinematic F-curves): the last key at or before frame, else the first key
+        return self.values[self.start + np.maximum(self.keys_before(frame, inclusive=True) - 1, 0)]
+
+    def interpolate(self, frame):
+        # Eased interpolation between the keys around frame, holding the first/last key outside their range
+        before = self.keys_before(frame)
+        lo = self.start + np.clip(before - 1, 0, self.count - 1)
+        hi = self.start + np.clip(before, 0, self.count - 1)
+        span = self.frames[hi] - self.frames[lo]
+        u = smoothstep(np.where(span > 0, (frame - self.frames[lo]) / np.where(span > 0, span, 1), 0))
+        return (1-u)[:,None]*self.values[lo] + u[:,None]*self.values[hi]
+
+class RopeBatch(object):
+    def __init__(self, params, batch_size=1, fps=24, steps_per_second=120, solver_iterations=4):
+        self.params = params
+        self.batch_size = batch_size
+        self.n = params["num_segments"]
+        self.radius = params["segment_radius"]
+        self.inv_mass = 1.0 / params["segment_mass"]
+        self.friction = params["segment_friction"] * TABLE_FRICTION
+        self.linear_damping = params["linear_damping"]
+        self.angular_damping = params["angular_damping"]
+        self.substeps = max(int(round(steps_per_second / fps)), 1)
+        self.dt = 1.0 / (fps * self.substeps)
+        self.solver_iterations = solver_iterations
+        self.rest_length = 2*self.radius
+        self.table_z = TABLE_Z + self.radius
+        # Bond k joins segments k and k+1; bonds of one parity share no segment, so each parity is solved in one vectorized pass
+        bonds = np.arange(self.n-1)
+        self.bond_parities = [bonds[0::2], bonds[1::2]]
+        # Every pair of non-adjacent bonds is a potential capsule-capsule contact
+        bi, bj = np.triu_indices(self.n-1, k=2)
+        self.pair_i, self.pair_j = bi, bj
+        self.reset()
+
+    def reset(self):
+        # Straight rope along x, exactly like make_capsule_rope lays it out
+        n, r = self.n, self.radius
+        self.x = np.zeros((self.batch_size, n, 3))
+        self.x[:,:,0] = r*n - 2*r*np.arange(n)
+        self.v = np.zeros_like(self.x)
+        self.location = self.x.copy() # The animated "location" property each take_action adds its displacement to
+        self.kinematic = np.zeros((self.batch_size, n), dtype=bool)
+        self.targets = self.x.copy()
+        self.keys = [dict() for _ in range(self.batch_size)] # rope -> segment -> {"loc": {frame: pos}, "kin": {frame: bool}}
+        self.key_tables = None # KeyTables compiled from self.keys, rebuilt after the keys change
+        self.frame = 1
+
+    def segment_keys(self, rope, seg):
+        # Every keyframe edit goes through here, so this is where the compiled tables are dropped
+        self.key_tables = None
+        return self.keys[rope].setdefault(seg % self.n, {"loc": {}, "kin": {}})
+
+    def toggle_animation(self, rope, seg, frame, animate):
+        # Sets segment seg of rope to be animable or non-animable at particular frame
+        seg = seg % self.n
+        self.kinematic[rope, seg] = animate
+        self.segment_keys(rope, seg)["kin"][frame] = animate
+
+    def take_action(self, rope, seg, frame, action_vec, animate=True):
+        # Keyframes a displacement for segment seg of rope given by action_vec at given frame (same semantics as knots.take_action)
+        seg = seg % self.n
+        keys = self.segment_keys(rope, seg)
+        if animate != self.kinematic[rope, seg]:
+            # We are "picking up" a dropped segment, so we need its updated location
+            self.location[rope, seg] = self.x[rope, seg]
+            keys["loc"][self.frame] = self.location[rope, seg].copy()
+        self.toggle_animation(rope, seg, self.frame, animate)
+        self.location[rope, seg] += np.asarray(action_vec, dtype=float)
+        keys["loc"][frame] = self.location[rope, seg].copy()
+
+    def apply_trajectory(self, rope, trajectory):
+        # Equivalent of knots.compile_trajectory for one rope: pin every segment, then keyframe the ends' waypoints and releases
+        ends = {end["segment"] % self.n: end for end in trajectory["ends"]}
+        for i in range(self.n):
+            self.take_action(rope, i, 1, (0,0,0), animate=(i in ends))
+        for i, end in ends.items():
+            for frame, delta in end["waypoints"]:
+                self.take_action(rope, i, frame, delta)
+            for frame, value in end["kinematic"]:
+                self.segment_keys(rope, i)["kin"][frame] = value
+
+    def compile_keys(self):
+        channels = [(rope, seg, keys) for rope, rope_keys in enumerate(self.keys) for seg, keys in sorted(rope_keys.items())]
+        self.key_tables = (KeyTable([(rope, seg, keys["kin"]) for rope, seg, keys in channels if keys["kin"]]),
+                           KeyTable([(rope, seg, keys["loc"]) for rope, seg, keys in channels if keys["loc"]]))
+
+    def evaluate_keys(self, frame):
+        # Updates kinematic flags and grasp targets of the whole batch from the keyframes at a (fractional) frame
+        if self.key_tables is None:
+            self.compile_keys()
+        kin, loc = self.key_tables
+        if len(kin.count):
+            self.kinematic[kin.rope, kin.seg] = kin.step(frame)
+        if len(loc.count):
+            grasped = self.kinematic[loc.rope, loc.seg]
+            self.targets[loc.rope[grasped], loc.seg[grasped]] = loc.interpolate(frame)[grasped]
+
+    def frame_set(self, frame):
+        # Simulates forward until the batch reaches frame (like scene.frame_set on a fresh point cache, only forwards)
+        while self.frame < frame:
+            for k in range(self.substeps):
+                self.evaluate_keys(self.frame + (k+1.0)/self.substeps)
+                self.substep()
+            self.frame += 1
+
+    def substep(self):
+        dt = self.dt
+        dynamic = ~self.kinematic
+        w = np.where(dynamic, self.inv_mass, 0.0)
+        self.v[dynamic] += GRAVITY*dt
+        self.v *= (1 - self.linear_damping)**dt
+        self.damp_rotation(w)
+        p = self.x + self.v*dt
+        p[self.kinematic] = self.targets[self.kinematic]
+        predicted_z = p[...,2].copy()
+        contacts = self.find_contacts(p)
+        for _ in range(self.solver_iterations):
+            self.solve_distances(p, w)
+            self.solve_contacts(p, w, contacts)
+            p[...,2] = np.where(dynamic, np.maximum(p[...,2], self.table_z), p[...,2])
+        v = (p - self.x) / dt
+        # Coulomb friction against the table: the normal correction bounds how much tangential velocity is removed
+        normal_dv = np.where(dynamic, np.maximum(self.table_z - predicted_z, 0), 0) / dt
+        tangential = v[...,:2]
+        speed = np.linalg.norm(tangential, axis=-1)
+        scale = np.where(normal_dv > 0, np.maximum(0, 1 - self.friction*normal_dv / np.maximum(speed, 1e-9)), 1)
+        v[...,:2] = tangential * scale[...,None]
+        self.x = p
+        self.v = v
+
+    def damp_rotation(self, w):
+        # Segments have no orientation of their own (see transforms()), so angular damping acts on the bonds: the part of
+        # each bond's relative end velocity perpendicular to it (the bond spinning about its center) decays like Bullet's
+        # angular velocity does, (1 - angular_damping)^dt, without changing the pair's momentum
+        factor = 1 - (1 - self.angular_damping)**self.dt
+        for bonds in self.bond_parities:
+            wa, wb = w[:,bonds], w[:,bonds+1]
+            wsum = wa + wb
+            d = self.x[:,bonds+1] - self.x[:,bonds]
+            d /= np.maximum(np.linalg.norm(d, axis=-1, keepdims=True), 1e-12)
+            rel = self.v[:,bonds+1] - self.v[:,bonds]
+            spin = rel - np.sum(rel*d, axis=-1, keepdims=True)*d
+            dv = factor * spin / np.where(wsum > 0, wsum, 1)[...,None]
+            self.v[:,bonds] += wa[...,None] * dv
+            self.v[:,bonds+1] -= wb[...,None] * dv
+
+    def solve_distances(self, p, w):
+        # Keeps consecutive segments at the rest separation (the point constraints of make_capsule_rope)
+        for bonds in self.bond_parities:
+            wa, wb = w[:,bonds], w[:,bonds+1]
+            d = p[:,bonds+1] - p[:,bonds]
+            length = np.linalg.norm(d, axis=-1)
+            wsum = wa + wb
+            s = np.where(wsum > 0, (length - self.rest_length) / np.maximum(wsum*length, 1e-12), 0)
+            p[:,bonds] += (wa*s)[...,None] * d
+            p[:,bonds+1] -= (wb*s)[...,None] * d
+
+    def find_contacts(self, p):
+        # Broad phase: non-adjacent bond pairs whose midpoints are close enough for their capsules to touch this substep
+        mid = 0.5*(p[:,:-1] + p[:,1:])
+        dist = np.linalg.norm(mid[:,self.pair_i] - mid[:,self.pair_j], axis=-1)
+        rope, pair = np.nonzero(dist < 2*self.rest_length + self.radius)
+        return rope, self.pair_i[pair], self.pair_j[pair]
+
+    def solve_contacts(self, p, w, contacts):
+        # Narrow phase + projection: pushes overlapping capsules (radius r around each bond) apart along their closest points
+        rope, ia, ib = contacts
+        if len(rope) == 0:
+            return
+        a0, a1, b0, b1 = p[rope,ia], p[rope,ia+1], p[rope,ib], p[rope,ib+1]
+        s, t = closest_segment_params(a0, a1, b0, b1)
+        diff = (a0 + s[:,None]*(a1-a0)) - (b0 + t[:,None]*(b1-b0))
+        dist = np.linalg.norm(diff, axis=-1)
+        penetration = 2*self.radius - dist
+        active = (penetration > 0) & (dist > 1e-9)
+        if not np.any(active):
+            return
+        rope, ia, ib, s, t = rope[active], ia[active], ib[active], s[active], t[active]
+        normal = diff[active] / dist[active][:,None]
+        idx = np.concatenate([rope*self.n + ia, rope*self.n + ia + 1, rope*self.n + ib, rope*self.n + ib + 1])
+        weights = np.concatenate([1-s, s, -(1-t), -t])
+        wi = w.reshape(-1)[idx]
+        denom = np.sum((wi*weights*weights).reshape(4, -1), axis=0)
+        lam = np.where(denom > 0, penetration[active] / np.maximum(denom, 1e-12), 0)
+        impulse = (wi*weights*np.tile(lam, 4))[:,None] * np.tile(normal, (4, 1))
+        size = self.batch_size*self.n
+        count = np.maximum(np.bincount(idx, minlength=size), 1)
+        delta = np.stack([np.bincount(idx, impulse[:,k], minlength=size) for k in range(3)], axis=-1)
+        p += (delta / count[:,None]).reshape(p.shape)
+
+    def positions(self):
+        # (batch_size, num_segments, 3) segment centers
+        return self.x.copy()
+
+    def transforms(self):
+        # (batch_size, num_segments, 4, 4) capsule world matrices: local z along the rope (make_capsule_rope rotates the mesh so it lies along the chain), scaled by radius
+        tangent = np.zeros_like(self.x)
+        tangent[:,1:-1] = self.x[:,2:] - self.x[:,:-2]
+        tangent[:,0] = self.x[:,1] - self.x[:,0]
+        tangent[:,-1] = self.x[:,-1] - self.x[:,-2]
+        z = tangent / np.maximum(np.linalg.norm(tangent, axis=-1, keepdims=True), 1e-12)
+        helper = np.where(np.abs(z[...,2:3]) < 0.9, np.array([0.0, 0.0, 1.0]), np.array([1.0, 0.0, 0.0]))
+        x = np.cross(helper, z)
+        x /= np.linalg.norm(x, axis=-1, keepdims=True)
+        y = np.cross(z, x)
+        mats = np.zeros(self.x.shape[:2] + (4, 4))
+        mats[...,:3,0] = x*self.radius
+        mats[...,:3,1] = y*self.radius
+        mats[...,:3,2] = z*self.radius
+        mats[...,:3,3] = self.x
+        mats[...,3,3] = 1
+        return mats
+
+def tie_knot(sim, names):
+    # Ties one knot per rope (names is a knot name or one name per rope) and simulates until it settles; returns the end frame
+    if isinstance(names, str):
+        names = [names]*sim.batch_size
+    trajectories = [load_trajectory(name) for name in names]
+    for rope, trajectory in enumerate(trajectories):
+        sim.apply_trajectory(rope, trajectory)
+    sim.frame_set(max(trajectory["sim_frames"] for trajectory in trajectories) - 1)
+    return max(trajectory["end_frame"] for trajectory in trajectories)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-k', '--knot', type=str, default='pretzel')
+    parser.add_argument('-b', '--batch_size', type=int, default=1)
+    parser.add_argument('-i', '--iterations', type=int, default=4)
+    args = parser.parse_args()
+    with open("rigidbody_params.json", "r") as f:
+        params = json.load(f)
+    sim = RopeBatch(params, batch_size=args.batch_size, solver_iterations=args.iterations)
+    start = time.time()
+    end_frame = tie_knot(sim, args.knot)
+    elapsed = time.time() - start
+    simulated = args.batch_size * (sim.frame - 1) / 24.0
+    print("Tied %d x %s (%d frames) in %.2fs: %.1fx real-time" % (args.batch_size, args.knot, sim.frame - 1, elapsed, simulated / elapsed))
@@ -0,0 +1,58 @@
+import os
+import tempfile
+import numpy as np
+
+'''Shared-memory observation buffers for the rope environments (rope_env.py in Blender, vec_env.py outside it).
+
+One file holds every field of every environment as (num_envs, ...) arrays; the Blender workers and the policy process memory-map
+the same file, so each worker writes its observation into its own slot and the policy reads the batch without copying or
+touching the disk. Files go to /dev/shm where it exists (RAM-backed on Linux), so it works with Blender 2.80's Python 3.7, which
+predates multiprocessing.shared_memory.'''
+
+ALIGNMENT = 64
+
+def observation_spec(num_segments, width, height, rgb=False):
+    # (name, dtype, per-environment shape) of every observation field
+    spec = [("positions", "<f4", (num_segments, 3)),
+            ("depth", "u1", (height, width)),
+            ("mask", "u1", (height, width))]
+    if rgb:
+        spec.append(("rgb", "u1", (height, width, 3)))
+    return spec
+
+def shm_path(prefix="rope_obs_"):
+    dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    fd, path = tempfile.mkstemp(prefix=prefix, dir=dir)
+    os.close(fd)
+    return path
+
+class ObservationBuffer(object):
+    def __init__(self, path, spec, num_envs, create=False):
+        # Maps path as one (num_envs, ...) array per field of spec; create=True sizes (and zeroes) the file first
+        self.path = path
+        self.spec = [(name, np.dtype(dtype), tuple(shape)) for name, dtype, shape in spec]
+        self.num_envs = num_envs
+        layout = []
+        offset = 0
+        for name, dtype, shape in self.spec:
+            layout.append((name, dtype, shape, offset))
+            size = num_envs * dtype.itemsize * int(np.prod(shape))
+            offset += -(-size // ALIGNMENT) * ALIGNMENT
+        if create:
+            with open(path, 'wb') as f:
+                f.truncate(offset)
+        self.memory = np.memmap(path, dtype=np.uint8, mode='r+', shape=(offset,))
+        self.arrays = {name: np.ndarray((num_envs,) + shape, dtype=dtype, buffer=self.memory, offset=start) for name, dtype, shape, start in layout}
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def slot(self, env):
+        # Views of one environment's fields
+        return {name: array[env] for name, array in self.arrays.items()}
+
+    def close(self, unlink=False):
+        self.arrays = {}
+        self.memory = None
+        if unlink and os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,181 @@
+import os
+import argparse
+import numpy as np
+
+'''Analytic depth and visible-mask rasterizer for the capsule rope, in NumPy (no Blender needed).
+
+Each segment is the capsule mesh from make_capsule_rope: radius 1 with cap centers at local z = +-0.5, posed by its 4x4 world
+matrix (which carries the segment_radius scale), e.g. obj.matrix_world, checkpoint matrices or numpy_rope's RopeBatch.transforms().
+Every pixel's ray is intersected with every capsule whose screen-space box it falls in, and the nearest hit wins, so capsules
+occlude each other. Images follow the compositor passes in render.make_pass_nodes: depth is the inverted depth normalized
+between the table (0) and the nearest rope point (255), and the mask is its ceil (255 wherever the rope is visible).
+Usage: python rasterize.py knot_cache/pretzel_<hash>_0.npz -o passes'''
+
+TABLE_Z = -5.0 # make_table places the plane at z=-5
+CAMERA_LOCATION = (2, 0, 28) # add_camera_light, looking straight down -z
+
+def camera_intrinsics(width, height, lens=50.0, sensor_width=36.0, sensor_height=24.0, sensor_fit='AUTO'):
+    # 3x3 pinhole matrix of a Blender perspective camera (square pixels; sensor fit like Blender's AUTO/HORIZONTAL/VERTICAL)
+    if sensor_fit == 'VERTICAL' or (sensor_fit == 'AUTO' and height > width):
+        f = lens / (sensor_height if sensor_fit == 'VERTICAL' else sensor_width) * height
+    else:
+        f = lens / sensor_width * width
+    return np.array([[f, 0, width/2.0], [0, f, height/2.0], [0, 0, 1]])
+
+def camera_from_blender(camera, scene):
+    # (intrinsics, camera-to-world matrix, (width, height)) of a bpy perspective camera object, for rasterize()
+    scale = scene.render.resolution_percentage / 100
+    size = (int(scene.render.resolution_x * scale), int(scene.render.resolution_y * scale))
+    K = camera_intrinsics(size[0], size[1], camera.data.lens, camera.data.sensor_width, camera.data.sensor_height, camera.data.sensor_fit)
+    return K, np.array(camera.matrix_world.normalized()), size
+
+def default_camera(width=640, height=480):
+    # The camera add_camera_light creates, without Blender
+    cam_to_world = np.eye(4)
+    cam_to_world[:3,3] = CAMERA_LOCATION
+    return camera_intrinsics(width, height), cam_to_world, (width, height)
+
+def capsule_endpoints(transforms):
+    # (N,3) cap centers a, b and (N,) radii of the scaled capsule meshes
+    transforms = np.asarray(transforms, dtype=np.float64).reshape(-1, 4, 4)
+    axis = 0.5*transforms[:,:3,2]
+    centers = transforms[:,:3,3]
+    radii = np.linalg.norm(transforms[:,:3,0], axis=1)
+    return centers - axis, centers + axis, radii
+
+def pixel_rays(K, cam_to_world, us, vs):
+    # Unit world-space ray directions through pixel centers (us, vs), and the cosine between each ray and the view axis
+    x = (us + 0.5 - K[0,2]) / K[0,0]
+    y = -(vs + 0.5 - K[1,2]) / K[1,1] # image rows go down, camera y goes up
+    d = np.stack((x, y, -np.ones_like(x)), axis=-1) @ cam_to_world[:3,:3].T
+    norm = np.linalg.norm(d, axis=-1)
+    return d / norm[...,None], 1.0 / norm
+
+def intersect_capsules(ro, rd, a, b, r):
+    # Ray distance to the first hit on capsule (a, b, r), inf on a miss; all arguments broadcast (rays x capsules)
+    ba = b - a
+    oa = ro - a
+    baba = np.sum(ba*ba, axis=-1)
+    bard = np.sum(ba*rd, axis=-1)
+    baoa = np.sum(ba*oa, axis=-1)
+    rdoa = np.sum(rd*oa, axis=-1)
+    oaoa = np.sum(oa*oa, axis=-1)
+    # Cylinder body
+    qa = baba - bard*bard
+    qb = baba*rdoa - baoa*bard
+    qc = baba*oaoa - baoa*baoa - r*r*baba
+    h = qb*qb - qa*qc
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_body = (-qb - np.sqrt(np.maximum(h, 0))) / qa
+    y = baoa + t_body*bard
+    body = (h >= 0) & (qa > 1e-12) & (y > 0) & (y < baba)
+    # Hemispherical caps: the end the body hit fell beyond
+    oc = np.where((y <= 0)[...,None], oa, ro - b)
+    sb = np.sum(rd*oc, axis=-1)
+    sc = np.sum(oc*oc, axis=-1) - r*r
+    sh = sb*sb - sc
+    t_cap = -sb - np.sqrt(np.maximum(sh, 0))
+    t = np.where(body, t_body, np.where(sh > 0, t_cap, np.inf))
+    return np.where(t > 0, t, np.inf)
+
+def capsule_boxes(K, world_to_cam, a, b, r, size):
+    # Conservative pixel boxes (u0, v0, u1, v1) of each capsule, clipped to the image; empty when behind the camera
+    corners = []
+    for end in (a, b):
+        for offset in np.array([[sx, sy, sz] for sx in (-1, 1) for sy in (-1, 1) for sz in (-1, 1)]):
+            corners.append(end + offset*r[:,None])
+    corners = np.stack(corners, axis=1) @ world_to_cam[:3,:3].T + world_to_cam[:3,3]
+    z = -corners[...,2]
+    visible = np.all(z > 1e-6, axis=1)
+    z = np.maximum(z, 1e-6)
+    u = K[0,0]*corners[...,0]/z + K[0,2]
+    v = -K[1,1]*corners[...,1]/z + K[1,2]
+    u0 = np.clip(np.floor(u.min(axis=1)), 0, size[0]).astype(int)
+    u1 = np.clip(np.ceil(u.max(axis=1)) + 1, 0, size[0]).astype(int)
+    v0 = np.clip(np.floor(v.min(axis=1)), 0, size[1]).astype(int)
+    v1 = np.clip(np.ceil(v.max(axis=1)) + 1, 0, size[1]).astype(int)
+    u1 = np.where(visible, u1, u0)
+    return u0, v0, u1, v1
+
+def rasterize(transforms, K, cam_to_world, size):
+    # (height, width) planar depth (distance along the view axis, like Blender's Z pass; inf where no capsule is hit)
+    width, height = size
+    depth = np.full(height*width, np.inf)
+    a, b, r = capsule_endpoints(transforms)
+    if len(r) == 0:
+        return depth.reshape(height, width)
+    world_to_cam = np.linalg.inv(cam_to_world)
+    u0, v0, u1, v1 = capsule_boxes(K, world_to_cam, a, b, r, size)
+    # Every capsule's box is padded to the largest box, so all ray-capsule tests run as one (capsules, rows, cols) batch
+    bw, bh = (u1 - u0).max(), (v1 - v0).max()
+    if bw <= 0 or bh <= 0:
+        return depth.reshape(height, width)
+    us = u0[:,None,None] + np.arange(bw)[None,None,:]
+    vs = v0[:,None,None] + np.arange(bh)[None,:,None]
+    us, vs = np.broadcast_arrays(us, vs)
+    inside = (us < u1[:,None,None]) & (vs < v1[:,None,None])
+    rd, cos = pixel_rays(K, cam_to_world, us, vs)
+    t = intersect_capsules(cam_to_world[:3,3], rd, a[:,None,None], b[:,None,None], r[:,None,None])
+    z = (t*cos)[inside]
+    pixels = (vs*width + us)[inside]
+    hit = np.isfinite(z)
+    z, pixels = z[hit], pixels[hit]
+    # Nearest capsule per pixel: sort by depth and keep each pixel's first occurrence
+    order = np.argsort(z, kind='stable')
+    pixels, first = np.unique(pixels[order], return_index=True)
+    depth[pixels] = z[order][first]
+    return depth.reshape(height, width)
+
+def plane_depth(K, cam_to_world, size, plane_z=TABLE_Z):
+    # (height, width) planar depth of the horizontal table plane z=plane_z (inf where a ray misses it); the world z of an
+    # unnormalized pixel ray is linear in u and v, so this is an outer sum rather than a per-pixel ray cast
+    width, height = size
+    x = (np.arange(width) + 0.5 - K[0,2]) / K[0,0]
+    y = -(np.arange(height) + 0.5 - K[1,2]) / K[1,1]
+    R = cam_to_world[:3,:3]
+    dz = x[None,:]*R[2,0] + y[:,None]*R[2,1] - R[2,2]
+    with np.errstate(divide='ignore'):
+        depth = (plane_z - cam_to_world[2,3]) / dz
+    return np.where(depth > 0, depth, np.inf)
+
+def depth_and_mask(depth, background=None):
+    # 8-bit depth and mask images following the compositor's Depth -> Invert -> Normalize (-> Ceil) chain: the farthest
+    # visible surface (the table when background is given) maps to 0 and the nearest rope point to 255; the mask only covers the rope
+    visible = np.isfinite(depth)
+    scene_depth = depth if background is None else np.minimum(depth, background)
+    finite = np.isfinite(scene_depth)
+    normalized = np.zeros(depth.shape)
+    if finite.any():
+        near, far = scene_depth[finite].min(), scene_depth[finite].max()
+        normalized[finite] = (far - scene_depth[finite]) / (far - near) if far > near else 1.0
+    depth_img = np.round(255*normalized).astype(np.uint8)
+    mask_img = (np.ceil(normalized) * visible * 255).astype(np.uint8)
+    return depth_img, mask_img
+
+def render_passes(transforms, K, cam_to_world, size, table_z=TABLE_Z):
+    # Depth and mask images for one rope pose; table_z=None normalizes against the rope alone
+    background = None if table_z is None else plane_depth(K, cam_to_world, size, table_z)
+    return depth_and_mask(rasterize(transforms, K, cam_to_world, size), background)
+
+def save_passes(mask_filename, depth_filename, depth_img, mask_img):
+    # Grey images written as 3-channel PNGs, like the File Output nodes with color_mode 'RGB'
+    import cv2 # Imported here so render.py can use the rasterizer inside Blender's Python, which ships without OpenCV
+    cv2.imwrite(depth_filename, cv2.cvtColor(depth_img, cv2.COLOR_GRAY2BGR))
+    cv2.imwrite(mask_filename, cv2.cvtColor(mask_img, cv2.COLOR_GRAY2BGR))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('states', type=str, nargs='+') # .npz rope states with a "matrices" array (checkpoint.save_rope_state)
+    parser.add_argument('-o', '--out_dir', type=str, default='.')
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=480)
+    args = parser.parse_args()
+    K, cam_to_world, size = default_camera(args.width, args.height)
+    for dir in ["images_depth", "image_masks"]:
+        os.makedirs(os.path.join(args.out_dir, dir), exist_ok=True)
+    for index, path in enumerate(args.states):
+        with np.load(path) as data:
+            transforms = data["matrices"]
+        depth_img, mask_img = render_passes(transforms, K, cam_to_world, size)
+        save_passes(os.path.join(args.out_dir, "image_masks/%06d_visible_mask.png" % index), os.path.join(args.out_dir, "images_depth/%06d_rgb.png" % index), depth_img, mask_img)
+        print(path, "->", index)
@@ -0,0 +1,154 @@
+import os
+import json
+import argparse
+import numpy as np
+
+'''Append-only recording of the rope's segment transforms on every rendered frame, so a dataset can be re-rendered
+(new resolution, camera, engine or rig) by posing the segments from the recording instead of re-simulating.
+
+Each segment is stored as its position (3 x float32) and its rotation as a unit quaternion quantized to 4 x int16, i.e.
+20 bytes instead of a 64 byte matrix; the scale (segment_radius) is stored once in trajectory.json. Frames are appended to
+trajectory.bin with a (frame index, simulation frame, offset) int64 row in trajectory.idx, like the keypoint store in
+annotations.py, and the data file is memory-mapped for reading.
+Usage: python recording.py trajectory (prints a summary)'''
+
+DATA_FILENAME = "trajectory.bin"
+INDEX_FILENAME = "trajectory.idx"
+META_FILENAME = "trajectory.json"
+SEGMENT_DTYPE = np.dtype([("position", "<f4", 3), ("rotation", "<i2", 4)])
+QUAT_SCALE = 32767
+
+def matrices_to_quaternions(rotations):
+    # (N,3,3) rotation matrices -> (N,4) unit quaternions (w, x, y, z), choosing the numerically stable branch per matrix
+    m = rotations
+    trace = m[:,0,0] + m[:,1,1] + m[:,2,2]
+    candidates = np.stack([
+        np.stack([1 + trace, m[:,2,1] - m[:,1,2], m[:,0,2] - m[:,2,0], m[:,1,0] - m[:,0,1]], axis=1),
+        np.stack([m[:,2,1] - m[:,1,2], 1 + m[:,0,0] - m[:,1,1] - m[:,2,2], m[:,0,1] + m[:,1,0], m[:,0,2] + m[:,2,0]], axis=1),
+        np.stack([m[:,0,2] - m[:,2,0], m[:,0,1] + m[:,1,0], 1 - m[:,0,0] + m[:,1,1] - m[:,2,2], m[:,1,2] + m[:,2,1]], axis=1),
+        np.stack([m[:,1,0] - m[:,0,1], m[:,0,2] + m[:,2,0], m[:,1,2] + m[:,2,1], 1 - m[:,0,0] - m[:,1,1] + m[:,2,2]], axis=1),
+    ], axis=1)
+    best = np.argmax(np.stack([trace, m[:,0,0], m[:,1,1], m[:,2,2]], axis=1), axis=1)
+    q = candidates[np.arange(len(m)), best]
+    q /= np.linalg.norm(q, axis=1, keepdims=True)
+    return q * np.where(q[:,:1] < 0, -1, 1) # w >= 0, so quantization never flips between the two equivalent signs
+
+def quaternions_to_matrices(q):
+    q = q / np.linalg.norm(q, axis=1, keepdims=True)
+    w, x, y, z = q.T
+    return np.stack([
+        np.stack([1 - 2*(y*y + z*z), 2*(x*y - w*z), 2*(x*z + w*y)], axis=1),
+        np.stack([2*(x*y + w*z), 1 - 2*(x*x + z*z), 2*(y*z - w*x)], axis=1),
+        np.stack([2*(x*z - w*y), 2*(y*z + w*x), 1 - 2*(x*x + y*y)], axis=1),
+    ], axis=1)
+
+def encode(matrices):
+    # (N,4,4) segment world matrices -> N SEGMENT_DTYPE records (the uniform scale is dropped)
+    matrices = np.asarray(matrices, dtype=np.float64)
+    rotations = matrices[:,:3,:3] / np.linalg.norm(matrices[:,:3,:3], axis=1, keepdims=True)
+    records = np.empty(len(matrices), dtype=SEGMENT_DTYPE)
+    records["position"] = matrices[:,:3,3]
+    records["rotation"] = np.round(matrices_to_quaternions(rotations) * QUAT_SCALE)
+    return records
+
+def decode(records, scale):
+    matrices = np.zeros((len(records), 4, 4))
+    matrices[:,:3,:3] = quaternions_to_matrices(records["rotation"].astype(np.float64)) * scale
+    matrices[:,:3,3] = records["position"]
+    matrices[:,3,3] = 1
+    return matrices
+
+class TrajectoryWriter(object):
+    def __init__(self, dir, num_segments, scale, append=False, **meta):
+        # Opens dir/trajectory.{bin,idx} for appending; with append=False any existing recording is discarded.
+        # scale is the segments' uniform scale (segment_radius); extra keyword arguments are stored in trajectory.json
+        if not os.path.exists(dir):
+            os.makedirs(dir)
+        meta.update(num_segments=num_segments, scale=scale)
+        with open(os.path.join(dir, META_FILENAME), 'w') as f:
+            json.dump(meta, f, indent=2, sort_keys=True)
+        mode = 'ab' if append else 'wb'
+        self.num_segments = num_segments
+        self.data = open(os.path.join(dir, DATA_FILENAME), mode)
+        self.index = open(os.path.join(dir, INDEX_FILENAME), mode)
+        self.offset = self.data.tell() // SEGMENT_DTYPE.itemsize # In segments
+
+    def write(self, frame, sim_frame, matrices):
+        self.write_records(frame, sim_frame, encode(matrices))
+
+    def write_records(self, frame, sim_frame, records):
+        # Appends already encoded records (e.g. copied from a TrajectoryReader's data when merging recordings)
+        assert len(records) == self.num_segments, "recordings hold a fixed number of segments per frame"
+        self.data.write(records.tobytes())
+        self.data.flush()
+        self.index.write(np.array([int(frame), int(sim_frame), self.offset], dtype=np.int64).tobytes())
+        self.index.flush()
+        self.offset += len(records)
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def truncate(dir, num_frames):
+    # Drops the recorded frames >= num_frames so a resumed run can append after the rest (see annotations.truncate)
+    index_path = os.path.join(dir, INDEX_FILENAME)
+    if not os.path.exists(index_path):
+        return
+    with open(os.path.join(dir, META_FILENAME), 'r') as f:
+        num_segments = json.load(f)["num_segments"]
+    index = np.fromfile(index_path, dtype=np.int64)
+    index = index[:len(index) - len(index)%3].reshape(-1, 3)
+    index = index[index[:,0] < num_frames]
+    index.tofile(index_path)
+    with open(os.path.join(dir, DATA_FILENAME), 'r+b') as f:
+        f.truncate(SEGMENT_DTYPE.itemsize * (int(index[:,2].max()) + num_segments) if len(index) else 0)
+
+class TrajectoryReader(object):
+    def __init__(self, dir):
+        # Random access to a recording by frame index; the data file is memory-mapped
+        with open(os.path.join(dir, META_FILENAME), 'r') as f:
+            self.meta = json.load(f)
+        self.num_segments = self.meta["num_segments"]
+        self.scale = self.meta["scale"]
+        index = np.fromfile(os.path.join(dir, INDEX_FILENAME), dtype=np.int64)
+        index = index[:len(index) - len(index)%3].reshape(-1, 3) # Drop a partially written row
+        data_path = os.path.join(dir, DATA_FILENAME)
+        num_records = os.path.getsize(data_path) // SEGMENT_DTYPE.itemsize
+        index = index[index[:,2] + self.num_segments <= num_records] # ...and frames whose transforms never reached the disk
+        self.data = np.memmap(data_path, dtype=SEGMENT_DTYPE, mode='r', shape=(num_records,)) if num_records else np.zeros(0, dtype=SEGMENT_DTYPE)
+        self.index = {int(frame): (int(sim_frame), int(offset)) for frame, sim_frame, offset in index}
+
+    def __getitem__(self, frame):
+        # (num_segments, 4, 4) world matrices of frame
+        return decode(self.records(frame), self.scale)
+
+    def records(self, frame):
+        _, offset = self.index[int(frame)]
+        return self.data[offset:offset + self.num_segments]
+
+    def __contains__(self, frame):
+        return int(frame) in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def frames(self):
+        return sorted(self.index)
+
+    def sim_frame(self, frame):
+        return self.index[int(frame)][0]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('dir', type=str)
+    args = parser.parse_args()
+    reader = TrajectoryReader(args.dir)
+    frames = reader.frames()
+    size = os.path.getsize(os.path.join(args.dir, DATA_FILENAME))
+    print("%d frames x %d segments (%.1f KB)%s" % (len(frames), reader.num_segments, size/1024.0, ", frames %d-%d" % (frames[0], frames[-1]) if frames else ""))
@@ -4,11 +4,20 @@ import numpy as np
 from math import pi
 import os
 import sys
+import shutil
+import functools
 sys.path.append(os.getcwd())
 
 from rigidbody_rope import *
-from sklearn.neighbors import NearestNeighbors
 import knots
+import checkpoint
+import annotations
+import rasterize
+import crossings
+import recording
+from manifest import Manifest
+from layout import OUTPUT_FILES
+from timing import TIMER
 
 def set_animation_settings(anim_end):
     # Sets up the animation cache to run till frame anim_end (otherwise default terminates @ 250)
@@ -16,22 +25,10 @@ def set_animation_settings(anim_end):
     scene.frame_end = anim_end
     scene.rigidbody_world.point_cache.frame_end = anim_end
 
-def set_render_settings(engine, render_size):
-    # Set rendering engine, dimensions, colorspace, images settings
-    if not os.path.exists("./images"):
-        os.makedirs('./images')
-    else:
-        os.system('rm -r ./images')
-    if not os.path.exists("./images_depth"):
-        os.makedirs('./images_depth')
-    else:
-        os.system('rm -r ./images_depth')
-        os.makedirs('./images_depth')
-    if not os.path.exists("./image_masks"):
-        os.makedirs('./image_masks')
-    else:
-        os.system('rm -r ./image_masks')
-        os.makedirs('./image_masks')
+def set_render_settings(engine, render_size, analytic_passes=False, clear_outputs=True):
+    # Set rendering engine, dimensions, colorspace, images settings; analytic_passes rasterizes depth/mask with NumPy (rasterize.py)
+    # instead of compositing them from the render's Z pass; clear_outputs=False keeps the frames of a run being resumed
+    make_output_dirs(".", clear_outputs)
     scene = bpy.context.scene
     scene.render.engine = engine
     render_width, render_height = render_size
@@ -46,8 +43,83 @@ def set_render_settings(engine, render_size):
         scene.eevee.taa_samples = 1
         scene.view_settings.view_transform = 'Raw'
         scene.eevee.taa_render_samples = 1
+    if analytic_passes:
+        scene.use_nodes = False
+    else:
+        make_pass_nodes()
+
+def make_output_dirs(out_dir, clear=True):
+    # images, images_depth and image_masks under out_dir, emptied first if clear
+    for folder, _ in OUTPUT_FILES:
+        path = os.path.join(out_dir, folder)
+        if clear and os.path.exists(path):
+            shutil.rmtree(path)
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+def make_pass_nodes():
+    # Builds the compositor once: RGB goes to the Composite output, and two File Output nodes write the depth (Depth -> Invert -> Normalize)
+    # and mask (Ceil of the normalized depth) passes during the same render; save_passes moves them to their dataset filenames
+    scene = bpy.context.scene
+    scene.use_nodes = True
+    bpy.context.view_layer.use_pass_z = True
+    tree = scene.node_tree
+    links = tree.links
+    for node in tree.nodes:
+        tree.nodes.remove(node)
+    render_node = tree.nodes.new(type="CompositorNodeRLayers")
+    inv_node = tree.nodes.new(type="CompositorNodeInvert")
+    norm_node = tree.nodes.new(type="CompositorNodeNormalize")
+    math_node = tree.nodes.new(type="CompositorNodeMath")
+    math_node.operation = 'CEIL' # Threshold the depth image
+    composite = tree.nodes.new(type="CompositorNodeComposite")
+    links.new(render_node.outputs["Image"], composite.inputs["Image"])
+    links.new(render_node.outputs["Depth"], inv_node.inputs["Color"])
+    links.new(inv_node.outputs[0], norm_node.inputs[0])
+    links.new(norm_node.outputs[0], math_node.inputs[0])
+    for name, folder, output in [("Depth Output", "images_depth", norm_node), ("Mask Output", "image_masks", math_node)]:
+        file_node = tree.nodes.new(type="CompositorNodeOutputFile")
+        file_node.name = name
+        file_node.base_path = os.path.abspath(folder)
+        file_node.file_slots[0].path = "tmp_####"
+        file_node.format.file_format = 'PNG'
+        file_node.format.color_mode = scene.render.image_settings.color_mode
+        links.new(output.outputs[0], file_node.inputs[0])
 
-def annotate(frame, mapping, num_annotations, knot_only=True, end_only=False, offset=1):
+KEYPOINT_CACHE = {} # step_size -> subsampled local capsule vertices (homogeneous), shared by every segment of the rope
+
+def get_local_keypoints(step_size):
+    # All capsules are copies of the same imported mesh, so the subsampled local vertices only need to be read once
+    if step_size not in KEYPOINT_CACHE:
+        mesh = get_rope("Cylinder")[0].data
+        coords = np.empty(len(mesh.vertices)*3, dtype=np.float64)
+        mesh.vertices.foreach_get("co", coords)
+        coords = coords.reshape(-1, 3)[::step_size]
+        KEYPOINT_CACHE[step_size] = np.hstack((coords, np.ones((len(coords), 1))))
+    return KEYPOINT_CACHE[step_size]
+
+def project_to_pixels(world_coords, scene, camera, render_size):
+    # Batched equivalent of bpy_extras.object_utils.world_to_camera_view followed by pixel rounding, for an (N,3) array
+    cam_inv = np.array(camera.matrix_world.normalized().inverted())
+    co = world_coords @ cam_inv[:3,:3].T + cam_inv[:3,3]
+    z = -co[:,2]
+    frame = [np.array(v) for v in camera.data.view_frame(scene=scene)[:3]]
+    x, y = co[:,0], co[:,1]
+    if camera.data.type != 'ORTHO':
+        # The view frame lies at depth -frame.z; scaling each point onto that plane is the same as scaling the frame to each point's depth
+        scale = -frame[0][2] / np.where(z == 0, 1, z)
+        x, y = x*scale, y*scale
+    min_x, max_x = frame[2][0], frame[1][0]
+    min_y, max_y = frame[1][1], frame[0][1]
+    x = (x - min_x) / (max_x - min_x)
+    y = (y - min_y) / (max_y - min_y)
+    if camera.data.type != 'ORTHO':
+        x = np.where(z == 0, 0.5, x)
+        y = np.where(z == 0, 0.5, y)
+    pixels = np.stack((np.round(x*render_size[0]), np.round(render_size[1] - y*render_size[1])), axis=1)
+    return pixels.astype(int)
+
+def annotate(frame, mapping, num_annotations, knot_only=True, end_only=False, offset=1, piece="Cylinder"):
     # Export pixelwise annotations for rope at current frame; if knot-only, only annotate the knot, if end_only, only annotate the ends of the rope, if both are false, annotate the full rope
     scene = bpy.context.scene
     render_scale = scene.render.resolution_percentage / 100
@@ -55,32 +127,25 @@ def annotate(frame, mapping, num_annotations, knot_only=True, end_only=False, of
             int(scene.render.resolution_x * render_scale),
             int(scene.render.resolution_y * render_scale),
             )
-    pixels = []
+    rope = get_rope(piece)
+    n = len(rope)
     if knot_only:
         annot_list = []
-        pull, hold, _ = find_knot(50)
+        pull, hold, _ = find_knot(n, piece=piece)
         indices = list(range(pull-offset, pull+offset+1)) + list(range(hold-offset, hold+offset+1))
     elif end_only:
-        indices = list(range(4)) + list(range(46,50))
+        indices = list(range(4)) + list(range(n-4,n))
     else:
-        indices = list(range(50))
-    for i in indices:
-        cyl = get_piece("Cylinder", i if i != 0 else -1)
-        cyl_verts = list(cyl.data.vertices)
-        step_size = max(len(indices)*len(cyl_verts)//num_annotations, 1)
-        vertex_coords = [cyl.matrix_world @ v.co for v in cyl_verts][::step_size]
-        for i in range(len(vertex_coords)):
-            v = vertex_coords[i]
-            camera_coord = bpy_extras.object_utils.world_to_camera_view(scene, bpy.context.scene.camera, v)
-            pixel = [round(camera_coord.x * render_size[0]), round(render_size[1] - camera_coord.y * render_size[1])]
-            pixels.append([pixel])
-    mapping[frame] = pixels
-
-def get_piece(piece_name, piece_id):
-    # Returns the piece with name piece_name, index piece_id
-    if piece_id == -1 or piece_id == 0 or piece_id is None:
-        return bpy.data.objects['%s' % (piece_name)]
-    return bpy.data.objects['%s.%03d' % (piece_name, piece_id)]
+        indices = list(range(n))
+    indices = np.clip(indices, 0, n-1)
+    num_verts = len(rope[0].data.vertices)
+    step_size = max(len(indices)*num_verts//num_annotations, 1)
+    local_coords = get_local_keypoints(step_size)
+    # One (N,4,4) read of the segment transforms, then a single batched transform + projection for all keypoints
+    world_mats = rope.read().matrices[indices]
+    world_coords = (world_mats[:,:3,:] @ local_coords.T).transpose(0, 2, 1).reshape(-1, 3)
+    pixels = project_to_pixels(world_coords, scene, scene.camera, render_size)
+    mapping[frame] = [[pixel] for pixel in pixels.tolist()]
 
 def toggle_animation(obj, frame, animate):
     # Sets the obj to be animable or non-animable at particular frame
@@ -101,39 +166,26 @@ def take_action(obj, frame, action_vec, animate=True):
     obj.location += Vector((dx,dy,dz))
     obj.keyframe_insert(data_path="location", frame=frame)
 
-def find_knot(num_segments, chain=False, depth_thresh=0.4, idx_thresh=3, pull_offset=3):
-    piece = "Torus" if chain else "Cylinder"
-    cache = {}
-
-    # Make a single pass, store the xy positions of the cylinders
-    for i in range(num_segments):
-        cyl = get_piece(piece, i if i else -1)
-        x,y,z = cyl.matrix_world.translation
-        key = tuple((x,y))
-        val = {"idx":i, "depth":z}
-        cache[key] = val
-    neigh = NearestNeighbors(2, 0)
-    planar_coords = list(cache.keys())
-    neigh.fit(planar_coords)
-    # Now traverse and look for the under crossing
-    for i in range(num_segments):
-        cyl = get_piece(piece, i if i else -1)
-        x,y,z = cyl.matrix_world.translation
-        match_idxs = neigh.kneighbors([(x,y)], 2, return_distance=False) # 1st neighbor is always identical, we want 2nd
-        nearest = match_idxs.squeeze().tolist()[1:][0]
-        x1,y1 = planar_coords[nearest]
-        curr_cyl, match_cyl = cache[(x,y)], cache[(x1,y1)]
-        depth_diff = match_cyl["depth"] - curr_cyl["depth"]
-        idx_diff = abs(match_cyl["idx"] - curr_cyl["idx"])
-        if depth_diff > depth_thresh and idx_diff > idx_thresh:
-            pull_idx = i + pull_offset # Pick a point slightly past under crossing to do the pull
-            dx = planar_coords[pull_idx][0] - x
-            dy = planar_coords[pull_idx][1] - y
-            hold_idx = match_cyl["idx"]
+CROSSINGS = {} # piece -> CrossingAnalyzer, so consecutive calls on the same rope only re-test the bonds that moved
+
+@TIMER.timed("find_knot")
+def find_knot(num_segments, chain=False, depth_thresh=0.4, idx_thresh=3, pull_offset=3, piece=None):
+    piece = piece or ("Torus" if chain else "Cylinder")
+
+    # Make a single pass, store the xyz positions of the cylinders
+    positions = get_rope(piece).read().positions[:num_segments]
+    analyzer = CROSSINGS.setdefault(piece, crossings.CrossingAnalyzer())
+    # Now look for the first under crossing along the rope that is clearly below (depth_thresh) a distant part of the rope (idx_thresh)
+    for crossing in sorted(analyzer.update(positions), key=lambda c: c.under_pos):
+        if crossing.height > depth_thresh and abs(crossing.over_pos - crossing.under_pos) > idx_thresh:
+            under_idx = int(round(crossing.under_pos))
+            pull_idx = min(under_idx + pull_offset, num_segments-1) # Pick a point slightly past under crossing to do the pull
+            dx, dy = positions[pull_idx,:2] - positions[under_idx,:2]
+            hold_idx = int(round(crossing.over_pos))
             SCALE_X = 1
             SCALE_Y = 1
             Z_OFF = 2
-            action_vec = [SCALE_X*dx, SCALE_Y*dy, Z_OFF] 
+            action_vec = [float(SCALE_X*dx), float(SCALE_Y*dy), Z_OFF]
             return pull_idx, hold_idx, action_vec # Found! Return the pull, hold, and action
     return 16, 25, [0,0,0] # Didn't find a pull/hold, 16 and 25 are arbitrary cylinder indices
 
@@ -141,64 +193,110 @@ def randomize_camera():
     pass
     #bpy.context.scene.camera.rotation_euler = (0, 0, np.random.uniform(-np.pi/4, np.pi/4))
 
-def render_frame(frame, render_offset=0, step=2, num_annotations=300, filename="%06d_rgb.png", folder="images", annot=True, mapping=None):
-    # Renders a single frame in a sequence (if frame%step == 0)
+CAMERA_RIGS = {} # piece -> views ({"camera", "out_dir", "mapping"}) that render_frame renders every frame through (open_views(cameras))
+TRAJECTORY_WRITERS = {} # piece -> recording.TrajectoryWriter that render_frame appends the rope's transforms to (generate_dataset(..., record=True))
+RENDER_LOG = [] # (index, files) of every frame render_frame wrote in the current episode, for the resume manifest
+
+def render_frame(frame, render_offset=0, step=2, num_annotations=300, filename="%06d_rgb.png", folder="images", annot=True, mapping=None, out_dir=".", piece="Cylinder", update_rig=True):
+    # Renders a single frame in a sequence (if frame%step == 0); update_rig=False when the caller already posed the curve rigs
+    # for this frame (update_curve_rig poses every rope's, e.g. multi_rope.render_ropes does it once for all of them)
     frame -= render_offset
     randomize_camera()
     if frame%step == 0:
         scene = bpy.context.scene
 
         index = frame//step
-        render_mask("image_masks/%06d_visible_mask.png", "images_depth/%06d_rgb.png", index)
-        scene.render.filepath = os.path.join(folder, filename) % index
+        if update_rig:
+            update_curve_rig()
+        # With a camera rig every camera renders this frame into its own folder; otherwise the scene camera renders into out_dir
+        views = CAMERA_RIGS.get(piece) or [{"camera": None, "out_dir": ".", "mapping": mapping}]
+        files = []
+        for view in views:
+            if view["camera"] is not None:
+                scene.camera = view["camera"]
+            files += render_view(index, os.path.join(out_dir, view["out_dir"]), folder, filename, annot, view["mapping"], num_annotations, piece)
+        RENDER_LOG.append((index, files))
+        if piece in TRAJECTORY_WRITERS:
+            TRAJECTORY_WRITERS[piece].write(index, scene.frame_current, get_rope(piece).read().matrices)
+
+def render_view(index, out_dir, folder, filename, annot, mapping, num_annotations, piece):
+    # Renders the RGB image, depth/mask passes and keypoints of frame index through the scene camera; returns the written files
+    scene = bpy.context.scene
+    mask_filename = os.path.join(out_dir, "image_masks/%06d_visible_mask.png")
+    depth_filename = os.path.join(out_dir, "images_depth/%06d_rgb.png")
+    with TIMER.phase("render"):
+        scene.render.filepath = os.path.join(out_dir, folder, filename) % index
         bpy.ops.render.render(write_still=True)
-        if annot:
-            annotate(index, mapping, num_annotations)
+        if scene.use_nodes:
+            save_passes(mask_filename, depth_filename, index)
+        else:
+            save_analytic_passes(mask_filename, depth_filename, index, piece)
+    if annot:
+        with TIMER.phase("annotate"):
+            annotate(index, mapping, num_annotations, piece=piece)
+    return [scene.render.filepath, depth_filename % index, mask_filename % index]
 
-def render_mask(mask_filename, depth_filename, index):
+def camera_metadata(camera):
+    # Intrinsics and extrinsics of a camera at the current render resolution (Blender convention: the camera looks down its
+    # local -z with +y up, image rows go down)
     scene = bpy.context.scene
-    saved = scene.render.engine
-    scene.render.engine = 'BLENDER_EEVEE'
-    scene.eevee.taa_samples = 1
-    scene.eevee.taa_render_samples = 1
-    scene.use_nodes = True
-    tree = bpy.context.scene.node_tree
-    links = tree.links
-    render_node = tree.nodes["Render Layers"]
-    norm_node = tree.nodes.new(type="CompositorNodeNormalize")
-    inv_node = tree.nodes.new(type="CompositorNodeInvert")
-    math_node = tree.nodes.new(type="CompositorNodeMath")
-    math_node.operation = 'CEIL' # Threshold the depth image
-    composite = tree.nodes.new(type = "CompositorNodeComposite")
+    K, cam_to_world, (width, height) = rasterize.camera_from_blender(camera, scene)
+    return {"name": camera.name, "width": width, "height": height, "K": K.tolist(),
+            "cam_to_world": cam_to_world.tolist(), "world_to_cam": np.linalg.inv(cam_to_world).tolist(),
+            "lens": camera.data.lens, "sensor_width": camera.data.sensor_width, "sensor_height": camera.data.sensor_height, "sensor_fit": camera.data.sensor_fit}
 
-    links.new(render_node.outputs["Depth"], inv_node.inputs["Color"])
-    links.new(inv_node.outputs[0], norm_node.inputs[0])
-    links.new(norm_node.outputs[0], composite.inputs["Image"])
+def open_views(cameras=None, legacy_json=False, append=False, piece="Cylinder"):
+    # Output views of a run: without cameras, one view writing to the current folder with the scene camera; with a camera rig,
+    # one folder cam_XX/ per camera with its own images, passes, annotations and a camera.json, registered for render_frame
+    if not cameras:
+        return [{"camera": None, "out_dir": ".", "mapping": {} if legacy_json else annotations.AnnotationWriter("./images", append=append)}]
+    views = []
+    for k, camera in enumerate(cameras):
+        out_dir = "cam_%02d" % k
+        make_output_dirs(out_dir, clear=not append)
+        with open(os.path.join(out_dir, "camera.json"), 'w') as f:
+            json.dump(camera_metadata(camera), f, indent=2, sort_keys=True)
+        views.append({"camera": camera, "out_dir": out_dir, "mapping": {} if legacy_json else annotations.AnnotationWriter(os.path.join(out_dir, "images"), append=append)})
+    CAMERA_RIGS[piece] = views
+    return views
 
-    scene.render.filepath = depth_filename % index
-    bpy.ops.render.render(write_still=True)
+def close_views(views, legacy_json=False, piece="Cylinder"):
+    for view in views:
+        close_annotations(view["mapping"], legacy_json, os.path.join(view["out_dir"], "images"))
+    CAMERA_RIGS.pop(piece, None)
 
-    links.new(norm_node.outputs[0], math_node.inputs[0])
-    links.new(math_node.outputs[0], composite.inputs["Image"])
+def save_passes(mask_filename, depth_filename, index):
+    # Moves the depth and mask images written by the File Output nodes during the last render to their dataset filenames
+    scene = bpy.context.scene
+    tree = scene.node_tree
+    for name, filename in [("Depth Output", depth_filename), ("Mask Output", mask_filename)]:
+        file_node = tree.nodes[name]
+        written = os.path.join(file_node.base_path, "tmp_%04d.png" % scene.frame_current)
+        os.replace(written, filename % index)
 
-    scene.render.filepath = mask_filename % index
-    bpy.ops.render.render(write_still=True)
-    # Clean up
-    scene.render.engine = saved
-    for node in tree.nodes:
-        if node.name != "Render Layers":
-            tree.nodes.remove(node)
-    scene.use_nodes = False
+def save_analytic_passes(mask_filename, depth_filename, index, piece="Cylinder"):
+    # Rasterizes the depth and mask images straight from the segment transforms (set_render_settings(..., analytic_passes=True))
+    scene = bpy.context.scene
+    transforms = get_rope(piece).read().matrices
+    K, cam_to_world, size = rasterize.camera_from_blender(scene.camera, scene)
+    depth_img, mask_img = rasterize.render_passes(transforms, K, cam_to_world, size)
+    rasterize.save_passes(mask_filename % index, depth_filename % index, depth_img, mask_img)
 
 def take_undo_action_oracle(params, start_frame, render=False, render_offset=0, annot=True, mapping=None):
     # Takes an action to loosen the knot using ground truth info
-    piece = "Cylinder"
-    pull_idx, hold_idx, action_vec = find_knot(50)
+    rope = get_rope("Cylinder")
+    pull_idx, hold_idx, action_vec = find_knot(len(rope))
     action_vec = np.array(action_vec) + np.random.uniform(-0.5, 0.5, 3)
     action_vec /= np.linalg.norm(action_vec)
     action_vec *= 2
-    pull_cyl = get_piece(piece, pull_idx)
-    hold_cyl = get_piece(piece, hold_idx)
+    return take_pull_action(params, start_frame, pull_idx, hold_idx, action_vec, render, render_offset, annot, mapping)
+
+def take_pull_action(params, start_frame, pull_idx, hold_idx, action_vec, render=False, render_offset=0, annot=True, mapping=None):
+    # Holds segment hold_idx in place while segment pull_idx is moved by action_vec, releases both and lets the rope settle;
+    # returns the next free frame and the updated render_offset
+    rope = get_rope("Cylinder")
+    pull_cyl = rope[pull_idx]
+    hold_cyl = rope[hold_idx]
     end_frame = start_frame + 100
     take_action(hold_cyl, end_frame, (0,0,0))
 
@@ -214,32 +312,37 @@ def take_undo_action_oracle(params, start_frame, render=False, render_offset=0,
     ## Release both pull, hold
     toggle_animation(pull_cyl, end_frame, False)
     toggle_animation(hold_cyl, end_frame, False)
-    settle_time = 30
-    # Let the rope settle after the action, so we can know where the ends are afterwards
-    for step in range(start_frame + 10, end_frame+settle_time):
+    settle_time = 30 # At most; the settle stops as soon as the rope is at rest
+    for step in range(start_frame + 10, end_frame):
         bpy.context.scene.frame_set(step)
-        #render_frame(step, render_offset=render_offset, annot=annot, mapping=mapping)
-        if render and (abs(step-(start_frame+10)) < 2 or abs(step-(end_frame+settle_time)) < 2):
+        if render and abs(step-(start_frame+10)) < 2:
+            render_frame(step, render_offset=render_offset, annot=annot, mapping=mapping)
+        elif render:
+            render_offset += 1
+    # Let the rope settle after the action, so we can know where the ends are afterwards; the settled frame is rendered
+    step = end_frame - 1
+    for step, settled in knots.settle_frames(params, end_frame, end_frame+settle_time, "loosen"):
+        if render and (settled or step == end_frame+settle_time-1):
             render_frame(step, render_offset=render_offset, annot=annot, mapping=mapping)
         elif render:
             render_offset += 1
-    return end_frame+settle_time, render_offset
+    return step+1, render_offset
 
 def reidemeister(params, start_frame,render=False, render_offset=0, annot=True, mapping=None):
     # Straightens out the rope
-    piece = "Cylinder"
+    rope = get_rope("Cylinder")
     last = params["num_segments"]-1
-    end1 = get_piece(piece, -1)
-    end2 = get_piece(piece, last)
+    end1 = rope[0]
+    end2 = rope[last]
 
     middle_frame = start_frame+25
     end_frame = start_frame+75
-    take_action(end2, middle_frame, (-6-end2.matrix_world.translation[0],np.random.uniform(-2,2),0))
+    take_action(end2, middle_frame, (-6-rope.read().positions[last,0],np.random.uniform(-2,2),0))
     for step in range(start_frame, middle_frame):
         bpy.context.scene.frame_set(step)
         if render:
             render_frame(step, render_offset=render_offset, annot=annot, mapping=mapping)
-    take_action(end1, end_frame, (9-end1.matrix_world.translation[0],np.random.uniform(-2,2),0))
+    take_action(end1, end_frame, (9-rope.read().positions[0,0],np.random.uniform(-2,2),0))
 
     # Drop the ends
     toggle_animation(end1, end_frame, False)
@@ -251,50 +354,243 @@ def reidemeister(params, start_frame,render=False, render_offset=0, annot=True,
             render_frame(step, render_offset=render_offset, annot=annot, mapping=mapping)
     return end_frame
 
-def generate_dataset(params, iters=1, chain=False, render=False):
-    # Generates a dataset of rope renderings
+def tie_and_straighten(params, knot_name, tie_fn, cache_dir=None, knot_seed=0):
+    # Ties a knot and straightens the rope, or restores the resulting rope state from cache_dir if it was already simulated
+    def simulate():
+        with TIMER.phase("tie_%s" % knot_name) as stats:
+            knot_end_frame = tie_fn(params, render=False)
+            stats["frames"] += knot_end_frame
+        with TIMER.phase("reidemeister") as stats:
+            reid_end_frame = reidemeister(params, knot_end_frame, render=False)
+            stats["frames"] += reid_end_frame - knot_end_frame
+        return reid_end_frame
+    if cache_dir is None:
+        return simulate()
+    path = checkpoint.checkpoint_path(cache_dir, knot_name, params, knot_seed)
+    if os.path.exists(path):
+        with TIMER.phase("restore"):
+            return checkpoint.restore_rope_state(params, checkpoint.load_rope_state(path))
+    # Seed the tying/straightening so the cached state is reproducible, without disturbing the randomness of the loosening actions
+    rng_state = np.random.get_state()
+    np.random.seed(knot_seed)
+    reid_end_frame = simulate()
+    np.random.set_state(rng_state)
+    checkpoint.save_rope_state(path, checkpoint.get_rope_state(params))
+    return reid_end_frame
+
+def generate_dataset(params, iters=1, chain=False, render=False, start_iter=0, cache_dir=None, knot_seeds=1, legacy_json=False, record=False, resume=False, seed=None, cameras=None):
+    # Generates a dataset of rope renderings; start_iter offsets the episode index (used by shard.py so each worker keeps the same knot alternation)
+    # With cache_dir set, each knot type is only simulated for knot_seeds variants and later episodes branch from the cached tied state
+    # Annotations are streamed to images/keypoints.{bin,idx} as frames are rendered (legacy_json=True writes images/knots_info.json at the end instead)
+    # With record=True the segment transforms of every rendered frame go to ./trajectory, for replay_dataset
+    # With resume=True finished episodes are logged to manifest.jsonl and skipped when the run is restarted, and each episode is
+    # seeded from (seed, episode) and starts from the rope's build pose, so a resumed run renders the same episodes it would
+    # have without the interruption
+    # With cameras (add_camera_rig) every rendered frame is rendered through each camera into cam_XX/
     set_animation_settings(15000) # Cache length to use for simulation 
     piece = "Cylinder"
-    last = params["num_segments"]-1
-    mapping = {}
-
     render_offset = 0
-    num_loosens = 5 # For each knot, we can do num_loosens loosening actions
-    for i in range(iters):
-        num_knots = 1
-        # Tie a knot
-        if i%2==0:
-            knot_end_frame = knots.tie_pretzel_knot(params, render=False)
-        elif i%2==1:
-            knot_end_frame = knots.tie_figure_eight(params, render=False)
-        # Straighten rope out
-        reid_end_frame = reidemeister(params, knot_end_frame, render=False, mapping=mapping) 
-        render_offset += reid_end_frame
-        # Loosen the knot
-        loosen_start = reid_end_frame
-        for i in range(num_loosens):
-            loosen_end_frame, offset = take_undo_action_oracle(params, loosen_start, render=render, render_offset=render_offset, mapping=mapping)
-            loosen_start = loosen_end_frame
-            render_offset = offset
-        render_offset -= loosen_end_frame
-        # Delete all keyframes to make a new knot and reset the frame counter
-        bpy.context.scene.frame_set(0)
-        for a in bpy.data.actions:
-            bpy.data.actions.remove(a)
+    manifest = None
+    if resume:
+        manifest = Manifest(".")
+        render_offset = manifest.render_offset()
+        # Truncate before the writers are opened, since they continue from the current end of their files
+        discard_unfinished_frames(manifest.num_frames(), ["cam_%02d" % k for k in range(len(cameras))] if cameras else ["."])
+        # Episodes otherwise start wherever the previous one left the rope, which a restarted run can't reproduce
+        rest_matrices = get_rope(piece).read_matrices().copy()
+    # A resumed run always streams annotations (and converts them at the end with legacy_json), so finished episodes keep theirs
+    views = open_views(cameras, legacy_json and not resume, append=resume, piece=piece)
+    if record:
+        TRAJECTORY_WRITERS[piece] = recording.TrajectoryWriter("./trajectory", params["num_segments"], params["segment_radius"], append=resume, fps=bpy.context.scene.render.fps)
+
+    for i in range(start_iter, start_iter+iters):
+        knot_name = "pretzel" if i%2 == 0 else "figure_eight"
+        if manifest is not None and i in manifest.completed():
+            print("Episode %d/%d (done)" % (i-start_iter+1, iters), flush=True)
+            continue
+        print("Episode %d/%d" % (i-start_iter+1, iters), flush=True)
+        episode_seed = None
+        if resume:
+            episode_seed = ((seed or 0) * 1000003 + i) % 2**32
+            random.seed(episode_seed)
+            np.random.seed(episode_seed)
+            reset_rope(rest_matrices, piece)
+        del RENDER_LOG[:]
+        knot_seed = (i//2)%knot_seeds
+        render_offset = run_episode(params, knot_name, render=render, render_offset=render_offset, mapping=views[0]["mapping"], cache_dir=cache_dir, knot_seed=knot_seed)
+        TIMER.end_episode(episode=i, knot=knot_name)
+        if manifest is not None:
+            manifest.append(i, [index for index, _ in RENDER_LOG], [os.path.normpath(f) for _, files in RENDER_LOG for f in files],
+                            knot=knot_name, knot_seed=knot_seed, seed=episode_seed, render_offset=render_offset)
+    TIMER.dump_profiles()
+    if record:
+        TRAJECTORY_WRITERS.pop(piece).close()
+    close_views(views, legacy_json and not resume, piece)
+    if legacy_json and resume:
+        for view in views:
+            annotations.to_legacy_json(os.path.join(view["out_dir"], "images"))
+
+def discard_unfinished_frames(num_frames, view_dirs=(".",)):
+    # Deletes the frames (images, passes, annotations, recorded transforms) at or after num_frames, i.e. those of an episode
+    # that was interrupted, so the resumed run can renumber from the manifest without leaving stale files behind
+    for view_dir in view_dirs:
+        for folder, _ in OUTPUT_FILES:
+            if not os.path.isdir(os.path.join(view_dir, folder)):
+                continue
+            for name in os.listdir(os.path.join(view_dir, folder)):
+                prefix = name.split('_')[0]
+                if prefix.isdigit() and int(prefix) >= num_frames:
+                    os.remove(os.path.join(view_dir, folder, name))
+        annotations.truncate(os.path.join(view_dir, "images"), num_frames)
+    recording.truncate("./trajectory", num_frames)
+
+def run_episode(params, knot_name, render=False, render_offset=0, mapping=None, cache_dir=None, knot_seed=0, num_loosens=5):
+    # Ties knot_name (trajectories/<knot_name>.json), straightens the rope and takes num_loosens oracle loosening actions, then
+    # clears the keyframes for the next episode; returns the render_offset that continues the frame numbering in the next episode
+    tie_fn = functools.partial(knots.tie_knot, name=knot_name)
+    reid_end_frame = tie_and_straighten(params, knot_name, tie_fn, cache_dir, knot_seed)
+    render_offset += reid_end_frame
+    # Loosen the knot
+    loosen_start = loosen_end_frame = reid_end_frame
+    for _ in range(num_loosens):
+        with TIMER.phase("loosen") as stats:
+            loosen_end_frame, render_offset = take_undo_action_oracle(params, loosen_start, render=render, render_offset=render_offset, mapping=mapping)
+            stats["frames"] += loosen_end_frame - loosen_start
+        loosen_start = loosen_end_frame
+    render_offset -= loosen_end_frame
+    reset_episode()
+    return render_offset
+
+def reset_episode():
+    # Delete all keyframes to make a new knot and reset the frame counter
+    bpy.context.scene.frame_set(0)
+    for a in bpy.data.actions:
+        bpy.data.actions.remove(a)
+
+def reset_rope(rest_matrices, piece="Cylinder"):
+    # reset_episode, then every segment dynamic again and back at rest_matrices (e.g. Rope.read_matrices() right after the
+    # scene was built), so the next episode does not depend on where the last one left the rope
+    reset_episode()
+    rope = get_rope(piece)
+    for obj, matrix in zip(rope, rest_matrices):
+        obj.rigid_body.kinematic = False
+        obj.matrix_world = Matrix(matrix.tolist())
+    CROSSINGS.pop(piece, None)
+    rope.invalidate()
+    bpy.context.scene.frame_set(0)
+
+def close_annotations(mapping, legacy_json=False, dir="./images"):
     # Export pixelwise annotations
-    with open("./images/knots_info.json", 'w') as outfile:
-        json.dump(mapping, outfile, sort_keys=True, indent=2)
+    if legacy_json:
+        with open(os.path.join(dir, annotations.LEGACY_FILENAME), 'w') as outfile:
+            json.dump(mapping, outfile, sort_keys=True, indent=2)
+    else:
+        mapping.close()
 
-if __name__ == '__main__':
+def pose_rope(rope, matrices):
+    # Places every segment at the given (N,4,4) world transforms (with the rigid body world disabled nothing moves them back)
+    for obj, matrix in zip(rope, matrices):
+        obj.matrix_world = Matrix(matrix.tolist())
+    rope.invalidate()
+    bpy.context.view_layer.update()
+
+def replay_dataset(params, trajectory_dir, legacy_json=False, piece="Cylinder", cameras=None):
+    # Re-renders a recorded dataset with the current render settings, rig and camera(s): each frame is posed straight from the
+    # recording and the rigid body world is disabled, so no simulation runs; frame indices match the recording
+    scene = bpy.context.scene
+    scene.rigidbody_world.enabled = False
+    reader = recording.TrajectoryReader(trajectory_dir)
+    rope = get_rope(piece)
+    assert reader.num_segments == len(rope), "the recording has %d segments but the rope has %d" % (reader.num_segments, len(rope))
+    views = open_views(cameras, legacy_json, piece=piece)
+    for index in reader.frames():
+        pose_rope(rope, reader[index])
+        render_frame(index, step=1, mapping=views[0]["mapping"], piece=piece)
+    TIMER.end_episode(replay=trajectory_dir, frames=len(reader))
+    TIMER.dump_profiles()
+    close_views(views, legacy_json, piece)
+
+def script_argv():
+    # Blender passes its own flags through sys.argv; script args come after '--' (blender -b -P render.py -- --seed 0)
+    return sys.argv[sys.argv.index('--')+1:] if '--' in sys.argv else []
+
+def worker_arg_parser():
+    # Flags shared by render.py and the long-lived worker.py
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iters', type=int, default=2)
+    parser.add_argument('--start_iter', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--out_dir', type=str, default='.')
+    parser.add_argument('--knot_cache', type=str, default=None)
+    parser.add_argument('--direct_rig', action='store_true')
+    parser.add_argument('--legacy_json', action='store_true')
+    parser.add_argument('--metrics', type=str, default='metrics.jsonl') # Per-episode phase timings (JSON lines), relative to out_dir
+    parser.add_argument('--profile', type=str, default='') # Comma-separated phases to capture with cProfile, e.g. render,annotate
+    parser.add_argument('--knot_seeds', type=int, default=1)
+    parser.add_argument('--analytic_passes', action='store_true') # Rasterize depth/mask with NumPy instead of the compositor (needs cv2 in Blender's Python)
+    parser.add_argument('--record', action='store_true') # Record the segment transforms of every rendered frame to out_dir/trajectory
+    parser.add_argument('--resume', action='store_true') # Keep out_dir's outputs and skip the episodes its manifest.jsonl lists as finished
+    parser.add_argument('--replay', type=str, default=None) # Re-render a recorded trajectory directory instead of simulating
+    parser.add_argument('--rig', type=str, default='cable', choices=['cable', 'braid'])
+    parser.add_argument('--engine', type=str, default=None) # Override rigidbody_params.json, e.g. for a replay variant
+    parser.add_argument('--resolution', type=str, default=None) # WIDTHxHEIGHT, overrides rigidbody_params.json
+    parser.add_argument('--cameras', type=int, default=1) # Render every frame through this many cameras (add_camera_rig), each into cam_XX/
+    parser.add_argument('--random_cameras', action='store_true') # Random viewpoints instead of a ring around the table
+    parser.add_argument('--camera_seed', type=int, default=0)
+    parser.add_argument('--settle_threshold', type=float, default=None) # Kinetic-energy proxy below which the rope counts as at rest (settle.py); 0 keeps the fixed settle windows
+    parser.add_argument('--settle_window', type=int, default=None) # Frames it has to stay below the threshold
+    return parser
+
+def parse_worker_args():
+    return worker_arg_parser().parse_args(script_argv())
+
+def load_params(engine=None, resolution=None, settle_threshold=None, settle_window=None):
+    # rigidbody_params.json with the --engine/--resolution/--settle_* overrides applied
     with open("rigidbody_params.json", "r") as f:
         params = json.load(f)
+    if engine is not None:
+        params["engine"] = engine
+    if resolution is not None:
+        params["render_width"], params["render_height"] = [int(v) for v in resolution.lower().split('x')]
+    if settle_threshold is not None:
+        params["settle_threshold"] = settle_threshold
+    if settle_window is not None:
+        params["settle_window"] = settle_window
+    return params
+
+def build_scene(params, rig='cable', direct_rig=False, num_cameras=1, random_cameras=False, camera_seed=0):
+    # Returns the camera rig's cameras, or None for the single add_camera_light camera
     clear_scene()
     make_capsule_rope(params)
-    rig_rope(params, 'cable')
+    rig_rope(params, rig, direct=direct_rig)
     add_camera_light()
-    set_render_settings(params["engine"],(params["render_width"],params["render_height"]))
+    if num_cameras > 1:
+        return add_camera_rig(num_cameras, random_cameras, camera_seed)
+    return None
+
+if __name__ == '__main__':
+    args = parse_worker_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+        np.random.seed(args.seed)
+    params = load_params(args.engine, args.resolution, args.settle_threshold, args.settle_window)
+    cameras = build_scene(params, args.rig, args.direct_rig, args.cameras, args.random_cameras, args.camera_seed)
+    # Outputs (images, images_depth, image_masks) are written relative to out_dir
+    if not os.path.exists(args.out_dir):
+        os.makedirs(args.out_dir)
+    if args.knot_cache is not None:
+        args.knot_cache = os.path.abspath(args.knot_cache)
+    if args.replay is not None:
+        args.replay = os.path.abspath(args.replay)
+    os.chdir(args.out_dir)
+    TIMER.configure(metrics_path=args.metrics or None, profile_phases=[p for p in args.profile.split(',') if p])
+    set_render_settings(params["engine"],(params["render_width"],params["render_height"]), args.analytic_passes, clear_outputs=not args.resume)
     make_table(params)
     start = time.time()
-    generate_dataset(params, iters=2, render=True)
+    if args.replay is not None:
+        replay_dataset(params, args.replay, legacy_json=args.legacy_json, cameras=cameras)
+    else:
+        generate_dataset(params, iters=args.iters, render=True, start_iter=args.start_iter, cache_dir=args.knot_cache, knot_seeds=args.knot_seeds, legacy_json=args.legacy_json, record=args.record, resume=args.resume, seed=args.seed, cameras=cameras)
     end = time.time()
     print("Time:", end-start)
@@ -31,9 +31,122 @@ def clear_scene():
     bpy.ops.object.mode_set(mode='OBJECT')
     bpy.ops.object.select_all(action='SELECT')
     bpy.ops.object.delete()
+    ROPES.clear()
 
-def make_capsule_rope(params):
-    '''Make a rigid rope composed of capsules linked by rigid body constraints'''
+ROPES = {} # piece -> Rope handle of every rope in the scene
+
+class RopeState(object):
+    '''Bulk readout of a rope at one frame: (N,4,4) world matrices, (N,3) positions, (N,3,3) unit-axis orientations and
+    (N,3) finite-difference velocities (None unless the previous frame was read too, see Rope.velocities)'''
+    __slots__ = ("frame", "matrices", "positions", "orientations", "velocities")
+
+    def __init__(self, frame, matrices, velocities=None):
+        self.frame = frame
+        self.matrices = matrices
+        self.positions = matrices[:,:3,3]
+        self.orientations = matrices[:,:3,:3] / np.linalg.norm(matrices[:,:3,:3], axis=1, keepdims=True)
+        self.velocities = velocities
+
+class Rope(object):
+    '''Handle on the capsule segments of one rope. Indexing returns the cached segment objects in rope order (rope[0] is the
+    base object piece, rope[i] is piece.%03d), and read() returns the RopeState of the current frame from a single
+    foreach_get over bpy.data.objects; the state is dropped on every frame change (invalidate_ropes)'''
+    def __init__(self, segments, piece="Cylinder"):
+        self.piece = piece
+        self.segments = list(segments)
+        self.names = [obj.name for obj in self.segments]
+        self.object_indices = None # Positions of the segments in bpy.data.objects, for the bulk read
+        self.num_objects = 0
+        self.state = None
+        self.previous = None
+        ROPES[piece] = self
+
+    @classmethod
+    def from_scene(cls, piece="Cylinder"):
+        # Handle on a rope that is already in the scene (e.g. loaded from a .blend) rather than built by make_capsule_rope
+        segments = [bpy.data.objects[piece]]
+        while "%s.%03d" % (piece, len(segments)) in bpy.data.objects:
+            segments.append(bpy.data.objects["%s.%03d" % (piece, len(segments))])
+        return cls(segments, piece)
+
+    def __len__(self):
+        return len(self.segments)
+
+    def __getitem__(self, i):
+        return self.segments[i]
+
+    def __iter__(self):
+        return iter(self.segments)
+
+    def invalidate(self):
+        # Keeps the current state (if it was read) as the previous frame's, for finite-difference velocities
+        self.previous = self.state
+        self.state = None
+
+    def indices_valid(self, objects):
+        # bpy.data.objects is kept sorted by name, so adding, removing or renaming any object can shift the segments'
+        # positions even when the count is unchanged; one name lookup per segment is still far cheaper than per-object reads
+        if self.object_indices is None or self.num_objects != len(objects):
+            return False
+        return all(objects[int(i)].name == name for i, name in zip(self.object_indices, self.names))
+
+    def read_matrices(self):
+        objects = bpy.data.objects
+        if not self.indices_valid(objects):
+            self.object_indices = np.array([objects.find(name) for name in self.names])
+            self.num_objects = len(objects)
+            if (self.object_indices < 0).any():
+                raise KeyError("rope %s: segment %s is no longer in the scene" % (self.piece, self.names[int(np.argmin(self.object_indices))]))
+        flat = np.empty(len(objects)*16, dtype=np.float32)
+        objects.foreach_get("matrix_world", flat)
+        # foreach_get flattens each matrix column by column
+        return flat.reshape(-1, 4, 4)[self.object_indices].transpose(0, 2, 1).astype(np.float64)
+
+    def read(self):
+        # State at the current frame; the segment transforms are only read once per frame
+        if self.state is None:
+            scene = bpy.context.scene
+            matrices = self.read_matrices()
+            velocities = None
+            if self.previous is not None and self.previous.frame == scene.frame_current - 1:
+                velocities = (matrices[:,:3,3] - self.previous.positions) * scene.render.fps
+            self.state = RopeState(scene.frame_current, matrices, velocities)
+        return self.state
+
+    def velocities(self):
+        # (N,3) velocities at the current frame; if the previous frame wasn't read, steps back to it (it is already in the
+        # rigid body point cache, so this does not re-simulate)
+        state = self.read()
+        if state.velocities is None:
+            scene = bpy.context.scene
+            scene.frame_set(state.frame - 1)
+            self.read()
+            scene.frame_set(state.frame)
+            state = self.read()
+        return state.velocities
+
+def invalidate_ropes(*args):
+    for rope in ROPES.values():
+        rope.invalidate()
+
+# Re-running a script in the same Blender session re-imports this module; keep a single handler
+bpy.app.handlers.frame_change_post[:] = [h for h in bpy.app.handlers.frame_change_post if getattr(h, "__name__", None) != "invalidate_ropes"]
+bpy.app.handlers.frame_change_post.append(invalidate_ropes)
+
+def get_rope(piece="Cylinder"):
+    # Handle on the rope whose segments are named piece, piece.001, ...
+    if piece not in ROPES:
+        Rope.from_scene(piece)
+    return ROPES[piece]
+
+def get_piece(piece_name, piece_id):
+    # Returns the piece with name piece_name, index piece_id (-1, 0 and None all mean the base object piece_name)
+    return get_rope(piece_name)[piece_id if piece_id not in (-1, None) else 0]
+
+def make_capsule_rope(params, piece="Cylinder", offset=(0,0,0), collision_collection=0):
+    '''Make a rigid rope composed of capsules linked by rigid body constraints; segments are named piece, piece.001, ...
+    offset and collision_collection let several independent ropes share one rigid body world (see multi_rope.py).
+    Returns the Rope handle (also available later through get_rope(piece))'''
     radius = params["segment_radius"]
     rope_length = radius * params["num_segments"]
     num_segments = int(rope_length / radius)
@@ -46,30 +159,53 @@ def make_capsule_rope(params):
     bend_damping = 5
     num_joints = int(radius/separation)*2+1
     bpy.ops.import_mesh.stl(filepath="data/capsule_12_8_1_2.stl")
-    loc0 = (radius*num_segments,0,0)
+    loc0 = (radius*num_segments+offset[0],offset[1],offset[2])
     link0 = bpy.context.object
     link0.location = loc0
     loc0 = loc0[0]
-    link0.name = "Cylinder"
-    bpy.ops.transform.resize(value=(radius, radius, radius))
+    link0.name = piece
+    link0.scale = (radius, radius, radius)
     link0.rotation_euler = (0, pi/2, 0)
-    bpy.ops.rigidbody.object_add()
+    link0.select_set(False)
+    bpy.ops.rigidbody.object_add({"object": link0, "active_object": link0})
     link0.rigid_body.mass = link_mass
     link0.rigid_body.friction = link_friction
     link0.rigid_body.linear_damping = params["linear_damping"]
     link0.rigid_body.angular_damping = params["angular_damping"] # NOTE: this makes the rope a lot less wiggly
+    link0.rigid_body.collision_collections = [i == collision_collection for i in range(20)]
     # These are simulation parameters that seemed to work well for simulation speed & collision handling
     bpy.context.scene.rigidbody_world.steps_per_second = 120
     bpy.context.scene.rigidbody_world.solver_iterations = 20
-    for i in range(num_segments-1):
-        bpy.ops.object.duplicate_move(TRANSFORM_OT_translate={"value":(-2*radius, 0, 0)})
-    bpy.ops.object.select_all(action='SELECT')
-    bpy.ops.rigidbody.connect(con_type='POINT', connection_pattern='CHAIN_DISTANCE')
-    bpy.ops.object.select_all(action='DESELECT')
-    links = [bpy.data.objects['Cylinder.%03d' % (i) if i>0 else "Cylinder"] for i in range(num_segments)]
-    return links
+    # Object.copy() shares the mesh datablock and carries the rigid body settings; linking the copy into link0's
+    # collections (scene + RigidBodyWorld) adds it to the simulation without any operator or selection state
+    links = [link0]
+    for i in range(1, num_segments):
+        link = link0.copy()
+        link.name = "%s.%03d" % (piece, i)
+        link.location = (loc0 - 2*radius*i, offset[1], offset[2])
+        for collection in link0.users_collection:
+            collection.objects.link(link)
+        links.append(link)
+    # Point constraints at the midpoint of each consecutive pair (same chain as rigidbody.connect with CHAIN_DISTANCE)
+    con0 = None
+    for i in reversed(range(num_segments-1)):
+        if con0 is None:
+            con = bpy.data.objects.new("Constraint", None)
+            bpy.context.scene.collection.objects.link(con)
+            bpy.ops.rigidbody.constraint_add({"object": con, "active_object": con})
+            con.empty_display_type = 'ARROWS'
+            con.rigid_body_constraint.type = 'POINT'
+            con0 = con
+        else:
+            con = con0.copy()
+            for collection in con0.users_collection:
+                collection.objects.link(con)
+        con.location = (links[i].location + links[i+1].location) / 2.0
+        con.rigid_body_constraint.object1 = links[i+1]
+        con.rigid_body_constraint.object2 = links[i]
+    return Rope(links, piece)
 
-def createNewBone(obj, new_bone_name, head, tail):
+def createNewBone(obj, new_bone_name, head, tail, piece="Cylinder"):
     '''A helper function to create armature'''
     bpy.ops.object.editmode_toggle()
     bpy.ops.armature.bone_primitive_add(name=new_bone_name)
@@ -79,9 +215,94 @@ def createNewBone(obj, new_bone_name, head, tail):
     bpy.ops.object.editmode_toggle()
     bone = obj.pose.bones[-1]
     constraint = bone.constraints.new('COPY_TRANSFORMS')
-    target_obj_name = "Cylinder" if new_bone_name == "Bone.000" else new_bone_name.replace("Bone", "Cylinder")
+    target_obj_name = piece if new_bone_name == "Bone.000" else new_bone_name.replace("Bone", piece)
     constraint.target = bpy.data.objects[target_obj_name]
 
+def add_bones(arm, n, radius, piece="Cylinder", offset=(0,0,0)):
+    '''Creates all n bones in a single edit-mode session, then constrains each to its capsule'''
+    bpy.context.view_layer.objects.active = arm
+    bpy.ops.object.mode_set(mode='EDIT')
+    for i in range(n):
+        loc = 2*radius*((n-i) - n//2)
+        edit_bone = arm.data.edit_bones.new("Bone.%03d"%i)
+        edit_bone.head = (loc+offset[0],offset[1],offset[2])
+        edit_bone.tail = (loc+offset[0],offset[1],offset[2]+1)
+    bpy.ops.object.mode_set(mode='OBJECT')
+    rope = get_rope(piece)
+    for i in range(n):
+        constraint = arm.pose.bones["Bone.%03d"%i].constraints.new('COPY_TRANSFORMS')
+        constraint.target = rope[i]
+
+def add_bones_per_segment(arm, n, radius, piece="Cylinder", offset=(0,0,0)):
+    '''Original bone construction (two edit-mode toggles per bone); kept for benchmarks/rig_rope.py'''
+    for i in range(n):
+        loc = 2*radius*((n-i) - n//2)
+        createNewBone(arm, "Bone.%03d"%i, (loc+offset[0],offset[1],offset[2]), (loc+offset[0],offset[1],offset[2]+1), piece)
+
+def add_hooks(bezier, arm, n, num_control_points):
+    '''Hooks each bezier control point to a bone by setting the modifier's vertex indices directly (no edit mode or hook_assign);
+    Blender < 2.90 has no vertex_indices_set, so there every point is assigned with hook_assign within one edit session'''
+    hooks = []
+    for i in range(num_control_points):
+        hook = bezier.modifiers.new(name = "Hook.%03d"%i, type = 'HOOK' )
+        hook.object = arm
+        hook.subtarget = "Bone.%03d"%(n-1-(i*n/num_control_points))
+        hooks.append(hook)
+    if hasattr(hooks[0], "vertex_indices_set"):
+        for i, hook in enumerate(hooks):
+            hook.vertex_indices_set([3*i+1]) # Each bezier point is (left handle, control point, right handle)
+        return
+    bpy.context.view_layer.objects.active = bezier
+    bpy.ops.object.mode_set(mode='EDIT')
+    bpy.ops.curve.select_all(action='DESELECT')
+    points = bezier.data.splines[0].bezier_points
+    for i, hook in enumerate(hooks):
+        points[i].select_control_point = True
+        bpy.ops.object.hook_assign(modifier=hook.name)
+        points[i].select_control_point = False
+    bpy.ops.object.mode_set(mode='OBJECT')
+
+def add_hooks_per_point(bezier, arm, n, num_control_points):
+    '''Original hook construction (select + hook_assign operator per control point); kept for benchmarks/rig_rope.py'''
+    bpy.ops.object.mode_set(mode='EDIT')
+    bpy.ops.curve.select_all(action='DESELECT')
+    for i in range(num_control_points):
+        bpy.ops.curve.select_all(action='DESELECT')
+        hook = bezier.modifiers.new(name = "Hook.%03d"%i, type = 'HOOK' )
+        hook.object = arm
+        hook.subtarget = "Bone.%03d"%(n-1-(i*n/num_control_points))
+        pt = bezier.data.splines[0].bezier_points[i]
+        pt.select_control_point = True
+        bpy.ops.object.hook_assign(modifier="Hook.%03d"%i)
+        pt.select_control_point = False
+    bpy.ops.object.mode_set(mode='OBJECT')
+
+CURVE_RIGS = {} # piece -> state of its directly driven curve (rig_rope(..., direct=True)); empty when the armature/hook rig is used
+
+def add_direct_drive(bezier, n, num_control_points, piece="Cylinder"):
+    '''Stores each control point's offset in the frame of the segment its hook would follow, so the curve can be posed straight from the segment transforms'''
+    bpy.context.view_layer.update()
+    segments = np.array([int(n-1-(i*n/num_control_points)) for i in range(num_control_points)])
+    points = bezier.data.splines[0].bezier_points
+    co = np.empty(3*len(points))
+    points.foreach_get("co", co)
+    bezier_mat = np.array(bezier.matrix_world)
+    world_co = co.reshape(-1, 3) @ bezier_mat[:3,:3].T + bezier_mat[:3,3]
+    seg_inv = np.linalg.inv(get_rope(piece).read_matrices()[segments])
+    offsets = np.einsum('kij,kj->ki', seg_inv[:,:3,:3], world_co) + seg_inv[:,:3,3]
+    CURVE_RIGS[piece] = {"bezier": bezier, "segments": segments, "offsets": offsets, "bezier_inv": np.linalg.inv(bezier_mat)}
+
+def update_curve_rig():
+    '''Poses every directly driven curve from the current segment transforms in one foreach_set each; no-op for the armature/hook rig'''
+    for piece, rig in CURVE_RIGS.items():
+        mats = get_rope(piece).read().matrices[rig["segments"]]
+        world_co = np.einsum('kij,kj->ki', mats[:,:3,:3], rig["offsets"]) + mats[:,:3,3]
+        bezier_inv = rig["bezier_inv"]
+        local_co = world_co @ bezier_inv[:3,:3].T + bezier_inv[:3,3]
+        points = rig["bezier"].data.splines[0].bezier_points
+        points.foreach_set("co", local_co.ravel())
+        points[0].co = points[0].co # foreach_set skips RNA updates; one assignment recalculates the AUTO handles and tags the curve
+
 def make_braid_rig(params, bezier):
     '''Braided rope armature'''
     n = params["num_segments"]
@@ -115,20 +336,24 @@ def make_cable_rig(params, bezier):
     '''Cable armature'''
     bpy.ops.object.modifier_add(type='CURVE')
     bpy.ops.curve.primitive_bezier_circle_add(radius=0.02)
-    bezier.data.bevel_object = bpy.data.objects["BezierCircle"]
+    bezier.data.bevel_object = bpy.context.object
     bpy.context.view_layer.objects.active = bezier
     return bezier
 
-def rig_rope(params, mode):
-    '''Adds rig (either braid or cable), hides capsules'''
-    bpy.ops.object.armature_add(enter_editmode=False, location=(0, 0, 0))
-    arm = bpy.context.object
+def rig_rope(params, mode, per_segment_ops=False, direct=False, piece="Cylinder", offset=(0,0,0)):
+    '''Adds rig (either braid or cable), hides capsules; per_segment_ops=True uses the original (slower) bone/hook construction.
+    direct=True skips the armature and hooks: the curve is only posed when update_curve_rig() is called (i.e. on rendered frames)'''
     n = params["num_segments"]
     radius = params["segment_radius"]
-    for i in range(n):
-        loc = 2*radius*((n-i) - n//2)
-        createNewBone(arm, "Bone.%03d"%i, (loc,0,0), (loc,0,1))
-    bpy.ops.curve.primitive_bezier_curve_add(location=(radius,0,0))
+    CURVE_RIGS.pop(piece, None)
+    if not direct:
+        bpy.ops.object.armature_add(enter_editmode=False, location=(0, 0, 0))
+        arm = bpy.context.object
+        if per_segment_ops:
+            add_bones_per_segment(arm, n, radius, piece, offset)
+        else:
+            add_bones(arm, n, radius, piece, offset)
+    bpy.ops.curve.primitive_bezier_curve_add(location=(radius+offset[0],offset[1],offset[2]))
     bezier_scale = n*radius
     bpy.ops.transform.resize(value=(bezier_scale, bezier_scale, bezier_scale))
     bezier = bpy.context.active_object
@@ -139,40 +364,54 @@ def rig_rope(params, mode):
     num_control_points = 40 # Tune this
     bpy.ops.curve.subdivide(number_cuts=num_control_points-2)
     bpy.ops.object.mode_set(mode='OBJECT')
-    bezier_points = bezier.data.splines[0].bezier_points
-    bpy.ops.object.mode_set(mode='EDIT')
-    bpy.ops.curve.select_all(action='DESELECT')
-    for i in range(num_control_points):
-        bpy.ops.curve.select_all(action='DESELECT')
-        hook = bezier.modifiers.new(name = "Hook.%03d"%i, type = 'HOOK' )
-        hook.object = arm
-        hook.subtarget = "Bone.%03d"%(n-1-(i*n/num_control_points))
-        pt = bpy.data.curves['BezierCurve'].splines[0].bezier_points[i]
-        pt.select_control_point = True
-        bpy.ops.object.hook_assign(modifier="Hook.%03d"%i)
-        pt.select_control_point = False
-    bpy.ops.object.mode_set(mode='OBJECT')
-    for i in range(n):
-        obj_name = "Cylinder.%03d"%i if i else "Cylinder"
-        bpy.data.objects[obj_name].hide_set(True)
-        bpy.data.objects[obj_name].hide_render = True
+    if direct:
+        add_direct_drive(bezier, n, num_control_points, piece)
+    elif per_segment_ops:
+        add_hooks_per_point(bezier, arm, n, num_control_points)
+    else:
+        add_hooks(bezier, arm, n, num_control_points)
+    for obj in get_rope(piece):
+        obj.hide_set(True)
+        obj.hide_render = True
     bezier.select_set(False)
     if mode == 'braid':
         rope = make_braid_rig(params, bezier)
     else:
         rope = make_cable_rig(params, bezier)
 
-def add_camera_light():
-    bpy.ops.object.light_add(type='SUN', radius=1, location=(0,0,0))
-    bpy.ops.object.camera_add(location=(2,0,28), rotation=(0,0,0))
+def add_camera_light(offset=(0,0,0), light=True):
+    if light:
+        bpy.ops.object.light_add(type='SUN', radius=1, location=(0,0,0))
+    bpy.ops.object.camera_add(location=(2+offset[0],offset[1],28+offset[2]), rotation=(0,0,0))
     bpy.context.scene.camera = bpy.context.object
+    return bpy.context.object
+
+def add_camera_rig(num_cameras, randomize=False, seed=0, target=(0,0,-5), distance=33, elevation=60, min_elevation=45, offset=(0,0,0)):
+    # Cameras looking at target (the table center): the add_camera_light camera first, then num_cameras-1 more, evenly spaced around
+    # the table at the given elevation (degrees), or at random azimuths, elevations in [min_elevation, 90) and distances within 10%
+    rng = np.random.RandomState(seed) # Its own generator, so adding cameras does not change the simulation's random actions
+    cameras = [bpy.context.scene.camera]
+    target = Vector(target) + Vector(offset)
+    for k in range(1, num_cameras):
+        if randomize:
+            azimuth, pitch, dist = rng.uniform(0, 2*pi), radians(rng.uniform(min_elevation, 90)), distance*rng.uniform(0.9, 1.1)
+        else:
+            azimuth, pitch, dist = 2*pi*(k-1)/(num_cameras-1), radians(elevation), distance
+        location = target + dist*Vector((cos(pitch)*cos(azimuth), cos(pitch)*sin(azimuth), sin(pitch)))
+        bpy.ops.object.camera_add(location=location)
+        camera = bpy.context.object
+        camera.name = "Camera_%02d" % k
+        camera.rotation_euler = (target - location).to_track_quat('-Z', 'Y').to_euler()
+        cameras.append(camera)
+    return cameras
 
-def make_table(params):
-    bpy.ops.mesh.primitive_plane_add(size=params["table_size"], location=(0,0,-5))
+def make_table(params, offset=(0,0,0), collision_collection=0):
+    bpy.ops.mesh.primitive_plane_add(size=params["table_size"], location=(offset[0],offset[1],offset[2]-5))
     bpy.ops.rigidbody.object_add()
     table = bpy.context.object
     table.rigid_body.type = 'PASSIVE'
     table.rigid_body.friction = 0.8
+    table.rigid_body.collision_collections = [i == collision_collection for i in range(20)]
     bpy.ops.object.select_all(action='DESELECT')
 
 if __name__ == '__main__':
@@ -0,0 +1,123 @@
+import bpy
+import numpy as np
+
+import os
+import sys
+import random
+import functools
+sys.path.append(os.getcwd())
+
+from rigidbody_rope import get_rope
+import knots
+import render
+import rasterize
+from crossings import CrossingAnalyzer
+from observations import ObservationBuffer, observation_spec
+
+'''Knot-untangling environment over the Blender scene (run inside worker.py; vec_env.py is the client side).
+
+reset() ties a knot from trajectories/ and straightens it like generate_dataset does; step(pull_idx, hold_idx, action_vec) runs
+render.take_pull_action (hold, pull, release, settle). Observations (segment positions, the analytic depth and mask images and,
+optionally, the rendered RGB image) are written into this environment's slot of a shared ObservationBuffer; the reward is the
+number of crossings removed by the step and the episode is done once no crossing is left or after max_steps.'''
+
+def env_observation_spec(params, rgb=False, piece="Cylinder"):
+    # Observation fields of a RopeEnv on this scene, so the client can create the shared buffer before the environments map it
+    return observation_spec(len(get_rope(piece)), params["render_width"], params["render_height"], rgb)
+
+def make_viewer_nodes():
+    # Compositor that only feeds the render to a Viewer node, whose image bpy can read after a render in background mode
+    # (the Render Result itself has no pixels there); the raw/None color settings of set_render_settings make it match the PNG
+    scene = bpy.context.scene
+    scene.use_nodes = True
+    tree = scene.node_tree
+    for node in tree.nodes:
+        tree.nodes.remove(node)
+    render_node = tree.nodes.new(type="CompositorNodeRLayers")
+    viewer = tree.nodes.new(type="CompositorNodeViewer")
+    viewer.use_alpha = False
+    tree.links.new(render_node.outputs["Image"], tree.nodes.new(type="CompositorNodeComposite").inputs["Image"])
+    tree.links.new(render_node.outputs["Image"], viewer.inputs["Image"])
+
+class RopeEnv(object):
+    def __init__(self, params, obs_path, num_envs, slot, rgb=False, max_steps=20, cache_dir=None, rest_matrices=None, piece="Cylinder"):
+        # Observations go to slot of the (num_envs, ...) ObservationBuffer at obs_path, which the client created; every reset
+        # starts from rest_matrices (the current pose by default)
+        self.params = params
+        self.piece = piece
+        self.rope = get_rope(piece)
+        self.rest_matrices = self.rope.read_matrices().copy() if rest_matrices is None else rest_matrices
+        # Observations are at params' full resolution; depth and mask are rasterized, so the compositor is not needed
+        render.set_render_settings(params["engine"], (params["render_width"], params["render_height"]), analytic_passes=True, clear_outputs=False)
+        bpy.context.scene.render.resolution_percentage = 100
+        self.obs = ObservationBuffer(obs_path, env_observation_spec(params, rgb, piece), num_envs).slot(slot)
+        self.rgb = rgb
+        if rgb:
+            make_viewer_nodes()
+            self.pixels = np.empty(params["render_width"] * params["render_height"] * 4, dtype=np.float32)
+        self.max_steps = max_steps
+        self.cache_dir = cache_dir
+        self.analyzer = CrossingAnalyzer()
+        self.frame = 0
+        self.steps = 0
+        self.num_crossings = 0
+        render.set_animation_settings(15000)
+
+    def reset(self, knot="pretzel", seed=None, knot_seed=0):
+        render.reset_rope(self.rest_matrices, self.piece)
+        self.analyzer = CrossingAnalyzer()
+        if seed is not None:
+            random.seed(seed)
+            np.random.seed(seed)
+        tie_fn = functools.partial(knots.tie_knot, name=knot)
+        self.frame = render.tie_and_straighten(self.params, knot, tie_fn, self.cache_dir, knot_seed)
+        self.steps = 0
+        self.num_crossings = self.observe()
+        return self.info()
+
+    def step(self, pull_idx, hold_idx, action_vec):
+        n = len(self.rope)
+        if not (0 <= pull_idx < n and 0 <= hold_idx < n):
+            raise ValueError("segment indices must be in [0, %d)" % n)
+        if self.frame + 200 > bpy.context.scene.frame_end:
+            raise RuntimeError("out of simulation frames (%d); reset the environment" % bpy.context.scene.frame_end)
+        self.frame, _ = render.take_pull_action(self.params, self.frame, int(pull_idx), int(hold_idx), [float(v) for v in action_vec])
+        self.steps += 1
+        num_crossings = self.observe()
+        reward = self.num_crossings - num_crossings
+        self.num_crossings = num_crossings
+        done = num_crossings == 0 or self.steps >= self.max_steps
+        return reward, done, self.info()
+
+    def observe(self):
+        # Writes the current observation into the shared buffer; returns the number of crossings
+        scene = bpy.context.scene
+        state = self.rope.read()
+        self.obs["positions"][:] = state.positions
+        K, cam_to_world, size = rasterize.camera_from_blender(scene.camera, scene)
+        depth_img, mask_img = rasterize.render_passes(state.matrices, K, cam_to_world, size)
+        self.obs["depth"][:] = depth_img
+        self.obs["mask"][:] = mask_img
+        if self.rgb:
+            self.obs["rgb"][:] = self.render_rgb()
+        return len(self.analyzer.update(state.positions))
+
+    def render_rgb(self):
+        # Renders through the scene camera and reads the Viewer node's image back as (height, width, 3) uint8, without a file
+        render.update_curve_rig()
+        bpy.ops.render.render()
+        image = bpy.data.images["Viewer Node"]
+        if hasattr(image.pixels, "foreach_get"):
+            image.pixels.foreach_get(self.pixels)
+        else:
+            self.pixels[:] = image.pixels[:] # Blender < 2.83 can only copy the pixels through a tuple
+        pixels = self.pixels.reshape(image.size[1], image.size[0], 4)
+        return np.round(np.clip(pixels[::-1,:,:3], 0, 1) * 255).astype(np.uint8) # Blender images start at the bottom row
+
+    def info(self):
+        # Oracle action (render.find_knot) included, e.g. for imitation learning or as a baseline policy
+        pull_idx, hold_idx, action_vec = render.find_knot(len(self.rope), piece=self.piece)
+        return {"frame": self.frame, "steps": self.steps, "crossings": self.num_crossings, "oracle": [pull_idx, hold_idx, action_vec]}
+
+    def close(self):
+        self.obs = None
@@ -0,0 +1,27 @@
+import numpy as np
+
+'''Motion-based settle detection, so simulation phases that wait for the rope to come to rest stop once it has instead of
+running a fixed number of frames (knots.settle_frames drives it from Blender).
+
+The kinetic-energy proxy is half the mean squared segment speed (unit mass per segment, in scene units^2/s^2), from the
+per-frame finite-difference velocities of Rope.read(); the rope counts as settled once it stays below threshold for window
+consecutive frames. Phases keep their old length as a cap. A threshold of 0 never settles, which restores the fixed windows.'''
+
+THRESHOLD = 5e-3 # rms segment speed of 0.1 units/s
+WINDOW = 10
+
+class SettleDetector(object):
+    def __init__(self, threshold=THRESHOLD, window=WINDOW):
+        self.threshold = threshold
+        self.window = window
+        self.calm = 0 # Consecutive frames below threshold
+        self.energy = None
+
+    def update(self, velocities):
+        # velocities: (N,3) array, or None when this frame's velocities are unknown; returns True once settled
+        if velocities is None:
+            self.calm = 0
+            return False
+        self.energy = 0.5 * float(np.mean(np.sum(np.square(velocities), axis=-1)))
+        self.calm = self.calm + 1 if self.energy < self.threshold else 0
+        return self.calm >= self.window
@@ -0,0 +1,200 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import threading
+import subprocess
+
+from annotations import AnnotationWriter, open_annotations, INDEX_FILENAME, DATA_FILENAME, LEGACY_FILENAME
+import recording
+from layout import OUTPUT_FILES
+from manifest import Manifest, MANIFEST_FILENAME
+
+'''Usage: python shard.py -n 4 --iters 8 (launches 4 headless Blender workers running render.py, then merges their outputs)'''
+
+def split_episodes(iters, num_workers):
+    # Splits iters episodes into contiguous (start_iter, num_iters) ranges, one per worker
+    ranges = []
+    start = 0
+    for w in range(num_workers):
+        count = iters//num_workers + (1 if w < iters%num_workers else 0)
+        if count > 0:
+            ranges.append((start, count))
+        start += count
+    return ranges
+
+class Shard(object):
+    def __init__(self, idx, start_iter, iters, seed, out_dir):
+        self.idx = idx
+        self.start_iter = start_iter
+        self.iters = iters
+        self.seed = seed
+        self.out_dir = out_dir
+        self.episodes_done = 0
+        self.proc = None
+        self.returncode = None
+
+    def launch(self, blender, extra_args=()):
+        # Starts a headless Blender worker; stdout is mirrored to out_dir/log.txt and parsed for progress
+        os.makedirs(self.out_dir, exist_ok=True)
+        cmd = [blender, '-b', '--python-exit-code', '1', '-P', 'render.py', '--',
+               '--seed', str(self.seed),
+               '--start_iter', str(self.start_iter),
+               '--iters', str(self.iters),
+               '--out_dir', self.out_dir] + list(extra_args)
+        self.proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+        self.reader = threading.Thread(target=self._read_output, daemon=True)
+        self.reader.start()
+
+    def _read_output(self):
+        with open(os.path.join(self.out_dir, 'log.txt'), 'w') as log:
+            for line in self.proc.stdout:
+                log.write(line)
+                if line.startswith("Episode"):
+                    self.episodes_done = int(line.split()[1].split('/')[0])
+        self.returncode = self.proc.wait()
+
+    def done(self):
+        return self.returncode is not None
+
+    def skip_if_finished(self):
+        # With --resume, a shard whose manifest already lists all of its episodes needs no Blender run; returns True if so
+        manifest = Manifest(self.out_dir)
+        if not set(range(self.start_iter, self.start_iter + self.iters)) <= manifest.completed():
+            return False
+        self.episodes_done = self.iters
+        self.returncode = 0
+        return True
+
+    def num_frames(self):
+        # Frames of finished episodes: from the manifest of a --resume run (anything after it belongs to an interrupted
+        # episode), otherwise every rendered frame
+        if os.path.exists(os.path.join(self.out_dir, MANIFEST_FILENAME)):
+            return Manifest(self.out_dir).num_frames()
+        return len([f for f in os.listdir(os.path.join(self.out_dir, "images")) if f.endswith("_rgb.png")])
+
+    def status(self):
+        if not self.done():
+            state = "running"
+        elif self.returncode == 0:
+            state = "done"
+        else:
+            state = "FAILED (exit %d, see %s)" % (self.returncode, os.path.join(self.out_dir, 'log.txt'))
+        return "shard %02d [episodes %d-%d, seed %d]: %d/%d %s" % (self.idx, self.start_iter, self.start_iter+self.iters-1, self.seed, self.episodes_done, self.iters, state)
+
+def link_or_copy(src, dst):
+    # Hard links when out_dir is on the same filesystem as the shards, so merging costs no copies and leaves the shards intact
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def clear_merged(out_dir):
+    # Removes the frames, annotations and trajectory of an earlier merge into out_dir, so a shorter merge leaves nothing stale
+    for folder, _ in OUTPUT_FILES:
+        folder = os.path.join(out_dir, folder)
+        os.makedirs(folder, exist_ok=True)
+        for name in os.listdir(folder):
+            if name.split('_')[0].isdigit() or name in [INDEX_FILENAME, DATA_FILENAME, LEGACY_FILENAME]:
+                os.remove(os.path.join(folder, name))
+    if os.path.exists(os.path.join(out_dir, "trajectory")):
+        shutil.rmtree(os.path.join(out_dir, "trajectory"))
+
+def merge_shards(shards, out_dir, legacy_json=False):
+    # Renumbers every shard's frames into one consecutive sequence and merges their annotations (and recorded trajectories).
+    # The shard folders are left as they are, so a merge can be re-run; it always starts from an empty out_dir
+    clear_merged(out_dir)
+    mapping = {} if legacy_json else AnnotationWriter(os.path.join(out_dir, "images"))
+    trajectory = None
+    offset = 0
+    for shard in shards:
+        images_dir = os.path.join(shard.out_dir, "images")
+        num_frames = shard.num_frames()
+        for folder, filename in OUTPUT_FILES:
+            for i in range(num_frames):
+                src = os.path.join(shard.out_dir, folder, filename % i)
+                if os.path.exists(src):
+                    link_or_copy(src, os.path.join(out_dir, folder, filename % (offset + i)))
+        if any(os.path.exists(os.path.join(images_dir, f)) for f in [INDEX_FILENAME, LEGACY_FILENAME]):
+            reader = open_annotations(images_dir)
+            for frame in reader.frames():
+                if frame >= num_frames:
+                    break
+                pixels = reader[frame]
+                mapping[str(offset + frame)] = [[pixel] for pixel in pixels.tolist()] if legacy_json else pixels
+        trajectory_dir = os.path.join(shard.out_dir, "trajectory")
+        if os.path.exists(os.path.join(trajectory_dir, recording.INDEX_FILENAME)):
+            reader = recording.TrajectoryReader(trajectory_dir)
+            if trajectory is None:
+                trajectory = recording.TrajectoryWriter(os.path.join(out_dir, "trajectory"), reader.num_segments, reader.scale, **reader.meta)
+            for frame in reader.frames():
+                if frame >= num_frames:
+                    break
+                trajectory.write_records(offset + frame, reader.sim_frame(frame), reader.records(frame))
+        offset += num_frames
+    if legacy_json:
+        with open(os.path.join(out_dir, "images", LEGACY_FILENAME), 'w') as outfile:
+            json.dump(mapping, outfile, sort_keys=True, indent=2)
+    else:
+        mapping.close()
+    if trajectory is not None:
+        trajectory.close()
+    return offset
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--num_workers', type=int, default=os.cpu_count())
+    parser.add_argument('--iters', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out_dir', type=str, default='.')
+    parser.add_argument('--shard_dir', type=str, default='./shards')
+    parser.add_argument('--blender', type=str, default='blender')
+    parser.add_argument('--knot_cache', type=str, default=None)
+    parser.add_argument('--knot_seeds', type=int, default=1)
+    parser.add_argument('--direct_rig', action='store_true')
+    parser.add_argument('--legacy_json', action='store_true')
+    parser.add_argument('--analytic_passes', action='store_true')
+    parser.add_argument('--record', action='store_true')
+    parser.add_argument('--resume', action='store_true') # Keep the shard folders of an interrupted run, skip their finished episodes and remerge them all
+    args = parser.parse_args()
+    worker_args = []
+    if args.knot_cache is not None:
+        worker_args = ['--knot_cache', os.path.abspath(args.knot_cache), '--knot_seeds', str(args.knot_seeds)]
+    if args.direct_rig:
+        worker_args.append('--direct_rig')
+    if args.legacy_json:
+        worker_args.append('--legacy_json')
+    if args.analytic_passes:
+        worker_args.append('--analytic_passes')
+    if args.record:
+        worker_args.append('--record')
+    if args.resume:
+        worker_args.append('--resume')
+
+    shards = []
+    for w, (start_iter, iters) in enumerate(split_episodes(args.iters, args.num_workers)):
+        shard_out = os.path.abspath(os.path.join(args.shard_dir, "shard_%02d" % w))
+        if os.path.exists(shard_out) and not args.resume:
+            shutil.rmtree(shard_out)
+        shards.append(Shard(w, start_iter, iters, args.seed + w, shard_out))
+    start = time.time()
+    for shard in shards:
+        if args.resume and shard.skip_if_finished():
+            continue
+        shard.launch(args.blender, worker_args)
+    while not all(shard.done() for shard in shards):
+        time.sleep(5)
+        print("[%.0fs] " % (time.time()-start) + " | ".join("%02d: %d/%d" % (s.idx, s.episodes_done, s.iters) for s in shards))
+    for shard in shards:
+        print(shard.status())
+    failed = [shard for shard in shards if shard.returncode != 0]
+    # Every successful shard is merged again from scratch, including those merged by an earlier (resumed) run
+    num_frames = merge_shards([shard for shard in shards if shard.returncode == 0], args.out_dir, args.legacy_json)
+    print("Merged %d frames from %d shards into %s" % (num_frames, len(shards)-len(failed), args.out_dir))
+    print("Time:", time.time()-start)
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,47 @@
+import numpy as np
+
+import annotations
+
+def frame_pixels(frame):
+    return np.arange(2 * (frame + 1), dtype=np.int16).reshape(-1, 2) + frame
+
+def write_frames(dir, frames, append=False):
+    with annotations.AnnotationWriter(str(dir), append=append) as writer:
+        for frame in frames:
+            writer[frame] = frame_pixels(frame)
+
+def test_round_trip(tmp_path):
+    write_frames(tmp_path, range(5))
+    reader = annotations.AnnotationReader(str(tmp_path))
+    assert reader.frames() == list(range(5))
+    for frame in range(5):
+        np.testing.assert_array_equal(reader[frame], frame_pixels(frame))
+
+def test_legacy_json_round_trip(tmp_path):
+    write_frames(tmp_path, range(3))
+    annotations.to_legacy_json(str(tmp_path))
+    legacy = annotations.LegacyAnnotationReader(str(tmp_path))
+    assert legacy.frames() == [0, 1, 2]
+    np.testing.assert_array_equal(legacy[2], frame_pixels(2))
+
+def test_truncate_then_resume(tmp_path):
+    # An interrupted run wrote frames 0-5 but only 0-3 belong to finished episodes
+    write_frames(tmp_path, range(6))
+    annotations.truncate(str(tmp_path), 4)
+    assert annotations.AnnotationReader(str(tmp_path)).frames() == [0, 1, 2, 3]
+    # The resumed run renders frames 4-6 again, appending after the kept ones
+    write_frames(tmp_path, range(4, 7), append=True)
+    reader = annotations.AnnotationReader(str(tmp_path))
+    assert reader.frames() == list(range(7))
+    for frame in range(7):
+        np.testing.assert_array_equal(reader[frame], frame_pixels(frame))
+
+def test_truncate_everything(tmp_path):
+    write_frames(tmp_path, range(3))
+    annotations.truncate(str(tmp_path), 0)
+    assert len(annotations.AnnotationReader(str(tmp_path))) == 0
+    write_frames(tmp_path, [0], append=True)
+    np.testing.assert_array_equal(annotations.AnnotationReader(str(tmp_path))[0], frame_pixels(0))
+
+def test_truncate_without_annotations(tmp_path):
+    annotations.truncate(str(tmp_path), 4) # Nothing written yet (first run with --resume)
@@ -0,0 +1,58 @@
+import numpy as np
+
+from crossings import CrossingAnalyzer, candidate_pairs, gauss_code
+
+def random_walk(rng, num_segments):
+    steps = rng.normal(size=(num_segments, 3)) * [1, 1, 0.1]
+    return np.cumsum(0.5 * steps / np.linalg.norm(steps, axis=1, keepdims=True), axis=0)
+
+def crossing_set(crossings):
+    return sorted((c.over, c.under, c.sign) for c in crossings)
+
+def brute_force_pairs(p):
+    # Every non-adjacent bond pair whose xy bounding boxes overlap
+    lo, hi = np.minimum(p[:-1,:2], p[1:,:2]), np.maximum(p[:-1,:2], p[1:,:2])
+    return {(i, j) for i in range(len(lo)) for j in range(i+2, len(lo)) if (lo[i] <= hi[j]).all() and (lo[j] <= hi[i]).all()}
+
+def test_candidate_pairs_cover_overlapping_boxes():
+    p = random_walk(np.random.RandomState(0), 200)
+    lengths = np.linalg.norm(p[1:,:2] - p[:-1,:2], axis=1)
+    i, j = candidate_pairs(p[:-1,:2], p[1:,:2], lengths.max())
+    assert brute_force_pairs(p) <= set(zip(i.tolist(), j.tolist()))
+
+def test_simple_crossing():
+    # A loop: the rope goes right, up, back left over its start, then down below it
+    p = np.array([[0, 0, 0], [2, 0, 0], [2, 1, 0], [1, 1, 0], [1, -1, 1], [1, -2, 1]], dtype=float)
+    crossings = CrossingAnalyzer().update(p)
+    assert len(crossings) == 1
+    assert (crossings[0].over, crossings[0].under) == (3, 0)
+    assert [kind for _, kind, _ in gauss_code(crossings)] == ['U', 'O']
+
+def test_incremental_matches_full():
+    rng = np.random.RandomState(1)
+    p = random_walk(rng, 300)
+    analyzer = CrossingAnalyzer()
+    analyzer.update(p)
+    for _ in range(20):
+        # Move a few stretches of the rope by about a segment length, like a pull action does
+        p = p.copy()
+        for start in rng.randint(0, len(p) - 10, size=3):
+            p[start:start+10] += rng.normal(scale=0.3, size=3) * [1, 1, 0.1]
+        assert crossing_set(analyzer.update(p)) == crossing_set(CrossingAnalyzer().update(p))
+
+def test_unmoved_rope_keeps_crossings():
+    p = random_walk(np.random.RandomState(2), 100)
+    analyzer = CrossingAnalyzer()
+    first = crossing_set(analyzer.update(p))
+    assert crossing_set(analyzer.update(p)) == first
+
+def test_slow_drift_is_caught():
+    # A strand slides across another by less than move_tol per update; the drift has to add up until the bond is re-tested
+    p = np.array([[0, 0, 0], [1, 0, 0], [2, 0, 0], [3, 0, 0], [3, 3, 0], [-0.5, 3, 1], [-0.5, -1, 1]], dtype=float)
+    analyzer = CrossingAnalyzer()
+    assert analyzer.update(p) == []
+    for _ in range(20000):
+        p[5:,0] += 5e-5
+        crossings = analyzer.update(p)
+    assert crossing_set(crossings) == crossing_set(CrossingAnalyzer().update(p))
+    assert len(crossings) == 1
@@ -0,0 +1,38 @@
+from manifest import Manifest
+
+def write_episode(dir, frames):
+    files = []
+    for frame in frames:
+        name = "images/%06d_rgb.png" % frame
+        (dir / name).write_bytes(b"frame %d" % frame)
+        files.append(name)
+    return files
+
+def test_append_and_reload(tmp_path):
+    (tmp_path / "images").mkdir()
+    manifest = Manifest(str(tmp_path))
+    assert manifest.completed() == set() and manifest.num_frames() == 0 and manifest.render_offset() == 0
+    manifest.append(0, [0, 1, 2], write_episode(tmp_path, [0, 1, 2]), knot="pretzel", render_offset=100)
+    manifest.append(1, [3, 4], write_episode(tmp_path, [3, 4]), knot="figure_eight", render_offset=200)
+    reloaded = Manifest(str(tmp_path))
+    assert reloaded.completed() == {0, 1}
+    assert reloaded.num_frames() == 5
+    assert reloaded.render_offset() == 200
+    assert reloaded.episodes[1]["knot"] == "figure_eight"
+    assert reloaded.verify() == []
+
+def test_partial_last_line_ignored(tmp_path):
+    (tmp_path / "images").mkdir()
+    manifest = Manifest(str(tmp_path))
+    manifest.append(0, [0], write_episode(tmp_path, [0]), render_offset=10)
+    with open(manifest.path, 'a') as f:
+        f.write('{"episode": 1, "fra')
+    assert Manifest(str(tmp_path)).completed() == {0}
+
+def test_verify_reports_changed_files(tmp_path):
+    (tmp_path / "images").mkdir()
+    manifest = Manifest(str(tmp_path))
+    manifest.append(0, [0, 1], write_episode(tmp_path, [0, 1]), render_offset=10)
+    (tmp_path / "images" / "000000_rgb.png").write_bytes(b"changed")
+    (tmp_path / "images" / "000001_rgb.png").unlink()
+    assert Manifest(str(tmp_path)).verify() == ["images/000000_rgb.png", "images/000001_rgb.png"]
@@ -0,0 +1,56 @@
+import json
+import os
+
+import numpy as np
+
+import numpy_rope
+
+def load_params(**overrides):
+    with open(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "rigidbody_params.json")) as f:
+        params = json.load(f)
+    params.update(overrides)
+    return params
+
+def test_key_evaluation():
+    sim = numpy_rope.RopeBatch(load_params(), batch_size=2)
+    start = sim.x[1, 3].copy()
+    sim.take_action(1, 3, 11, (1, 0, 0))
+    sim.toggle_animation(1, 3, 21, False)
+    sim.evaluate_keys(6)
+    # Halfway between the frame 1 and frame 11 keys; smoothstep(0.5) = 0.5
+    np.testing.assert_allclose(sim.targets[1, 3], start + [0.5, 0, 0])
+    assert sim.kinematic[1, 3] and not sim.kinematic[0, 3]
+    sim.evaluate_keys(3.5)
+    np.testing.assert_allclose(sim.targets[1, 3], start + [numpy_rope.smoothstep(0.25), 0, 0])
+    sim.evaluate_keys(15)
+    np.testing.assert_allclose(sim.targets[1, 3], start + [1, 0, 0]) # Holds the last key
+    sim.evaluate_keys(21)
+    assert not sim.kinematic[1, 3]
+
+def test_keys_recompiled_after_edit():
+    sim = numpy_rope.RopeBatch(load_params(), batch_size=1)
+    sim.take_action(0, 0, 11, (0, 0, 1))
+    sim.evaluate_keys(11)
+    sim.take_action(0, 5, 11, (0, 1, 0))
+    sim.evaluate_keys(11)
+    np.testing.assert_allclose(sim.targets[0, 5], sim.location[0, 5])
+
+def test_angular_damping_slows_spin():
+    # Two segments spinning about their common center, no gravity or contacts involved
+    spins = []
+    for damping in (0.0, 0.55):
+        sim = numpy_rope.RopeBatch(load_params(angular_damping=damping, linear_damping=0.0, num_segments=2), batch_size=1)
+        sim.v[0, 0] = (0, 1, 0)
+        sim.v[0, 1] = (0, -1, 0)
+        momentum = sim.v.sum(axis=1)
+        sim.damp_rotation(np.full((1, 2), sim.inv_mass))
+        np.testing.assert_allclose(sim.v.sum(axis=1), momentum)
+        spins.append(sim.v[0, 0, 1] - sim.v[0, 1, 1])
+    assert spins[0] == 2 and 0 < spins[1] < 2
+
+def test_trajectories_load_from_any_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    trajectory = numpy_rope.load_trajectory("pretzel")
+    sim = numpy_rope.RopeBatch(load_params(), batch_size=1)
+    sim.apply_trajectory(0, trajectory)
+    assert sim.kinematic[0].any()
@@ -0,0 +1,27 @@
+import os
+
+import numpy as np
+
+from observations import ALIGNMENT, ObservationBuffer, observation_spec
+
+def test_fields_shared_between_mappings(tmp_path):
+    path = str(tmp_path / "obs")
+    spec = observation_spec(5, 8, 6, rgb=True)
+    owner = ObservationBuffer(path, spec, num_envs=3, create=True)
+    assert owner["positions"].shape == (3, 5, 3) and owner["rgb"].shape == (3, 6, 8, 3)
+    assert not any(array.any() for array in owner.arrays.values())
+    # A worker maps the same file and writes its slot; the owner sees it without copying
+    worker = ObservationBuffer(path, spec, num_envs=3).slot(1)
+    worker["positions"][:] = np.arange(15).reshape(5, 3)
+    worker["mask"][:] = 1
+    np.testing.assert_array_equal(owner["positions"][1], np.arange(15).reshape(5, 3))
+    assert owner["mask"][1].all() and not owner["mask"][[0, 2]].any()
+    owner.close(unlink=True)
+    assert not os.path.exists(path)
+
+def test_fields_are_aligned(tmp_path):
+    buffer = ObservationBuffer(str(tmp_path / "obs"), observation_spec(7, 5, 3), num_envs=3, create=True)
+    base = buffer.memory.ctypes.data
+    for array in buffer.arrays.values():
+        assert (array.ctypes.data - base) % ALIGNMENT == 0
+    buffer.close()
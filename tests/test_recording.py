@@ -0,0 +1,57 @@
+import os
+
+import numpy as np
+
+import recording
+
+def random_matrices(rng, num_segments, scale=0.25):
+    # Segment world matrices: random rotations (from QR) scaled uniformly, random positions
+    q, r = np.linalg.qr(rng.normal(size=(num_segments, 3, 3)))
+    q *= np.sign(np.diagonal(r, axis1=1, axis2=2))[:,None,:]
+    q[np.linalg.det(q) < 0] *= -1
+    matrices = np.zeros((num_segments, 4, 4))
+    matrices[:,:3,:3] = q * scale
+    matrices[:,:3,3] = rng.uniform(-5, 5, size=(num_segments, 3))
+    matrices[:,3,3] = 1
+    return matrices
+
+def write_frames(dir, frames, num_segments=8, append=False):
+    with recording.TrajectoryWriter(str(dir), num_segments, 0.25, append=append, fps=24) as writer:
+        for frame in frames:
+            writer.write(frame, 10 + frame, random_matrices(np.random.RandomState(frame), num_segments))
+
+def test_quaternion_round_trip():
+    matrices = random_matrices(np.random.RandomState(0), 1000, scale=1)
+    rotations = recording.quaternions_to_matrices(recording.matrices_to_quaternions(matrices[:,:3,:3]))
+    np.testing.assert_allclose(rotations, matrices[:,:3,:3], atol=1e-9)
+
+def test_encode_decode():
+    matrices = random_matrices(np.random.RandomState(1), 100)
+    np.testing.assert_allclose(recording.decode(recording.encode(matrices), 0.25), matrices, atol=1e-4)
+
+def test_writer_reader_round_trip(tmp_path):
+    write_frames(tmp_path, range(5))
+    reader = recording.TrajectoryReader(str(tmp_path))
+    assert reader.frames() == list(range(5))
+    assert reader.meta["fps"] == 24
+    for frame in range(5):
+        assert reader.sim_frame(frame) == 10 + frame
+        np.testing.assert_allclose(reader[frame], random_matrices(np.random.RandomState(frame), 8), atol=1e-4)
+
+def test_truncate_then_resume(tmp_path):
+    write_frames(tmp_path, range(6))
+    recording.truncate(str(tmp_path), 4)
+    assert recording.TrajectoryReader(str(tmp_path)).frames() == [0, 1, 2, 3]
+    write_frames(tmp_path, range(4, 7), append=True)
+    reader = recording.TrajectoryReader(str(tmp_path))
+    assert reader.frames() == list(range(7))
+    for frame in range(7):
+        np.testing.assert_allclose(reader[frame], random_matrices(np.random.RandomState(frame), 8), atol=1e-4)
+
+def test_reader_skips_torn_frame(tmp_path):
+    write_frames(tmp_path, range(3))
+    # A crash mid-write: the last frame's index row made it to disk but only part of its data did
+    data_path = os.path.join(str(tmp_path), recording.DATA_FILENAME)
+    with open(data_path, 'r+b') as f:
+        f.truncate(os.path.getsize(data_path) - 1)
+    assert recording.TrajectoryReader(str(tmp_path)).frames() == [0, 1]
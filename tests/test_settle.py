@@ -0,0 +1,27 @@
+import numpy as np
+
+from settle import SettleDetector
+
+def test_settles_after_window_calm_frames():
+    detector = SettleDetector(threshold=1e-2, window=3)
+    still = np.full((10, 3), 0.01)
+    assert [detector.update(still) for _ in range(4)] == [False, False, True, True]
+    assert detector.energy < 1e-2
+
+def test_motion_restarts_the_window():
+    detector = SettleDetector(threshold=1e-2, window=3)
+    still, moving = np.zeros((10, 3)), np.ones((10, 3))
+    detector.update(still)
+    detector.update(still)
+    assert not detector.update(moving)
+    assert [detector.update(still) for _ in range(3)] == [False, False, True]
+
+def test_unknown_velocities_restart_the_window():
+    detector = SettleDetector(threshold=1e-2, window=2)
+    detector.update(np.zeros((10, 3)))
+    assert not detector.update(None)
+    assert [detector.update(np.zeros((10, 3))) for _ in range(2)] == [False, True]
+
+def test_zero_threshold_never_settles():
+    detector = SettleDetector(threshold=0, window=1)
+    assert not any(detector.update(np.zeros((10, 3))) for _ in range(20))
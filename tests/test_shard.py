@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+
+import shard
+from annotations import AnnotationReader, AnnotationWriter
+from layout import OUTPUT_FILES
+from manifest import Manifest
+
+def make_shard(dir, idx, num_frames):
+    out_dir = str(dir / ("shard_%02d" % idx))
+    with AnnotationWriter(os.path.join(out_dir, "images")) as writer:
+        for frame in range(num_frames):
+            writer[frame] = np.full((2, 2), 10*idx + frame)
+    for folder, filename in OUTPUT_FILES:
+        os.makedirs(os.path.join(out_dir, folder), exist_ok=True)
+        for frame in range(num_frames):
+            with open(os.path.join(out_dir, folder, filename % frame), 'w') as f:
+                f.write("%d/%d" % (idx, frame))
+    return shard.Shard(idx, 0, 1, idx, out_dir)
+
+def merged_frames(out_dir):
+    return sorted(os.listdir(os.path.join(out_dir, "images_depth")))
+
+def check_merge(out_dir):
+    reader = AnnotationReader(os.path.join(out_dir, "images"))
+    assert reader.frames() == [0, 1, 2, 3, 4]
+    assert [int(reader[frame][0, 0]) for frame in reader.frames()] == [0, 1, 2, 10, 11]
+    with open(os.path.join(out_dir, "images", "000003_rgb.png")) as f:
+        assert f.read() == "1/0"
+    assert merged_frames(out_dir) == ["%06d_rgb.png" % frame for frame in range(5)]
+
+def test_merge_is_repeatable(tmp_path):
+    shards = [make_shard(tmp_path, 0, 3), make_shard(tmp_path, 1, 2)]
+    out_dir = str(tmp_path / "out")
+    assert shard.merge_shards(shards, out_dir) == 5
+    check_merge(out_dir)
+    # The shards are untouched, so merging again gives the same result
+    assert shard.merge_shards(shards, out_dir) == 5
+    check_merge(out_dir)
+
+def test_merge_clears_stale_frames(tmp_path):
+    out_dir = str(tmp_path / "out")
+    shards = [make_shard(tmp_path, 0, 3), make_shard(tmp_path, 1, 4)]
+    shard.merge_shards(shards, out_dir)
+    # Merging fewer frames into the same out_dir must not leave frames 3-6 of the first merge behind
+    shard.merge_shards(shards[:1], out_dir)
+    assert merged_frames(out_dir) == ["%06d_rgb.png" % frame for frame in range(3)]
+    assert AnnotationReader(os.path.join(out_dir, "images")).frames() == [0, 1, 2]
+
+def test_resumed_shards_use_their_manifest(tmp_path):
+    # shard_00 finished both episodes; shard_01 finished one (frames 0-1) and was interrupted while rendering frame 2
+    finished, interrupted = make_shard(tmp_path, 0, 3), make_shard(tmp_path, 1, 3)
+    finished.iters = interrupted.iters = 2
+    Manifest(finished.out_dir).append(0, [0, 1], [], render_offset=2)
+    Manifest(finished.out_dir).append(1, [2], [], render_offset=3)
+    Manifest(interrupted.out_dir).append(0, [0, 1], [], render_offset=2)
+    assert finished.skip_if_finished() and finished.returncode == 0
+    assert not interrupted.skip_if_finished()
+    out_dir = str(tmp_path / "out")
+    assert shard.merge_shards([finished, interrupted], out_dir) == 5
+    check_merge(out_dir)
@@ -0,0 +1,26 @@
+from timing import PhaseTimer
+
+def test_nested_profiled_phases(tmp_path):
+    timer = PhaseTimer()
+    timer.configure(profile_phases=["loosen", "render"], profile_dir=str(tmp_path))
+    with timer.phase("loosen", frames=3):
+        for _ in range(2):
+            with timer.phase("render"):
+                pass
+    with timer.phase("render"):
+        pass
+    assert timer.profiling is None
+    assert timer.phases["loosen"]["calls"] == 1 and timer.phases["loosen"]["frames"] == 3
+    assert timer.phases["render"]["calls"] == 3
+    timer.dump_profiles()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["loosen.prof", "render.prof"]
+
+def test_end_episode_resets(tmp_path):
+    timer = PhaseTimer()
+    timer.configure(metrics_path=str(tmp_path / "metrics.jsonl"))
+    with timer.phase("tie"):
+        timer.count("settle_tie", frames=4, saved=6)
+    record = timer.end_episode(episode=0)
+    assert record["counters"] == {"settle_tie": {"frames": 4, "saved": 6}}
+    assert timer.phases == {} and timer.counters == {}
+    assert len((tmp_path / "metrics.jsonl").read_text().splitlines()) == 1
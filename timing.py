@@ -0,0 +1,94 @@
+import os
+import json
+import time
+import cProfile
+import functools
+from contextlib import contextmanager
+
+'''Per-phase wall/CPU timing for the render pipeline, emitted as one JSON line per episode.
+
+Phases nest (e.g. "render" runs inside "loosen"), so each phase's time is inclusive of the phases inside it.
+Timing costs two clock reads per phase entry, so TIMER is always on; cProfile capture is opt-in per phase. Only one profiler can be
+active at a time, so a profiled phase that runs inside another profiled phase is captured in the enclosing phase's profile.'''
+
+class PhaseTimer(object):
+    def __init__(self):
+        self.metrics_path = None
+        self.profile_dir = None
+        self.profiled = set()
+        self.profiles = {}
+        self.profiling = None # Profiled phase whose profiler is currently enabled
+        self.reset()
+
+    def configure(self, metrics_path=None, profile_phases=(), profile_dir="profiles"):
+        # metrics_path: JSON lines file that end_episode appends to; profile_phases: phase names to capture with cProfile
+        self.metrics_path = metrics_path
+        self.profiled = set(profile_phases)
+        self.profile_dir = profile_dir
+
+    def reset(self):
+        self.phases = {}
+        self.counters = {}
+        self.episode_start = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name, frames=0):
+        # Times the enclosed block under name; frames is the number of simulated frames it covers (or add to the yielded
+        # stats["frames"] once it is known)
+        stats = self.phases.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0, "frames": 0})
+        profiler = None
+        if name in self.profiled and self.profiling is None:
+            profiler = self.profiles.setdefault(name, cProfile.Profile())
+            profiler.enable()
+            self.profiling = name
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield stats
+        finally:
+            stats["wall"] += time.perf_counter() - wall
+            stats["cpu"] += time.process_time() - cpu
+            stats["calls"] += 1
+            stats["frames"] += frames
+            if profiler is not None:
+                profiler.disable()
+                self.profiling = None
+
+    def count(self, name, **values):
+        # Accumulates named counts for this episode (e.g. count("settle_loosen", frames=12, saved=18)), emitted under "counters"
+        counters = self.counters.setdefault(name, {})
+        for key, value in values.items():
+            counters[key] = counters.get(key, 0) + value
+
+    def timed(self, name):
+        # Decorator form of phase() for functions that are a phase in their own right
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.phase(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def end_episode(self, **info):
+        # Emits this episode's per-phase metrics (plus any info fields) and starts a new episode; returns the record
+        record = dict(info)
+        record["wall"] = time.perf_counter() - self.episode_start
+        record["phases"] = self.phases
+        if self.counters:
+            record["counters"] = self.counters
+        if self.metrics_path is not None:
+            with open(self.metrics_path, "a") as f:
+                f.write(json.dumps(record, sort_keys=True) + "\n")
+        self.reset()
+        return record
+
+    def dump_profiles(self):
+        # Writes one .prof file per profiled phase (view with python -m pstats or snakeviz)
+        if not self.profiles:
+            return
+        if not os.path.exists(self.profile_dir):
+            os.makedirs(self.profile_dir)
+        for name, profiler in self.profiles.items():
+            profiler.dump_stats(os.path.join(self.profile_dir, "%s.prof" % name))
+
+TIMER = PhaseTimer()
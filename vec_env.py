@@ -0,0 +1,125 @@
+import os
+import time
+import argparse
+import numpy as np
+
+from worker_client import BlenderWorker
+from observations import ObservationBuffer, shm_path
+
+'''Usage: python vec_env.py -n 4 --steps 5 (runs the oracle policy on 4 environments as a smoke test)
+Gym-style knot-untangling environments, each in its own persistent Blender process (worker.py + rope_env.py).
+
+VecRopeEnv steps M environments at once: step_async() sends every action and returns immediately, so the policy can compute the
+next actions (e.g. for another group of environments) while Blender simulates, and step_wait() collects the results. Observations
+are NumPy arrays stacked over the environments in one shared-memory ObservationBuffer that the workers write into directly:
+positions (M, num_segments, 3), depth and mask (M, height, width) and, with rgb=True, rgb (M, height, width, 3). The arrays
+returned by reset/step_wait are views of that buffer and are overwritten by the next call; copy them to keep them.
+An action is (pull_idx, hold_idx, action_vec): hold segment hold_idx, move segment pull_idx by action_vec, release, settle.'''
+
+class VecRopeEnv(object):
+    def __init__(self, num_envs, blender='blender', worker_args=(), rgb=False, max_steps=20, knots=("pretzel", "figure_eight"), seed=0, log_dir=None):
+        # worker_args go to every worker.py (e.g. ['--resolution', '320x240', '--knot_cache', 'knot_cache']); log_dir keeps each
+        # worker's Blender output in log_dir/env_XX.txt
+        self.num_envs = num_envs
+        self.knots = list(knots)
+        self.seed = seed
+        self.episodes = [0] * num_envs
+        if log_dir is not None and not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+        # Start every worker before waiting for any, so the scenes are built in parallel
+        self.workers = [BlenderWorker(blender, worker_args, log=None if log_dir is None else os.path.join(log_dir, "env_%02d.txt" % k), wait=False)
+                        for k in range(num_envs)]
+        for worker in self.workers:
+            worker.wait_ready()
+        spec = self.workers[0].call("env_spec", rgb=rgb)
+        self.buffer = ObservationBuffer(shm_path(), spec, num_envs, create=True)
+        for k, worker in enumerate(self.workers):
+            worker.submit("env_make", obs_path=self.buffer.path, num_envs=num_envs, slot=k, rgb=rgb, max_steps=max_steps)
+        for worker in self.workers:
+            worker.receive()
+        self.waiting = set()
+
+    def observations(self, indices=None):
+        if indices is None:
+            return dict(self.buffer.arrays)
+        return {name: array[indices] for name, array in self.buffer.arrays.items()}
+
+    def reset(self, indices=None, knots=None):
+        # Ties a new knot in the given environments (all by default), cycling through self.knots unless knots is given;
+        # returns (observations of those environments, infos)
+        indices = list(range(self.num_envs)) if indices is None else [int(k) for k in indices]
+        assert not self.waiting.intersection(indices), "step_wait() the pending step of these environments before resetting them"
+        for n, k in enumerate(indices):
+            knot = knots[n] if knots is not None else self.knots[self.episodes[k] % len(self.knots)]
+            self.workers[k].submit("env_reset", knot=knot, seed=self.seed + 1000003*k + self.episodes[k])
+            self.episodes[k] += 1
+        infos = [self.workers[k].receive()["info"] for k in indices]
+        return self.observations(None if len(indices) == self.num_envs else indices), infos
+
+    def step_async(self, actions, indices=None):
+        # Sends one (pull_idx, hold_idx, action_vec) per environment in indices (all by default) without waiting
+        indices = list(range(self.num_envs)) if indices is None else [int(k) for k in indices]
+        assert not self.waiting.intersection(indices), "step_wait() the previous step of these environments first"
+        for k, (pull_idx, hold_idx, action_vec) in zip(indices, actions):
+            self.workers[k].submit("env_step", pull_idx=int(pull_idx), hold_idx=int(hold_idx), action_vec=[float(v) for v in action_vec])
+        self.waiting.update(indices)
+
+    def step_wait(self, indices=None):
+        # Waits for the pending steps of indices (all by default); returns (observations, rewards, dones, infos) for them
+        indices = sorted(self.waiting) if indices is None else [int(k) for k in indices]
+        results = [self.workers[k].receive() for k in indices]
+        self.waiting.difference_update(indices)
+        rewards = np.array([r["reward"] for r in results], dtype=np.float32)
+        dones = np.array([r["done"] for r in results], dtype=bool)
+        return self.observations(None if len(indices) == self.num_envs else indices), rewards, dones, [r["info"] for r in results]
+
+    def step(self, actions, indices=None):
+        self.step_async(actions, indices)
+        return self.step_wait(indices)
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
+        self.buffer.close(unlink=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class SingleRopeEnv(VecRopeEnv):
+    '''Single environment: reset() -> (observation, info), step(pull_idx, hold_idx, action_vec) -> (observation, reward, done, info)'''
+    def __init__(self, **kwargs):
+        super(SingleRopeEnv, self).__init__(1, **kwargs)
+
+    def reset(self, knot=None):
+        observations, infos = super(SingleRopeEnv, self).reset(knots=None if knot is None else [knot])
+        return {name: array[0] for name, array in observations.items()}, infos[0]
+
+    def step(self, pull_idx, hold_idx, action_vec):
+        observations, rewards, dones, infos = super(SingleRopeEnv, self).step([(pull_idx, hold_idx, action_vec)])
+        return {name: array[0] for name, array in observations.items()}, float(rewards[0]), bool(dones[0]), infos[0]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--num_envs', type=int, default=2)
+    parser.add_argument('--steps', type=int, default=5)
+    parser.add_argument('--blender', type=str, default='blender')
+    parser.add_argument('--rgb', action='store_true')
+    parser.add_argument('--log_dir', type=str, default=None)
+    args, worker_args = parser.parse_known_args() # Anything else is passed on to worker.py
+    start = time.time()
+    with VecRopeEnv(args.num_envs, args.blender, worker_args, rgb=args.rgb, log_dir=args.log_dir) as env:
+        print("%d environments ready after %.1fs" % (args.num_envs, time.time()-start))
+        observations, infos = env.reset()
+        print("reset: crossings %s" % [info["crossings"] for info in infos])
+        for t in range(args.steps):
+            step_start = time.time()
+            observations, rewards, dones, infos = env.step([info["oracle"] for info in infos])
+            print("step %d (%.1fs): rewards %s, crossings %s, done %s" % (t, time.time()-step_start, rewards.tolist(), [info["crossings"] for info in infos], dones.tolist()))
+            if dones.any():
+                _, reset_infos = env.reset(np.flatnonzero(dones))
+                for k, info in zip(np.flatnonzero(dones), reset_infos):
+                    infos[k] = info
+    print("Time:", time.time()-start)
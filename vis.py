@@ -5,36 +5,89 @@ import os
 import math
 import json
 import colorsys
+from multiprocessing import Pool
+from annotations import open_annotations
+
+def circle_offsets(radius=1):
+    # (dy, dx) offsets of the pixels cv2.circle fills for a point, taken from cv2 itself so the stamp matches exactly
+    size = 2*radius + 1
+    canvas = np.zeros((size, size), dtype=np.uint8)
+    cv2.circle(canvas, (radius, radius), radius, 255, -1)
+    dy, dx = np.nonzero(canvas)
+    return dy - radius, dx - radius
+
+CIRCLE_DY, CIRCLE_DX = circle_offsets()
+PALETTES = {}
+
+def get_palette(n):
+    # Hue-ramp colours for n keypoints (as (R, G, B) written in cv2's channel order, like the original per-point loop), computed once per n
+    if n not in PALETTES:
+        colors = []
+        for i in range(n):
+            (r, g, b) = colorsys.hsv_to_rgb(float(i)/n, 1.0, 1.0)
+            colors.append((int(255 * r), int(255 * g), int(255 * b)))
+        PALETTES[n] = np.array(colors, dtype=np.uint8).reshape(-1, 3)
+    return PALETTES[n]
+
+def draw_keypoints(img, pixels):
+    # Rasterizes every keypoint at once; equivalent to one cv2.circle(img, (u, v), 1, color, -1) per keypoint in order
+    pixels = np.asarray(pixels, dtype=int).reshape(-1, 2)
+    colors = get_palette(len(pixels))
+    h, w = img.shape[:2]
+    ys = (pixels[:,1,None] + CIRCLE_DY[None,:]).ravel()
+    xs = (pixels[:,0,None] + CIRCLE_DX[None,:]).ravel()
+    point_colors = np.repeat(colors, len(CIRCLE_DY), axis=0)
+    inside = (ys >= 0) & (ys < h) & (xs >= 0) & (xs < w)
+    flat = (ys*w + xs)[inside]
+    point_colors = point_colors[inside]
+    # Later keypoints are drawn over earlier ones: keep only the last write to each pixel
+    _, last = np.unique(flat[::-1], return_index=True)
+    last = len(flat) - 1 - last
+    img.reshape(-1, img.shape[2])[flat[last]] = point_colors[last]
+    return img
 
 def show_knots(idx, knots_info, dir, save=True):
-    # Annotate all the images in /images using exported pixels from images/knots_info.json
+    # Annotate all the images in /images using exported pixels from images/keypoints.{bin,idx} (or images/knots_info.json)
     image_filename = "{0:06d}_rgb.png".format(idx)
     img = cv2.imread('{}/{}'.format(dir, image_filename))
-    pixels = knots_info[str(idx)]
-    pixels = [i[0] for i in pixels]
-    vis = img.copy()
+    pixels = knots_info[idx]
+    vis = draw_keypoints(img.copy(), pixels)
     print("Annotating %06d"%idx)
-    for i, (u, v) in enumerate(pixels):
-        (r, g, b) = colorsys.hsv_to_rgb(float(i)/len(pixels), 1.0, 1.0)
-        R, G, B = int(255 * r), int(255 * g), int(255 * b)
-        cv2.circle(vis,(int(u), int(v)), 1, (R, G, B), -1)
     if save:
     	annotated_filename = "{0:06d}_annotated.png".format(idx)
     	cv2.imwrite('./annotated/{}'.format(annotated_filename), vis)
+    return vis
+
+WORKER_STATE = {}
+
+def init_worker(dir):
+    # Each pool worker opens the annotations once; frames are then read lazily by index
+    WORKER_STATE["knots_info"] = open_annotations(dir)
+    WORKER_STATE["dir"] = dir
+
+def show_knots_worker(idx):
+    show_knots(idx, WORKER_STATE["knots_info"], WORKER_STATE["dir"])
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument('-n', '--num', type=int, default=len(os.listdir('./images')) - 1)
+    parser.add_argument('-n', '--num', type=int, default=None)
     parser.add_argument('-d', '--dir', type=str, default='images')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count())
     args = parser.parse_args()
+    if args.num is None:
+        args.num = len([f for f in os.listdir(args.dir) if f.endswith('_rgb.png')])
     if not os.path.exists("./annotated"):
         os.makedirs('./annotated')
     else:
         os.system("rm -rf ./annotated")
         os.makedirs("./annotated")
     print("parsed")
-    with open("{}/knots_info.json".format(args.dir), "r") as stream:
-    	knots_info = json.load(stream)
-    print("loaded knots info")
-    for i in range(args.num):
-        show_knots(i, knots_info, args.dir)
+    if args.workers > 1:
+        with Pool(args.workers, initializer=init_worker, initargs=(args.dir,)) as pool:
+            for _ in pool.imap_unordered(show_knots_worker, range(args.num), chunksize=8):
+                pass
+    else:
+        knots_info = open_annotations(args.dir)
+        print("loaded knots info")
+        for i in range(args.num):
+            show_knots(i, knots_info, args.dir)
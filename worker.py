@@ -0,0 +1,212 @@
+import bpy
+import numpy as np
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import traceback
+sys.path.append(os.getcwd())
+
+from rigidbody_rope import get_rope
+import render
+import rope_env
+from render import TIMER
+
+'''Usage: blender -b -P worker.py -- [--port 5005] [render.py flags, e.g. --rig braid --analytic_passes]
+Long-lived Blender worker: builds the rope, rig, camera and table once, then runs episode jobs sent as one JSON-RPC request per line,
+over stdin/stdout by default or a local TCP socket with --port. Between jobs the rope is put back at the pose it was built in, so a
+job costs only its simulation and rendering. worker_client.BlenderWorker drives it from plain Python.
+
+Requests: {"jsonrpc": "2.0", "id": 1, "method": "episode", "params": {"knot": "pretzel", "seed": 0, "out_dir": "jobs/0"}}
+  episode params: knot (trajectories/<knot>.json), seed, num_loosens (5), render_frames (true), out_dir (relative to the worker's
+  --out_dir), knot_seed (0), legacy_json, record, analytic_passes, engine, resolution ("WxH"); flags default to the worker's
+  environment methods (see rope_env.py and vec_env.py): "env_spec" {rgb}, "env_make" {obs_path, num_envs, slot, rgb, max_steps},
+  "env_reset" {knot, seed, knot_seed}, "env_step" {pull_idx, hold_idx, action_vec}, "env_close"
+  other methods: "ping", "shutdown"
+Responses: {"jsonrpc": "2.0", "id": 1, "result": {...}} or {"jsonrpc": "2.0", "id": 1, "error": {"code": ..., "message": ..., "data": traceback}}
+In stdio mode everything Blender prints goes to stderr, so stdout only carries a {"ready": ...} line followed by the responses.'''
+
+READY = "ready"
+
+class Worker(object):
+    def __init__(self, params, args, cameras=None):
+        self.params = params
+        self.args = args
+        self.cameras = cameras
+        self.base_dir = os.getcwd()
+        rope = get_rope("Cylinder")
+        # The pose every job starts from; the rigid body world keeps it at frame 0 once the keyframes are gone
+        self.rest_matrices = rope.read_matrices().copy()
+        self.jobs = 0
+        self.env = None
+        self.methods = {"episode": self.episode, "ping": self.ping, "env_spec": self.env_spec, "env_make": self.env_make,
+                        "env_reset": self.env_reset, "env_step": self.env_step, "env_close": self.env_close}
+
+    def reset(self):
+        # Puts the rope back where build_scene left it
+        render.reset_rope(self.rest_matrices)
+
+    def episode(self, knot, seed=None, num_loosens=5, render_frames=True, out_dir=".", knot_seed=0, legacy_json=None, record=None,
+                analytic_passes=None, engine=None, resolution=None):
+        args = self.args
+        legacy_json = args.legacy_json if legacy_json is None else legacy_json
+        record = args.record if record is None else record
+        analytic_passes = args.analytic_passes if analytic_passes is None else analytic_passes
+        engine = engine or self.params["engine"]
+        if resolution is None:
+            size = (self.params["render_width"], self.params["render_height"])
+        else:
+            size = tuple(int(v) for v in resolution.lower().split('x'))
+        if seed is not None:
+            random.seed(seed)
+            np.random.seed(seed)
+        out_dir = os.path.abspath(os.path.join(self.base_dir, out_dir))
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        os.chdir(out_dir)
+        # Metrics cover this job only, not the time the worker sat idle since the last one
+        TIMER.reset()
+        try:
+            start = time.time()
+            render.set_render_settings(engine, size, analytic_passes)
+            render.set_animation_settings(15000)
+            piece = "Cylinder"
+            views = render.open_views(self.cameras, legacy_json, piece=piece)
+            if record:
+                render.TRAJECTORY_WRITERS[piece] = render.recording.TrajectoryWriter("./trajectory", self.params["num_segments"], self.params["segment_radius"], fps=bpy.context.scene.render.fps)
+            try:
+                render.run_episode(self.params, knot, render=render_frames, mapping=views[0]["mapping"], cache_dir=args.knot_cache, knot_seed=knot_seed, num_loosens=num_loosens)
+            finally:
+                if record:
+                    render.TRAJECTORY_WRITERS.pop(piece).close()
+                render.close_views(views, legacy_json, piece)
+                self.reset()
+            metrics = TIMER.end_episode(job=self.jobs, knot=knot, seed=seed)
+            self.jobs += 1
+            view_dirs = [os.path.normpath(os.path.join(out_dir, view["out_dir"])) for view in views]
+            images = [sorted(f for f in os.listdir(os.path.join(view_dir, "images")) if f.endswith("_rgb.png")) for view_dir in view_dirs]
+            annotations_file = render.annotations.LEGACY_FILENAME if legacy_json else render.annotations.INDEX_FILENAME
+            return {"out_dir": out_dir,
+                    "frames": len(images[0]),
+                    "views": view_dirs,
+                    "images": [os.path.join(view_dir, "images", f) for view_dir, files in zip(view_dirs, images) for f in files],
+                    "annotations": [os.path.join(view_dir, "images", annotations_file) for view_dir in view_dirs],
+                    "trajectory": os.path.join(out_dir, "trajectory") if record else None,
+                    "time": time.time() - start,
+                    "metrics": metrics}
+        finally:
+            # A failed job never reaches end_episode; don't let its phases leak into the next job's metrics
+            TIMER.reset()
+            os.chdir(self.base_dir)
+
+    def ping(self):
+        return {"jobs": self.jobs}
+
+    def env_spec(self, rgb=False):
+        return rope_env.env_observation_spec(self.params, rgb)
+
+    def env_make(self, obs_path, num_envs, slot, rgb=False, max_steps=20):
+        self.env_close()
+        self.env = rope_env.RopeEnv(self.params, obs_path, num_envs, slot, rgb, max_steps, self.args.knot_cache, self.rest_matrices)
+        return {"slot": slot}
+
+    def env_reset(self, knot="pretzel", seed=None, knot_seed=0):
+        return {"info": self.env.reset(knot, seed, knot_seed)}
+
+    def env_step(self, pull_idx, hold_idx, action_vec):
+        reward, done, info = self.env.step(pull_idx, hold_idx, action_vec)
+        return {"reward": reward, "done": done, "info": info}
+
+    def env_close(self):
+        if self.env is not None:
+            self.env.close()
+            render.reset_rope(self.rest_matrices)
+            self.env = None
+        return {}
+
+    def handle(self, request):
+        # One JSON-RPC request dict -> (response dict, keep serving)
+        response = {"jsonrpc": "2.0", "id": request.get("id")}
+        method = request.get("method")
+        params = request.get("params") or {}
+        try:
+            if method == "shutdown":
+                self.env_close()
+                response["result"] = self.ping()
+                return response, False
+            elif method in self.methods:
+                response["result"] = self.methods[method](**params)
+            else:
+                response["error"] = {"code": -32601, "message": "unknown method %r" % method}
+        except Exception as e:
+            response["error"] = {"code": -32000, "message": "%s: %s" % (type(e).__name__, e), "data": traceback.format_exc()}
+        return response, True
+
+    def serve(self, lines, reply):
+        # Handles requests from an iterable of lines until EOF or "shutdown"; returns False after a shutdown
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                reply({"jsonrpc": "2.0", "id": None, "error": {"code": -32700, "message": str(e)}})
+                continue
+            response, running = self.handle(request)
+            reply(response)
+            if not running:
+                return False
+        return True
+
+def send(stream, message):
+    stream.write(json.dumps(message) + "\n")
+    stream.flush()
+
+def serve_stdio(worker):
+    # Keeps the real stdout for responses and points file descriptor 1 at stderr, so render logs can't corrupt the protocol
+    sys.stdout.flush()
+    rpc_out = os.fdopen(os.dup(1), 'w')
+    os.dup2(2, 1)
+    send(rpc_out, {READY: True, "pid": os.getpid()})
+    worker.serve(sys.stdin, lambda message: send(rpc_out, message))
+
+def serve_socket(worker, port):
+    # Serves one connection at a time on localhost (bpy is single threaded, so jobs would queue up anyway)
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(("127.0.0.1", port))
+    server.listen(1)
+    print("Worker listening on 127.0.0.1:%d" % port, flush=True)
+    running = True
+    while running:
+        conn, _ = server.accept()
+        with conn, conn.makefile('r') as rfile, conn.makefile('w') as wfile:
+            send(wfile, {READY: True, "pid": os.getpid()})
+            running = worker.serve(rfile, lambda message: send(wfile, message))
+    server.close()
+
+if __name__ == '__main__':
+    parser = render.worker_arg_parser()
+    parser.add_argument('--port', type=int, default=None) # Serve on 127.0.0.1:port instead of stdin/stdout
+    args = parser.parse_args(render.script_argv())
+    if args.seed is not None:
+        random.seed(args.seed)
+        np.random.seed(args.seed)
+    params = render.load_params(args.engine, args.resolution, args.settle_threshold, args.settle_window)
+    cameras = render.build_scene(params, args.rig, args.direct_rig, args.cameras, args.random_cameras, args.camera_seed)
+    if not os.path.exists(args.out_dir):
+        os.makedirs(args.out_dir)
+    if args.knot_cache is not None:
+        args.knot_cache = os.path.abspath(args.knot_cache)
+    os.chdir(args.out_dir)
+    TIMER.configure(metrics_path=os.path.abspath(args.metrics) if args.metrics else None, profile_phases=[p for p in args.profile.split(',') if p])
+    render.make_table(params)
+    worker = Worker(params, args, cameras)
+    if args.port is None:
+        serve_stdio(worker)
+    else:
+        serve_socket(worker, args.port)
+    TIMER.dump_profiles()
@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import socket
+import argparse
+import subprocess
+
+'''Usage: python worker_client.py --knots pretzel figure_eight --episodes 4 [--out_dir jobs] [--port 5005]
+Client for worker.py: starts one long-lived headless Blender worker (or connects to one already serving on --port) and runs
+episode jobs on it one after the other, so Blender start-up and scene building are paid once instead of once per run.'''
+
+class WorkerError(Exception):
+    def __init__(self, error):
+        super(WorkerError, self).__init__(error.get("message"))
+        self.code = error.get("code")
+        self.traceback = error.get("data")
+
+class BlenderWorker(object):
+    def __init__(self, blender='blender', worker_args=(), port=None, log=None, cwd=None, wait=True):
+        # Launches blender -b -P worker.py -- worker_args and talks JSON-RPC over its stdin/stdout; with port, connects to a
+        # worker started separately with --port instead. Blender's own output goes to log (a path; None inherits stderr).
+        # wait=False returns right away (e.g. to start several workers in parallel); call wait_ready() before the first request
+        self.proc = None
+        self.sock = None
+        self.next_id = 0
+        if port is None:
+            stderr = None if log is None else open(log, 'w')
+            cmd = [blender, '-b', '-P', 'worker.py', '--'] + list(worker_args)
+            self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=stderr, universal_newlines=True, bufsize=1, cwd=cwd)
+            self.rfile, self.wfile = self.proc.stdout, self.proc.stdin
+        else:
+            self.sock = socket.create_connection(("127.0.0.1", port))
+            self.rfile, self.wfile = self.sock.makefile('r'), self.sock.makefile('w')
+        self.info = self.wait_ready() if wait else None
+
+    def wait_ready(self):
+        # Blender prints its banner to stdout before worker.py takes it over, so skip anything before the ready line
+        for line in self.rfile:
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(message, dict) and message.get("ready"):
+                self.info = message
+                return message
+        raise WorkerError({"message": "worker exited before it was ready"})
+
+    def submit(self, method, **params):
+        # Sends a request without waiting for its response; returns the request id
+        self.next_id += 1
+        self.wfile.write(json.dumps({"jsonrpc": "2.0", "id": self.next_id, "method": method, "params": params}) + "\n")
+        self.wfile.flush()
+        return self.next_id
+
+    def receive(self):
+        # Blocks for the next response; returns its result or raises WorkerError
+        line = self.rfile.readline()
+        if not line:
+            raise WorkerError({"message": "worker closed the connection"})
+        response = json.loads(line)
+        if "error" in response:
+            raise WorkerError(response["error"])
+        return response["result"]
+
+    def call(self, method, **params):
+        self.submit(method, **params)
+        return self.receive()
+
+    def episode(self, knot, **params):
+        # Runs one episode (see worker.py for the parameters) and returns its result: out_dir, frames, images, annotations, time, metrics
+        return self.call("episode", knot=knot, **params)
+
+    def close(self):
+        if self.proc is not None:
+            if self.proc.poll() is None:
+                self.call("shutdown")
+            self.proc.wait()
+        elif self.sock is not None:
+            self.rfile.close()
+            self.wfile.close()
+            self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--knots', type=str, nargs='+', default=['pretzel', 'figure_eight'])
+    parser.add_argument('--episodes', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--num_loosens', type=int, default=5)
+    parser.add_argument('--out_dir', type=str, default='jobs') # Episode k goes to out_dir/episode_<k>
+    parser.add_argument('--blender', type=str, default='blender')
+    parser.add_argument('--port', type=int, default=None)
+    parser.add_argument('--log', type=str, default=None)
+    args, worker_args = parser.parse_known_args() # Anything else is passed on to worker.py (e.g. --analytic_passes --rig braid)
+    start = time.time()
+    with BlenderWorker(args.blender, worker_args, port=args.port, log=args.log) as worker:
+        print("Worker ready after %.1fs" % (time.time()-start))
+        for k in range(args.episodes):
+            knot = args.knots[k % len(args.knots)]
+            result = worker.episode(knot, seed=args.seed + k, num_loosens=args.num_loosens, out_dir=os.path.join(os.path.abspath(args.out_dir), "episode_%03d" % k))
+            print("Episode %d (%s): %d frames in %.1fs -> %s" % (k, knot, result["frames"], result["time"], result["out_dir"]))
+    print("Time:", time.time()-start)